@@ -0,0 +1,28 @@
+"""Compares the median timings of two benchmark results::
+
+    python benchmarks/compare.py before.json after.json
+"""
+import json
+import sys
+
+
+def load(filename):
+    with open(filename) as fp:
+        return {r['name']: r for r in json.load(fp)['results'] if 'median' in r}
+
+
+def main(before, after):
+    old, new = load(before), load(after)
+    print("%-45s %12s %12s %8s" % ('benchmark', 'before', 'after', 'ratio'))
+    for name in sorted(set(old) | set(new)):
+        a = old.get(name, {}).get('median')
+        b = new.get(name, {}).get('median')
+        ratio = '%.2fx' % (b / a) if a and b else '-'
+        print("%-45s %12s %12s %8s" % (
+            name[:45], '%.4fs' % a if a else '-', '%.4fs' % b if b else '-', ratio))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit(__doc__)
+    main(*sys.argv[1:])
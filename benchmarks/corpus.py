@@ -0,0 +1,98 @@
+"""Synthetic recipe trees for benchmarks.
+
+Recipes are written as JSON, which is valid YAML and much faster to
+generate. Usage::
+
+    python benchmarks/corpus.py <root> --recipes 10000 --nested-leaves 100000
+"""
+import argparse
+import json
+import math
+import os
+import random
+
+
+WORDS = (
+    'taxi trips census weather genome images text speech sensor traffic '
+    'flights stocks reviews movies books network graph energy health crime'
+).split()
+
+
+def make_recipe(i, rng, files=3):
+    words = rng.sample(WORDS, 4)
+    name = 'dataset-%07d-%s' % (i, words[0])
+    return {
+        'name': name,
+        'description': 'Synthetic %s dataset about %s.' % (' '.join(words[:2]), ' and '.join(words[2:])),
+        'homepage': 'http://example.com/%s' % name,
+        'keywords': words,
+        'files': [
+            {'name': 'part-%d' % j, 'url': 'http://example.com/%s/part-%d.csv' % (name, j)}
+            for j in range(files)
+        ],
+    }
+
+
+def make_nested_recipe(name, leaves, depth=3, fanout=None):
+    """Returns a recipe with ``leaves`` files nested ``depth`` levels deep."""
+    fanout = fanout or max(2, int(math.ceil(leaves ** (1.0 / depth))))
+    counter = [0]
+
+    def level(remaining_depth, path):
+        if remaining_depth == 0 or counter[0] >= leaves:
+            counter[0] += 1
+            return {
+                'name': path[-1],
+                'url': 'http://example.com/%s/%s.csv.gz' % (name, '/'.join(path)),
+            }
+        children = []
+        for i in range(fanout):
+            if counter[0] >= leaves:
+                break
+            children.append(level(remaining_depth - 1, path + ['%s%d' % ('abcdefgh'[len(path) % 8], i)]))
+        return {'name': path[-1], 'files': children}
+
+    files = level(depth, [name])['files']
+    return {'name': name, 'description': 'Nested dataset with %d files.' % leaves, 'files': files}
+
+
+def generate(root, recipes=1000, nested_leaves=0, nested_depth=3, seed=0):
+    """Writes ``recipes`` synthetic recipes into ``root``.
+
+    With ``nested_leaves``, one more recipe named ``nested`` holds that many
+    files in a ``nested_depth`` deep hierarchy. Returns the recipe names.
+    """
+    rng = random.Random(seed)
+    if not os.path.exists(root):
+        os.makedirs(root)
+    names = []
+    for i in range(recipes):
+        recipe = make_recipe(i, rng)
+        _write(root, recipe)
+        names.append(recipe['name'])
+    if nested_leaves:
+        recipe = make_nested_recipe('nested', nested_leaves, depth=nested_depth)
+        _write(root, recipe)
+        names.append(recipe['name'])
+    return names
+
+
+def _write(root, recipe):
+    with open(os.path.join(root, recipe['name'] + '.yaml'), 'w') as fp:
+        json.dump(recipe, fp)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('root')
+    parser.add_argument('--recipes', type=int, default=1000)
+    parser.add_argument('--nested-leaves', type=int, default=0)
+    parser.add_argument('--nested-depth', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    names = generate(args.root, args.recipes, args.nested_leaves, args.nested_depth, args.seed)
+    print("Generated %d recipes in %s" % (len(names), args.root))
+
+
+if __name__ == '__main__':
+    main()
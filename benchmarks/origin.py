@@ -0,0 +1,178 @@
+"""Local HTTP and FTP stand-ins for remote dataset origins.
+
+The HTTP origin serves the files of a directory with optional support for
+byte ranges, a per-connection bandwidth limit and injected failures (the
+connection is dropped after sending some bytes). The FTP origin requires
+``pyftpdlib``.
+"""
+import email.utils
+import os
+import re
+import threading
+import time
+
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class OriginRequestHandler(SimpleHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._send(head=True)
+
+    def do_GET(self):
+        self._send(head=False)
+
+    def _send(self, head):
+        origin = self.server.origin
+        origin.count('requests')
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        stat = os.stat(path)
+        size = stat.st_size
+        etag = '"%x-%x"' % (size, int(stat.st_mtime * 1000))
+        start, end, status = 0, size - 1, 200
+        range_header = self.headers.get('Range')
+        if origin.accept_ranges and range_header and self.headers.get('If-Range', etag) == etag:
+            match = re.match(r'bytes=(\d+)-(\d*)$', range_header)
+            if match:
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(int(match.group(2)), size - 1)
+                if start >= size:
+                    self.send_response(416)
+                    self.send_header('Content-Range', 'bytes */%d' % size)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                status = 206
+                origin.count('range_requests')
+        self.send_response(status)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', email.utils.formatdate(stat.st_mtime, usegmt=True))
+        if origin.accept_ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, size))
+        self.end_headers()
+        if head:
+            return
+
+        fail_after = origin.take_failure()
+        sent = 0
+        started = time.time()
+        with open(path, 'rb') as fp:
+            if fail_after is None and not origin.rate:
+                # Fast enough not to be the bottleneck of the client.
+                self.wfile.flush()
+                self.connection.sendfile(fp, start, end - start + 1)
+                origin.count('bytes_sent', end - start + 1)
+                return
+            fp.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = fp.read(min(remaining, 64 * 1024))
+                if not chunk:
+                    break
+                if fail_after is not None and sent + len(chunk) > fail_after:
+                    self.wfile.write(chunk[:fail_after - sent])
+                    origin.count('bytes_sent', fail_after - sent)
+                    origin.count('failures')
+                    self.close_connection = True
+                    return
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                remaining -= len(chunk)
+                origin.count('bytes_sent', len(chunk))
+                if origin.rate:
+                    delay = sent / float(origin.rate) - (time.time() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+
+
+class HTTPOrigin(object):
+    """Serves ``root`` over HTTP on a free local port.
+
+    ``rate`` limits each connection to that many bytes per second. The first
+    ``failures`` responses drop the connection after ``fail_after`` bytes.
+    """
+
+    def __init__(self, root, accept_ranges=True, rate=None, failures=0, fail_after=0):
+        self.root = root
+        self.accept_ranges = accept_ranges
+        self.rate = rate
+        self.failures = failures
+        self.fail_after = fail_after
+        self.stats = {}
+        self.lock = threading.Lock()
+
+        class Handler(OriginRequestHandler):
+            def __init__(self, *args, **kwargs):
+                kwargs['directory'] = root
+                super(Handler, self).__init__(*args, **kwargs)
+
+        self.server = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.origin = self
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+
+    def count(self, key, value=1):
+        with self.lock:
+            self.stats[key] = self.stats.get(key, 0) + value
+
+    def take_failure(self):
+        with self.lock:
+            if self.failures > 0:
+                self.failures -= 1
+                return self.fail_after
+
+    def url(self, name):
+        host, port = self.server.server_address
+        return 'http://%s:%d/%s' % (host, port, name)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FTPOrigin(object):
+    """Serves ``root`` over anonymous FTP on a free local port."""
+
+    def __init__(self, root):
+        from pyftpdlib.authorizers import DummyAuthorizer
+        from pyftpdlib.handlers import FTPHandler
+        from pyftpdlib.servers import ThreadedFTPServer
+
+        authorizer = DummyAuthorizer()
+        authorizer.add_anonymous(root)
+        handler = type('Handler', (FTPHandler,), {'authorizer': authorizer})
+        self.server = ThreadedFTPServer(('127.0.0.1', 0), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+
+    def url(self, name):
+        host, port = self.server.address
+        return 'ftp://%s:%d/%s' % (host, port, name)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.close_all()
@@ -0,0 +1,228 @@
+"""Scalability benchmarks of databrewer.
+
+Generates a synthetic recipe corpus, times the index, lookup and file
+matching operations and the downloads from a local origin, and writes the
+results as JSON so they can be compared across commits::
+
+    python benchmarks/run.py --recipes 10000 --nested-leaves 100000 -o before.json
+    python benchmarks/compare.py before.json after.json
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import corpus
+import origin
+
+from databrewer import recipes, utils
+from databrewer.catalog import Catalog, CatalogWriter
+from databrewer.manifest import RecipeManifest
+from databrewer.search import SearchIndex
+
+
+QUERIES = ['taxi', 'weather census', 'genome OR speech', 'traffic AND flights']
+PATTERNS = ['nested[b0][c0][d0]', 'nested[b1]*', 'nested[*][c1]*', '*']
+
+
+class Benchmark(object):
+
+    def __init__(self, repeat=3):
+        self.repeat = repeat
+        self.results = []
+
+    def time(self, name, func, repeat=None, **extra):
+        """Runs ``func`` and records its timings. Returns the last result."""
+        times = []
+        for _ in range(repeat or self.repeat):
+            started = time.perf_counter()
+            result = func()
+            times.append(time.perf_counter() - started)
+        times.sort()
+        record = dict(extra, name=name, times=times, min=times[0], median=times[len(times) // 2])
+        if extra.get('bytes'):
+            record['throughput'] = extra['bytes'] / record['median']
+        self.results.append(record)
+        print("%-40s %10.4fs%s" % (name, record['median'], " %8.1f MB/s" % (
+            record['throughput'] / 1e6) if 'throughput' in record else ''), file=sys.stderr)
+        return result
+
+
+def bench_index(bench, workdir, args):
+    recipes_dir = os.path.join(workdir, 'recipes')
+    index_dir = os.path.join(workdir, 'index')
+    os.makedirs(index_dir)
+    names = bench.time('corpus.generate', lambda: corpus.generate(
+        recipes_dir, args.recipes, args.nested_leaves, seed=args.seed), repeat=1,
+        recipes=args.recipes, nested_leaves=args.nested_leaves)
+    filenames = recipes.scan(recipes_dir)
+
+    parsed = bench.time('recipes.load_all', lambda: [
+        recipe for _, recipe, _ in recipes.load_all(filenames)], repeat=1, n=len(filenames))
+
+    def update():
+        with SearchIndex(index_dir, force_create=True) as index:
+            index.update(parsed)
+    bench.time('SearchIndex.update', update, repeat=1, n=len(parsed))
+
+    def write_catalog():
+        writer = CatalogWriter(index_dir)
+        for recipe in parsed:
+            writer.add(recipe)
+        writer.commit()
+    bench.time('CatalogWriter.commit', write_catalog, repeat=1, n=len(parsed))
+
+    manifest = RecipeManifest(index_dir)
+    for filename in filenames:
+        manifest.add(filename, os.path.basename(filename))
+    bench.time('RecipeManifest.diff (no changes)', lambda: manifest.diff(filenames), n=len(filenames))
+
+    rng = random.Random(args.seed)
+    sample = rng.sample(names, min(len(names), 1000))
+    with SearchIndex(index_dir) as index:
+        for query in QUERIES:
+            bench.time('SearchIndex.search %r' % query, lambda: list(index.search(query)))
+        bench.time('SearchIndex.get', lambda: [index.get(name) for name in sample], n=len(sample))
+        results = bench.time('SearchIndex.list', lambda: list(index.list()), n=len(parsed))
+
+    with Catalog(index_dir) as catalog:
+        bench.time('Catalog.get', lambda: [catalog.get(name) for name in sample], n=len(sample))
+        bench.time('Catalog.list', lambda: list(catalog.list()), n=len(parsed))
+
+    names = [r['name'] for r in results]
+    descriptions = [r.get('description', '') for r in results]
+    bench.time('format_results', lambda: list(utils.format_results(80, names, ' - ', descriptions)),
+               n=len(names))
+
+    if args.nested_leaves:
+        nested = next(r for r in parsed if r['name'] == 'nested')
+        bench.time('recipes.iter_files (nested)', lambda: sum(1 for _ in recipes.iter_files(nested)),
+                   n=args.nested_leaves)
+        for pattern in PATTERNS:
+            bench.time('recipes.match_files %r' % pattern,
+                       lambda: sum(1 for _ in recipes.match_files(nested, pattern)),
+                       n=args.nested_leaves)
+
+
+def bench_download(bench, workdir, args):
+    root = os.path.join(workdir, 'origin')
+    os.makedirs(root)
+    size = int(args.download_size * 1024 * 1024)
+    data = os.urandom(size)
+    with open(os.path.join(root, 'data.bin'), 'wb') as fp:
+        fp.write(data)
+    digest = hashlib.sha256(data).hexdigest()
+    del data
+    target = os.path.join(workdir, 'data.bin')
+
+    def download(url, **kwargs):
+        def run():
+            if os.path.exists(target):
+                os.unlink(target)
+            utils.download_file(url, target, **kwargs)
+        return run
+
+    with origin.HTTPOrigin(root) as http:
+        bench.time('download_file http', download(http.url('data.bin')), bytes=size)
+        progress = utils.AggregateProgress(file=open(os.devnull, 'w'))
+        bench.time('download_file http progress',
+                   download(http.url('data.bin'), reporthook=progress.reporthook()), bytes=size)
+        progress.close()
+        bench.time('download_file http sha256',
+                   download(http.url('data.bin'), checksum=('sha256', digest)),
+                   bytes=size)
+        bench.time('download_file http segments=4', download(http.url('data.bin'), segments=4),
+                   bytes=size)
+
+    with origin.HTTPOrigin(root, rate=args.connection_rate) as http:
+        bench.time('download_file http throttled', download(http.url('data.bin')), repeat=1,
+                   bytes=size, connection_rate=args.connection_rate)
+        bench.time('download_file http throttled segments=4',
+                   download(http.url('data.bin'), segments=4), repeat=1,
+                   bytes=size, connection_rate=args.connection_rate)
+
+    with origin.HTTPOrigin(root, accept_ranges=False) as http:
+        bench.time('download_file http no ranges segments=4',
+                   download(http.url('data.bin'), segments=4), bytes=size)
+
+    # The first response is cut in half, the second call must resume.
+    with origin.HTTPOrigin(root, failures=1, fail_after=size // 2) as http:
+        def resume():
+            for _ in range(2):
+                try:
+                    utils.download_file(http.url('data.bin'), target)
+                    return
+                except Exception:
+                    pass
+            raise RuntimeError("download did not resume")
+        if os.path.exists(target):
+            os.unlink(target)
+        bench.time('download_file http resume after failure', resume, repeat=1, bytes=size)
+        bench.results[-1]['bytes_sent'] = http.stats.get('bytes_sent', 0)
+        bench.results[-1]['range_requests'] = http.stats.get('range_requests', 0)
+
+    try:
+        ftp = origin.FTPOrigin(root)
+    except ImportError:
+        bench.results.append({'name': 'download_file ftp', 'skipped': 'pyftpdlib not installed'})
+    else:
+        with ftp:
+            bench.time('download_file ftp', download(ftp.url('data.bin')), bytes=size)
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--recipes', type=int, default=1000)
+    parser.add_argument('--nested-leaves', type=int, default=10000)
+    parser.add_argument('--download-size', type=float, default=64, help="MiB")
+    parser.add_argument('--connection-rate', type=int, default=4 * 1024 * 1024,
+                        help="Bytes per second of each throttled connection")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-downloads', action='store_true')
+    parser.add_argument('-o', '--output', help="JSON output file, defaults to stdout")
+    args = parser.parse_args()
+
+    bench = Benchmark(repeat=args.repeat)
+    workdir = tempfile.mkdtemp(prefix='databrewer-bench-')
+    try:
+        bench_index(bench, workdir, args)
+        if not args.skip_downloads:
+            bench_download(bench, workdir, args)
+    finally:
+        shutil.rmtree(workdir)
+
+    report = {
+        'meta': {
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': time.time(),
+            'args': vars(args),
+        },
+        'results': bench.results,
+    }
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+"""Python API to look up the recipes and open the dataset files.
+
+The functions use the default configuration, the same the command line
+uses. Create a ``Library`` to use another one::
+
+    from databrewer import api
+
+    recipe = api.get_recipe('iris')
+    with api.open('iris') as buf:
+        frame = pandas.read_csv(io.BytesIO(buf))
+
+Files are downloaded on first use and opened as read-only memory maps, so
+they can be handed to ``numpy.frombuffer`` without copying them::
+
+    data = numpy.frombuffer(api.open('iris'), dtype=numpy.uint8)
+
+The array keeps the map open until it is garbage collected. Closing the map
+while the array uses it raises ``BufferError``.
+"""
+import io
+import mmap
+import os
+
+from . import recipes
+from .catalog import Catalog, FileTable
+from .config import as_list, download_options, get_config
+from .utils import pooled_session
+
+
+class Library(object):
+    """Recipes and datasets of a configuration."""
+
+    def __init__(self, config=None):
+        self.config = config or get_config()
+        self._catalog = None
+        self._files = None
+        self._index = None
+        self._session = None
+
+    def close(self):
+        for name in ('_catalog', '_files', '_index'):
+            obj = getattr(self, name)
+            if obj is not None:
+                obj.close()
+                setattr(self, name, None)
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_recipe(self, name):
+        """Returns the recipe summary with the given name or ``None``.
+
+        The summary has the ``file_count`` and ``total_size`` of the recipe
+        instead of its files tree. Use ``files`` or ``resolve`` to list the
+        files.
+        """
+        catalog = self._get_catalog()
+        if catalog is not None:
+            return catalog.get(name)
+        recipe = self._get_index().get(name)
+        if recipe is not None:
+            return recipes.summarize(recipe)
+
+    def list(self):
+        """Yields the name and description of every recipe."""
+        catalog = self._get_catalog()
+        if catalog is not None:
+            return catalog.list()
+        return self._get_index().list(fields=('name', 'description'))
+
+    def search(self, query, limit=100, offset=0, fields=None):
+        """Yields the recipes matching ``query``, see ``SearchIndex.search``."""
+        return self._get_index().search(query, limit=limit, offset=offset, fields=fields)
+
+    def files(self, recipe, pattern=None):
+        """Yields the file specs of ``recipe`` matching the optional ``pattern``."""
+        index_dir = self.config['index_dir']
+        if self._files is None and FileTable.exists(index_dir):
+            self._files = FileTable(index_dir)
+        if self._files is not None and self._files.has_files(recipe['name']):
+            return self._files.files(recipe['name'], pattern)
+        if 'file_count' in recipe:
+            # A catalog summary, the files tree is only kept in the index.
+            if not recipe['file_count']:
+                return iter(())
+            recipe = self._get_index().get(recipe['name'])
+        if pattern:
+            return recipes.match_files(recipe, pattern)
+        return recipes.iter_files(recipe)
+
+    def is_empty(self):
+        """Returns whether ``databrewer update`` has not indexed any recipe."""
+        catalog = self._get_catalog()
+        if catalog is not None:
+            return not len(catalog)
+        return self._get_index().index.is_empty()
+
+    def preload(self):
+        """Opens the catalog, the files table and the search index ahead of use."""
+        self._get_catalog()
+        if self._files is None and FileTable.exists(self.config['index_dir']):
+            self._files = FileTable(self.config['index_dir'])
+        # Opens the searcher shared by the searches.
+        self._get_index().searcher
+
+    def resolve(self, name_spec):
+        """Returns the file specs selected by ``name_spec``.
+
+        A bare recipe name selects all its files. Each spec has the local
+        ``path`` of the file, which may not have been downloaded yet.
+        Raises ``LookupError`` if the recipe does not exist.
+        """
+        name = name_spec.partition('[')[0]
+        recipe = self.get_recipe(name)
+        if recipe is None:
+            raise LookupError("Recipe '%s' not found" % name)
+        pattern = '*' if name == name_spec else name_spec
+        dest_dir = os.path.join(self.config['datasets_dir'], recipe['name'])
+        specs = []
+        for spec in self.files(recipe, pattern):
+            spec['path'] = os.path.join(dest_dir, spec['filename'])
+            if recipe.get('restricted'):
+                spec['restricted'] = True
+            specs.append(spec)
+        return specs
+
+    def open(self, name_spec, download=True, mmap=True):
+        """Returns a read-only buffer of the single file selected by ``name_spec``.
+
+        The file is downloaded first if needed, unless ``download`` is
+        false. With ``mmap`` false, or for empty files, a binary file object
+        is returned instead of a memory map.
+        """
+        specs = self.resolve(name_spec)
+        if len(specs) != 1:
+            raise LookupError("'%s' matches %d files, expected one" % (name_spec, len(specs)))
+        spec = specs[0]
+        path = spec['path']
+        if not os.path.exists(path):
+            if not download:
+                raise IOError("File '%s' has not been downloaded" % path)
+            if spec.get('restricted'):
+                raise IOError("File '%s' is restricted and cannot be downloaded" % spec['name'])
+            ranking = self._get_ranking()
+            try:
+                recipes.download(spec, os.path.dirname(path), quiet=True,
+                                 session=self._get_session(), store=self._get_store(),
+                                 ranking=ranking, peers=as_list(self.config['peers']),
+                                 **download_options(self.config))
+            finally:
+                ranking.save()
+        if mmap and os.path.getsize(path):
+            return _mmap_file(path)
+        return io.open(path, 'rb')
+
+    def _get_catalog(self):
+        if self._catalog is None and Catalog.exists(self.config['index_dir']):
+            self._catalog = Catalog(self.config['index_dir'])
+        return self._catalog
+
+    def _get_index(self):
+        if self._index is None:
+            from .search import SearchIndex
+            self._index = SearchIndex(self.config['index_dir'])
+        return self._index
+
+    def _get_store(self):
+        if self.config['store_mode'] != 'off':
+            from .store import BlobStore
+            return BlobStore(self.config['store_dir'], link_mode=self.config['store_mode'])
+
+    def _get_ranking(self):
+        from .mirrors import MirrorRanking
+        return MirrorRanking(self.config['mirrors_file'])
+
+    def _get_session(self):
+        if self._session is None:
+            self._session = pooled_session(timeout=download_options(self.config)['timeout'])
+        return self._session
+
+
+def _mmap_file(path):
+    with io.open(path, 'rb') as fp:
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+_library = None
+
+
+def _default_library():
+    global _library
+    if _library is None:
+        _library = Library()
+    return _library
+
+
+def get_recipe(name):
+    """Returns the recipe summary with the given name or ``None``."""
+    return _default_library().get_recipe(name)
+
+
+def resolve(name_spec):
+    """Returns the file specs selected by ``name_spec``, see ``Library.resolve``."""
+    return _default_library().resolve(name_spec)
+
+
+def open(name_spec, download=True, mmap=True):
+    """Opens the file selected by ``name_spec``, see ``Library.open``."""
+    return _default_library().open(name_spec, download=download, mmap=mmap)
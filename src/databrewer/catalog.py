@@ -0,0 +1,261 @@
+"""Compact, memory-mapped catalog of recipes.
+
+The catalog is a single file with the encoded recipes followed by a table of
+names sorted for binary search::
+
+    header   magic, table offset, number of entries
+    records  JSON encoded recipes
+    table    (key offset, key length, name length, record offset, record length)
+    keys     name + NUL + description, for each entry
+
+It allows to look up a recipe or to list all the names and descriptions
+without opening the search index. The files table uses the same layout to
+store the flattened file specs of every recipe, keyed by their full name.
+Its descriptions hold the name of the owning recipe and the position of the
+file in it, separated by a NUL.
+"""
+import itertools
+import json
+import mmap
+import os
+import re
+import struct
+
+from fnmatch import translate
+
+from .recipes import iter_files, pattern_prefix, translate_pattern
+
+
+MAGIC = b'DBCAT001'
+FILES_MAGIC = b'DBFIL001'
+HEADER = struct.Struct('<8sQI')
+ENTRY = struct.Struct('<QIIQI')
+
+
+class Catalog(object):
+
+    filename = 'catalog.bin'
+    magic = MAGIC
+
+    def __init__(self, index_dir):
+        self.path = os.path.join(index_dir, self.filename)
+        with open(self.path, 'rb') as fp:
+            self.data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.table_offset, self.count = HEADER.unpack_from(self.data, 0)
+        if magic != self.magic:
+            self.close()
+            raise ValueError("invalid %s file: %s" % (self.__class__.__name__, self.path))
+
+    @classmethod
+    def exists(cls, index_dir):
+        return os.path.exists(os.path.join(index_dir, cls.filename))
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.data.close()
+
+    def get(self, name):
+        """Returns the recipe with the given name or ``None``."""
+        payload = self.get_payload(name)
+        if payload is not None:
+            return json.loads(payload.decode('utf-8'))
+
+    def get_payload(self, name):
+        key = name.encode('utf-8')
+        i = self._bisect(key)
+        if i < self.count and self._name(i) == key:
+            _, _, _, offset, length = self._entry(i)
+            return self.data[offset:offset + length]
+
+    def prefixed(self, prefix):
+        """Yields the entries whose name starts with ``prefix``, sorted by name."""
+        key = prefix.encode('utf-8')
+        for i in range(self._bisect(key), self.count):
+            if not self._name(i).startswith(key):
+                break
+            yield self._item(i)
+
+    def list(self):
+        """Yields the name and description of every recipe, sorted by name."""
+        for i in range(self.count):
+            key_offset, key_length, name_length, _, _ = self._entry(i)
+            name_end = key_offset + name_length
+            yield {
+                'name': self.data[key_offset:name_end].decode('utf-8'),
+                'description': self.data[name_end + 1:key_offset + key_length].decode('utf-8'),
+            }
+
+    def items(self):
+        """Yields the name, description and encoded recipe of every entry."""
+        for i in range(self.count):
+            yield self._item(i)
+
+    def _item(self, i):
+        key_offset, key_length, name_length, offset, length = self._entry(i)
+        name_end = key_offset + name_length
+        return (self.data[key_offset:name_end].decode('utf-8'),
+                self.data[name_end + 1:key_offset + key_length].decode('utf-8'),
+                self.data[offset:offset + length])
+
+    def _bisect(self, key):
+        """Returns the position of the first entry not lower than ``key``."""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._name(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _entry(self, i):
+        return ENTRY.unpack_from(self.data, self.table_offset + i * ENTRY.size)
+
+    def _name(self, i):
+        key_offset, _, name_length, _, _ = self._entry(i)
+        return self.data[key_offset:key_offset + name_length]
+
+
+class FileTable(Catalog):
+    """Flattened file specs of every recipe, sorted by their full name.
+
+    The description of each entry holds the name of the recipe owning the
+    file and its position in the recipe, so the files of a recipe are found
+    with range lookups instead of walking its tree. The entries are yielded
+    as ``(name, owner, position, payload)``.
+    """
+
+    filename = 'files.bin'
+    magic = FILES_MAGIC
+
+    def has_files(self, recipe):
+        """Returns whether the table has any file of the given recipe."""
+        entries = itertools.chain(self.named(recipe), self.prefixed(recipe + '['))
+        return any(owner == recipe for _, owner, _, _ in entries)
+
+    def files(self, recipe, pattern=None):
+        """Yields the file specs of a recipe matching the optional pattern.
+
+        The files are yielded in the order of the recipe.
+        """
+        match = None
+        prefixes = [recipe + '[']
+        if pattern:
+            match = re.compile(translate(translate_pattern(pattern))).match
+            literal = pattern_prefix(pattern)
+            if literal.startswith(recipe + '['):
+                prefixes = [literal]
+        entries = [self.named(recipe)] + [self.prefixed(prefix) for prefix in prefixes]
+        found = sorted((position, payload)
+                       for name, owner, position, payload in itertools.chain(*entries)
+                       if owner == recipe and (match is None or match(name)))
+        for _, payload in found:
+            yield json.loads(payload.decode('utf-8'))
+
+    def named(self, name):
+        """Yields the entries of the files with the given full name."""
+        key = name.encode('utf-8')
+        for i in range(self._bisect(key), self.count):
+            if self._name(i) != key:
+                break
+            yield self._item(i)
+
+    def _item(self, i):
+        name, description, payload = Catalog._item(self, i)
+        owner, _, position = description.partition('\0')
+        return name, owner, int(position), payload
+
+
+class CatalogWriter(object):
+    """Writes a new catalog, replacing the current one on commit."""
+
+    table = Catalog
+
+    def __init__(self, index_dir):
+        self.path = os.path.join(index_dir, self.table.filename)
+        self.tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        self.fp = open(self.tmp_path, 'wb')
+        self.fp.write(HEADER.pack(self.table.magic, 0, 0))
+        # Name and description, record offset and length, by sort key.
+        self.entries = {}
+
+    def add(self, recipe):
+        payload = json.dumps(recipe, separators=(',', ':')).encode('utf-8')
+        self.add_payload(recipe['name'], str(recipe.get('description') or ''), payload)
+
+    def add_payload(self, name, description, payload):
+        self._add_entry(name.encode('utf-8'), name, description, payload)
+
+    def _add_entry(self, key, name, description, payload):
+        offset = self.fp.tell()
+        self.fp.write(payload)
+        self.entries[key] = (name.encode('utf-8'), description.encode('utf-8'),
+                             offset, len(payload))
+
+    def __contains__(self, name):
+        return name.encode('utf-8') in self.entries
+
+    def commit(self):
+        table_offset = self.fp.tell()
+        keys_offset = table_offset + len(self.entries) * ENTRY.size
+        keys = []
+        for sort_key in sorted(self.entries):
+            name, description, offset, length = self.entries[sort_key]
+            key = name + b'\0' + description
+            self.fp.write(ENTRY.pack(keys_offset, len(key), len(name), offset, length))
+            keys_offset += len(key)
+            keys.append(key)
+        self.fp.write(b''.join(keys))
+        self.fp.seek(0)
+        self.fp.write(HEADER.pack(self.table.magic, table_offset, len(self.entries)))
+        self.fp.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self.fp.close()
+        if os.path.exists(self.tmp_path):
+            os.unlink(self.tmp_path)
+
+
+class FileTableWriter(CatalogWriter):
+    """Writes a new files table, replacing the current one on commit."""
+
+    table = FileTable
+
+    def __init__(self, index_dir):
+        super(FileTableWriter, self).__init__(index_dir)
+        self.recipes = set()
+
+    def add(self, recipe, files=None):
+        """Adds the files of a recipe, or the given expanded file specs.
+
+        Raises ``ValueError`` if the files of the recipe cannot be expanded.
+        """
+        if files is None:
+            # Expand the whole tree first so a broken recipe adds no files.
+            files = tuple(iter_files(recipe))
+        owner = recipe['name']
+        if owner in self.recipes:
+            # A recipe added again replaces its files.
+            self.entries = {key: entry for key, entry in self.entries.items()
+                            if key[1] != owner}
+        self.recipes.add(owner)
+        for position, spec in enumerate(files):
+            payload = json.dumps(spec, separators=(',', ':')).encode('utf-8')
+            self.add_payload(spec['name'], owner, payload, position)
+
+    def add_payload(self, name, owner, payload, position=0):
+        # The position keeps the files with the same full name apart.
+        self._add_entry((name.encode('utf-8'), owner, position), name,
+                        '%s\0%d' % (owner, position), payload)
+
+    def __contains__(self, name):
+        return name in self.recipes
@@ -1,23 +1,39 @@
+import contextlib
 import functools
 import itertools
+import json
 import os
 import shutil
 import sys
 import tempfile
-import zipfile
 
 import click
 import click.termui
-import requests
-import toolz
-
-from tqdm import tqdm
 
 from . import recipes
-from .config import get_config, dump_config, DEFAULT_RECIPES_DIR
-from .search import SearchIndex
-from .utils import abspath, ensure_dir, format_results, download_file
+from .api import Library
+from .catalog import Catalog, CatalogWriter, FileTable, FileTableWriter
+from .config import (as_list, config_key, daemon_socket, download_options, get_config,
+                     dump_config, DEFAULT_DAEMON_SOCKET, DEFAULT_RECIPES_DIR)
+from .manifest import RecipeManifest
+from .utils import (abspath, ensure_dir, format_results, download_if_modified, parse_size,
+                    pooled_session)
+
+
+# Heavy modules (requests, tqdm, whoosh, zipfile) are imported by the commands
+# using them to keep the start up fast.
+
+# Validators and members of the last downloaded recipes archive.
+ARCHIVE_STATE_FILE = '.archive.json'
+
+# Below this number of recipe files, starting processes costs more than parsing.
+PARALLEL_PARSE_MIN_FILES = 100
 
+# Commands answered by ``databrewer daemon`` when it is running.
+DAEMON_COMMANDS = ('list', 'search', 'info', 'files')
+
+# Width of the names column of the search results printed as they are read.
+SEARCH_NAME_WIDTH = 30
 
 CONTEXT_SETTINGS = {
     'default_map': {
@@ -37,8 +53,6 @@ CONTEXT_SETTINGS = {
 def cli(ctx, debug, pager, quiet, rcfile, root_dir, recipes_dir, datasets_dir):
     ctx.obj['use_pager'] = pager
     ctx.obj['quiet'] = quiet
-    # TODO: add timeout.
-    ctx.obj['requests'] = requests.Session()
     override = {}
     if root_dir:
         override['root_dir'] = abspath(root_dir)
@@ -46,8 +60,18 @@ def cli(ctx, debug, pager, quiet, rcfile, root_dir, recipes_dir, datasets_dir):
         override['datasets_dir'] = abspath(datasets_dir)
     if recipes_dir:
         override['recipes_dir'] = abspath(recipes_dir)
+    ctx.obj['config_args'] = (rcfile, override)
+
+    if ctx.invoked_subcommand in DAEMON_COMMANDS and os.path.exists(daemon_socket()):
+        # The configuration is loaded if the daemon does not answer.
+        ctx.obj['daemon'] = config_key(rcfile, override)
+        return
+    _load_config(ctx.obj)
+
 
-    rc = ctx.obj['rc'] = get_config(rcfile, override=override)
+def _load_config(obj):
+    rcfile, override = obj['config_args']
+    rc = obj['rc'] = get_config(rcfile, override=dict(override))
 
     ensure_dir(rc['root_dir'])
     ensure_dir(rc['index_dir'])
@@ -58,40 +82,184 @@ def requires_index(func):
     @functools.wraps(func)
     def wrapper(obj, *args, **kwargs):
         assert isinstance(obj, dict)
-        rc = obj['rc']
-        if SearchIndex.is_empty(rc['index_dir']):
-            _fail("Index is empty. Run 'databrewer update'")
-        return func(obj, *args, **kwargs)
+        with _reading_index():
+            if 'daemon' not in obj:
+                _check_index(obj)
+            return func(obj, *args, **kwargs)
     return wrapper
 
 
+@contextlib.contextmanager
+def _reading_index():
+    try:
+        yield
+    except ValueError as e:
+        from .search import OutdatedIndexError
+        if isinstance(e, OutdatedIndexError):
+            _fail("Index is outdated. Run 'databrewer update'")
+        raise
+
+
+def _from_daemon(obj, command, **args):
+    """Returns the result of a command run by the daemon, or ``None``.
+
+    Without the daemon the configuration is loaded to run the command here.
+    """
+    key = obj.pop('daemon', None)
+    if key is not None and command is not None:
+        from .daemon import request
+        try:
+            reply = request(daemon_socket(), command, args, key)
+        except (IOError, ValueError):
+            pass
+        else:
+            if 'error' in reply:
+                _fail(reply['error'])
+            return reply['result']
+    if 'rc' not in obj:
+        _load_config(obj)
+        _check_index(obj)
+
+
+def _check_index(obj):
+    if _get_library(obj).is_empty():
+        _fail("Index is empty. Run 'databrewer update'")
+
+
 @cli.command(name='update')
 @click.option('--recreate/--no-recreate', default=False)
+@click.option('--jobs', '-j', type=click.IntRange(1), metavar='<n>',
+              help="Number of processes to parse recipes. Defaults to the number of CPUs.")
 @click.pass_obj
-def cli_update(obj, recreate):
+def cli_update(obj, recreate, jobs):
     rc = obj['rc']
     # TODO: Handle the defaults recipes downloading in a better way.
-    _download_recipes(DEFAULT_RECIPES_DIR, rc['recipes_default_url'], quiet=obj['quiet'])
+    _download_recipes(DEFAULT_RECIPES_DIR, rc['recipes_default_url'], quiet=obj['quiet'],
+                      session=_get_session(obj))
 
     recipes_dir = rc['recipes_dir']
     if recipes_dir:
-        index = SearchIndex(rc['index_dir'], force_create=recreate)
-        specs = itertools.chain.from_iterable(
-            recipes.list(dir) for dir in recipes_dir
+        from .search import OutdatedIndexError, SearchIndex
+        try:
+            index = SearchIndex(rc['index_dir'], force_create=recreate)
+        except OutdatedIndexError:
+            # An index with an outdated schema is rebuilt from scratch.
+            recreate = True
+            index = SearchIndex(rc['index_dir'], force_create=True)
+        click.get_current_context().find_root().call_on_close(index.close)
+        fresh = recreate or index.index.is_empty()
+        if fresh:
+            manifest = RecipeManifest(rc['index_dir'])
+        else:
+            manifest = RecipeManifest.load(rc['index_dir'])
+        filenames = itertools.chain.from_iterable(
+            recipes.scan(dir) for dir in recipes_dir
         )
+        changed, removed = manifest.diff(filenames)
+        deleted = set()
+        for entry in removed:
+            manifest.remove(entry['path'])
+            deleted.add(entry['name'])
+        # Several files may define the same name. The remaining ones are
+        # parsed again, so the name is kept when a removed or renamed file
+        # defined it too.
+        dropped = deleted | set(manifest.entries[filename]['name']
+                                for filename, _ in changed if filename in manifest.entries)
+        reparsed = set(filename for filename, _ in changed)
+        for filename in manifest.paths(dropped):
+            if filename not in reparsed:
+                changed.append((filename, manifest.entries[filename]['hash']))
+
+        digests = dict(changed)
+        catalog = CatalogWriter(rc['index_dir'])
+        files = FileTableWriter(rc['index_dir'])
+        if len(changed) < PARALLEL_PARSE_MIN_FILES:
+            jobs = 1
+
+        def parse(filenames):
+            for filename, recipe, error in recipes.load_all(filenames, jobs=jobs):
+                if error:
+                    click.echo("Could not load '%s': %s" % (filename, error), err=True)
+                    continue
+                digest = digests[filename]
+                previous = manifest.entries.get(filename)
+                if previous and previous['name'] != recipe['name']:
+                    deleted.add(previous['name'])
+                manifest.add(filename, recipe['name'], digest)
+                _add_recipe(catalog, files, recipe)
+                yield recipe
+
+        specs = parse(filename for filename, _ in changed)
+        if changed and not obj.get('quiet'):
+            from tqdm import tqdm
+            specs = tqdm(specs, desc='Indexing', unit=' recipes', total=len(changed))
+        try:
+            updated, removed = index.update(specs, deleted=deleted,
+                                            optimize_segments=int(rc['index_optimize_segments']))
+            if (updated or removed or fresh or not Catalog.exists(rc['index_dir']) or
+                    not FileTable.exists(rc['index_dir'])):
+                _fill_catalog(catalog, files, rc['index_dir'], index, deleted, fresh)
+                catalog.commit()
+                files.commit()
+            else:
+                catalog.abort()
+                files.abort()
+        except BaseException:
+            catalog.abort()
+            files.abort()
+            raise
+        manifest.save()
         if not obj.get('quiet'):
-            specs = tqdm(specs, desc='Indexing', unit=' recipes')
-        index.update(specs)
+            click.echo("Updated %d recipes, removed %d." % (updated, removed))
     else:
         _fail("No recipes directories found.")
 
 
+def _fill_catalog(catalog, files, index_dir, index, deleted, fresh):
+    """Adds the recipes not updated in this run to the new catalog and files table."""
+    if not fresh and Catalog.exists(index_dir) and FileTable.exists(index_dir):
+        # Copy the unchanged records without decoding them.
+        with Catalog(index_dir) as previous:
+            for name, description, payload in previous.items():
+                if name not in catalog and name not in deleted:
+                    catalog.add_payload(name, description, payload)
+        with FileTable(index_dir) as previous:
+            for name, owner, position, payload in previous.items():
+                if owner not in files and owner not in deleted:
+                    files.add_payload(name, owner, payload, position)
+    else:
+        for recipe in index.list():
+            if recipe['name'] not in catalog:
+                _add_recipe(catalog, files, recipe)
+
+
+def _add_recipe(catalog, files, recipe):
+    """Adds the recipe summary to the catalog and its files to the files table."""
+    try:
+        specs = tuple(recipes.iter_files(recipe))
+    except ValueError as e:
+        click.echo("Could not list the files of '%s': %s" % (recipe['name'], e), err=True)
+        specs = None
+    catalog.add(recipes.summarize(recipe, specs))
+    if specs is not None:
+        files.add(recipe, specs)
+
+
+def _get_library(obj):
+    """Returns the recipes and datasets of the configuration, opened once per invocation."""
+    if 'library' not in obj:
+        obj['library'] = Library(obj['rc'])
+        click.get_current_context().find_root().call_on_close(obj['library'].close)
+    return obj['library']
+
+
 @cli.command(name='list')
 @click.pass_obj
 @requires_index
 def cli_list(obj):
-    index = SearchIndex(obj['rc']['index_dir'])
-    results = index.list()
+    results = _from_daemon(obj, 'list')
+    if results is None:
+        results = _get_library(obj).list()
     output = _list_format(results)
     if output:
         _echo(output)
@@ -101,20 +269,50 @@ def cli_list(obj):
 
 @cli.command('search')
 @click.argument('query', nargs=-1)
+@click.option('--limit', '-n', default=100, metavar='<n>', type=click.IntRange(0),
+              help="Maximum number of results, 0 for no limit.")
+@click.option('--offset', default=0, metavar='<n>', type=click.IntRange(0),
+              help="Number of results to skip.")
+@click.option('--page', '-p', metavar='<n>', type=click.IntRange(1),
+              help="Page of results to show, of --limit results each.")
+@click.option('--names-only', is_flag=True, help="Print only the names of the recipes.")
 @click.pass_obj
 @requires_index
-def cli_search(obj, query):
-    index = SearchIndex(obj['rc']['index_dir'])
-    results = index.search(' '.join(query))
-    output = _list_format(results)
-    if output:
-        _echo(output)
+def cli_search(obj, query, limit, offset, page, names_only):
+    if page is not None:
+        if not limit:
+            _fail("--page requires a --limit")
+        offset = (page - 1) * limit
+    fields = ('name',) if names_only else ('name', 'description')
+    results = _from_daemon(obj, 'search', query=' '.join(query), limit=limit or None,
+                           offset=offset, fields=fields)
+    if results is None:
+        results = _get_library(obj).search(' '.join(query), limit=limit or None,
+                                           offset=offset, fields=fields)
+    if obj.get('use_pager') and not names_only:
+        output = _list_format(results)
+        found = bool(output)
+        if found:
+            _echo(output)
     else:
+        # Print each result as soon as it is read.
+        found = False
+        term_width = _terminal_width()
+        for result in results:
+            if names_only:
+                click.echo(result['name'])
+            else:
+                for line in format_results(term_width, [result['name']], ' - ',
+                                           [result.get('description') or ''],
+                                           key_width=SEARCH_NAME_WIDTH):
+                    click.echo(line)
+            found = True
+    if not found:
         _fail("No datasets found.")
 
 
 def _list_format(specs):
-    values = list(toolz.pluck(['name', 'description'], specs))
+    values = [(spec['name'], spec.get('description') or '') for spec in specs]
     if values:
         names, descs = zip(*values)
         return '\n'.join(format_results(_terminal_width(), names, ' - ', descs))
@@ -123,13 +321,18 @@ def _list_format(specs):
 @cli.command(name='info')
 @click.argument('name_spec')
 @click.option('--check/--no-check', default=False)
+@click.option('--jobs', '-j', default=8, metavar='<n>', type=click.IntRange(1),
+              help="Number of files to check at the same time.")
 @click.pass_obj
 @requires_index
-def cli_info(obj, name_spec, check):
-    datasets_dir = obj['rc']['datasets_dir']
-    index = SearchIndex(obj['rc']['index_dir'])
+def cli_info(obj, name_spec, check, jobs):
     name = name_spec.partition('[')[0]
-    recipe = index.get(name)
+    # Checking the files needs the configuration anyway.
+    reply = _from_daemon(obj, None if check else 'info', name=name)
+    if reply is not None:
+        recipe, datasets_dir = reply['recipe'], reply['datasets_dir']
+    else:
+        recipe, datasets_dir = _get_library(obj).get_recipe(name), obj['rc']['datasets_dir']
     fields = ('name', 'description', 'homepage')
     if recipe:
         term_width = _terminal_width()
@@ -140,36 +343,60 @@ def cli_info(obj, name_spec, check):
             titles.append('Keywords:')
             values.append(', '.join(recipe['keywords']))
 
+        from tqdm import tqdm
+        if reply is not None:
+            files = reply['files']
+        else:
+            files = list(tqdm(_get_library(obj).files(recipe), unit=" files", leave=False))
+        if check:
+            from .remote import MetadataCache, probe_all
+            urls = [spec['url'] for spec in files
+                    if not spec.get('restricted') and spec['url'].startswith('http')]  # no ftp support
+            cache = MetadataCache(obj['rc']['remote_cache_file'],
+                                  ttl=int(obj['rc']['remote_cache_ttl']))
+            metas = probe_all(urls, session=_get_session(obj, pool_size=jobs),
+                              jobs=jobs, cache=cache)
+            total_size, unknown = 0, 0
+            for spec in files:
+                meta = metas.get(spec['url'])
+                if meta and meta['status'] == 200 and meta['length'] is not None:
+                    total_size += meta['length']
+                else:
+                    unknown += 1
+            titles.append('Size:')
+            size = tqdm.format_sizeof(total_size, 'b')
+            values.append(size + (' (%d files of unknown size)' % unknown if unknown else ''))
+
         output.extend(format_results(term_width, titles, ' ', values))
         # Files section.
         output.append("\nFiles:")
         rows = []
-        for spec in tqdm(recipes.iter_files(recipe), unit=" files", leave=False):
+        for spec in files:
             url_info = spec['url']
             if check:
                 if spec.get('restricted'):
                     url_extra = 'restricted'
                 else:
                     url_extra = 'unknown'
-                if not spec.get('restricted') and spec['url'].startswith('http'):  # no ftp support
-                    r = obj['requests'].head(spec['url'], timeout=3)
-                    if r.ok:
-                        if r.status_code == 200:
-                            length = r.headers.get('content-length')
-                            if length:
-                                url_extra = tqdm.format_sizeof(int(length), 'b')
-                            else:
-                                url_extra = 'unknown'
-                        else:
-                            url_extra = 'status:%s' % r.status_code
-                    else:
+                meta = metas.get(spec['url'])
+                if meta:
+                    if meta['status'] is None or meta['status'] >= 400:
                         url_extra = 'check-failed'
+                    elif meta['status'] == 200:
+                        if meta['length'] is not None:
+                            url_extra = tqdm.format_sizeof(meta['length'], 'b')
+                    else:
+                        url_extra = 'status:%s' % meta['status']
                 url_info = "%s [%s]" % (url_info, url_extra)
             rows.append(['  %(name)s' % spec, url_info])
+            checksum = recipes.get_checksum(spec)
+            if checksum:
+                rows.append(['', '%s:%s' % checksum])
             local_path = os.path.join(datasets_dir, name, spec['filename'])
             if os.path.exists(local_path):
+                if recipes.is_verified(spec, local_path):
+                    local_path += ' [verified]'
                 rows.append(['', local_path])
-            # TODO: Add checksum fields.
         file_fields, file_values = zip(*rows)
         output.extend(format_results(0, file_fields, ' - ', file_values))
         _echo("\n".join(output) + "\n")
@@ -178,42 +405,197 @@ def cli_info(obj, name_spec, check):
 
 
 @cli.command(name='download')
-@click.argument('name_spec')
+@click.argument('name_specs', nargs=-1, required=True, metavar='NAME_SPEC...')
 @click.option('--output-dir')
 @click.option('--force/--no-force', default=False)
+@click.option('--jobs', '-j', default=4, metavar='<n>', type=click.IntRange(1),
+              help="Number of files to download at the same time.")
+@click.option('--segments', '-s', default=1, metavar='<n>', type=click.IntRange(1),
+              help="Number of connections to download each large file.")
+@click.option('--per-host', metavar='<n>', type=click.IntRange(0),
+              help="Maximum connections to each host, 0 for no limit.")
+@click.option('--rate', metavar='<size>',
+              help="Maximum bandwidth per second, e.g. 500K or 10M. 0 for no limit.")
+@click.option('--extract/--no-extract', default=None,
+              help="Extract the archives while they are downloaded. Defaults to the recipe.")
+@click.option('--keep-archive/--no-keep-archive', default=None,
+              help="Keep the archives once extracted. Defaults to the recipe, or keep.")
 @click.pass_obj
 @requires_index
-def cli_download(obj, name_spec, output_dir, force):
-    index = SearchIndex(obj['rc']['index_dir'])
-    datasets_dir = obj['rc']['datasets_dir']
-    name = name_spec.partition('[')[0]
-    if name == name_spec:
-        # download all files
-        name_spec = '*'
-    recipe = index.get(name)
-    if recipe:
+def cli_download(obj, name_specs, output_dir, force, jobs, segments, per_host, rate,
+                 extract, keep_archive):
+    rc = obj['rc']
+    library = _get_library(obj)
+    selected = []
+    seen = set()
+    for name_spec in name_specs:
+        name = name_spec.partition('[')[0]
+        if name == name_spec:
+            # download all files
+            name_spec = '*'
+        recipe = library.get_recipe(name)
+        if not recipe:
+            _fail("Recipe '%s' not found" % name)
+        files = list(library.files(recipe, name_spec))
+        if not files:
+            _fail("Specified file '%s' not found" % name_spec)
+        if recipe.get('restricted'):
+            _fail("Dataset '%s' is restricted and cannot be downloaded automatically" % name)
         if not output_dir:
-            output_dir = os.path.join(datasets_dir, recipe['name'])
-        files = list(recipes.match_files(recipe, name_spec))
-        if files:
-            file_names = ['  %s' % spec['name'] for spec in files]
-            file_urls = [spec['url'] for spec in files]
-            click.echo("Selected Files:")
-            click.echo('\n'.join(format_results(0, file_names, ' - ', file_urls)) + '\n')
-            if recipe.get('restricted'):
-                _fail("Dataset is restricted and cannot be downloaded automatically")
-
-            if force or click.confirm("Confirm to download all the listed files", default=True):
-                for spec in files:
-                    output_file = os.path.join(output_dir, spec['filename'])
-                    if not force and os.path.exists(output_file):
-                        click.echo("File '%s' already exists. Skipping." % spec['filename'])
-                        continue
-                    recipes.download(spec, output_dir, quiet=obj['quiet'])
+            dest_dir = os.path.join(rc['datasets_dir'], recipe['name'])
+        elif len(name_specs) > 1:
+            dest_dir = os.path.join(output_dir, recipe['name'])
         else:
-            _fail("Specified file not found")
-    else:
-        _fail("Recipe not found")
+            dest_dir = output_dir
+        for spec in files:
+            # Overlapping specs select the same file, it is downloaded once.
+            path = os.path.join(dest_dir, spec['filename'])
+            if path not in seen:
+                seen.add(path)
+                selected.append((spec, dest_dir))
+
+    file_names = ['  %s' % spec['name'] for spec, _ in selected]
+    file_urls = [spec['url'] for spec, _ in selected]
+    click.echo("Selected Files:")
+    click.echo('\n'.join(format_results(0, file_names, ' - ', file_urls)) + '\n')
+
+    if force or click.confirm("Confirm to download all the listed files", default=True):
+        pending = []
+        for spec, dest_dir in selected:
+            if not force and recipes.is_downloaded(spec, dest_dir):
+                click.echo("File '%s' already exists. Skipping." % spec['filename'])
+                continue
+            pending.append((spec, dest_dir))
+        from .scheduler import Scheduler
+        if per_host is None:
+            per_host = int(rc['download_per_host'])
+        try:
+            rate = parse_size(rc['download_rate'] if rate is None else rate)
+        except ValueError as e:
+            _fail(str(e))
+        scheduler = Scheduler(workers=jobs, per_host=per_host or None, rate=rate or None)
+        session = _get_session(obj, pool_size=jobs * segments)
+        ranking = _get_ranking(rc)
+        results = recipes.download_many(pending, scheduler, quiet=obj['quiet'],
+                                        session=session, segments=segments,
+                                        extract=extract, keep_archive=keep_archive,
+                                        store=_get_store(rc), ranking=ranking,
+                                        peers=as_list(rc['peers']), force=force,
+                                        **download_options(rc))
+        try:
+            _download_summary(results, scheduler)
+        finally:
+            ranking.save()
+
+
+def _download_summary(results, scheduler=None):
+    names, statuses = [], []
+    failed = 0
+    for spec, error in results:
+        names.append('  %s' % spec['name'])
+        if error is None:
+            statuses.append('ok')
+        else:
+            failed += 1
+            statuses.append('failed: %s' % error)
+    if names:
+        click.echo("\nSummary:")
+        click.echo('\n'.join(format_results(0, names, ' - ', statuses)))
+        if scheduler is not None and scheduler.bytes:
+            from tqdm import tqdm
+            click.echo("\nDownloaded %s at %s/s" % (
+                tqdm.format_sizeof(scheduler.bytes, 'b'),
+                tqdm.format_sizeof(scheduler.throughput(), 'b')))
+    if failed:
+        _fail("%d of %d files failed to download" % (failed, len(names)))
+
+
+@cli.command(name='sync')
+@click.argument('name_specs', nargs=-1, metavar='[NAME_SPEC...]')
+@click.option('--lockfile', '-f', default='databrewer.lock', metavar='<path>',
+              help="Lockfile to read, or to write with --freeze.")
+@click.option('--freeze', is_flag=True,
+              help="Pin the files of the given datasets in the lockfile.")
+@click.option('--jobs', '-j', default=4, metavar='<n>', type=click.IntRange(1),
+              help="Number of files to download at the same time.")
+@click.option('--dry-run', is_flag=True, help="List the files to download and exit.")
+@click.pass_obj
+def cli_sync(obj, name_specs, lockfile, freeze, jobs, dry_run):
+    """Downloads the missing or changed files pinned in a lockfile."""
+    from . import lockfile as lockfiles
+    rc = obj['rc']
+    datasets_dir = rc['datasets_dir']
+    cache = lockfiles.HashCache(rc['hash_cache_file'])
+    if freeze:
+        if not name_specs:
+            _fail("Give the datasets to pin in the lockfile")
+        library = _get_library(obj)
+        selected = []
+        with _reading_index():
+            _check_index(obj)
+            for name_spec in name_specs:
+                name = name_spec.partition('[')[0]
+                recipe = library.get_recipe(name)
+                if not recipe:
+                    _fail("Recipe '%s' not found" % name)
+                pattern = '*' if name == name_spec else name_spec
+                selected.extend((recipe['name'], spec) for spec in library.files(recipe, pattern))
+        entries = lockfiles.freeze(selected, datasets_dir, cache)
+        lockfiles.save(lockfile, entries)
+        cache.save()
+        click.echo("Pinned %d files in %s" % (len(entries), lockfile))
+        return
+    if name_specs:
+        _fail("Datasets are only given with --freeze")
+
+    try:
+        entries = lockfiles.load(lockfile)
+    except (IOError, OSError, ValueError, KeyError) as e:
+        _fail("Could not read lockfile '%s': %s" % (lockfile, e))
+    pending = lockfiles.stale(entries, datasets_dir, cache)
+    cache.save()
+    if not pending:
+        click.echo("All %d files are up to date." % len(entries))
+        return
+    click.echo("Downloading %d of %d files." % (len(pending), len(entries)))
+    if dry_run:
+        for entry in pending:
+            click.echo(os.path.join(datasets_dir, entry['path']))
+        return
+
+    from .scheduler import Scheduler
+    scheduler = Scheduler(workers=jobs, per_host=int(rc['download_per_host']) or None,
+                          rate=parse_size(rc['download_rate']) or None)
+    downloads = [(entry, os.path.dirname(os.path.join(datasets_dir, entry['path'])))
+                 for entry in pending]
+    ranking = _get_ranking(rc)
+    results = recipes.download_many(downloads, scheduler, quiet=obj['quiet'],
+                                    session=_get_session(obj, pool_size=jobs),
+                                    store=_get_store(rc), ranking=ranking,
+                                    peers=as_list(rc['peers']), **download_options(rc))
+
+    def check(results):
+        for entry, error in results:
+            path = os.path.join(datasets_dir, entry['path'])
+            # Archives removed once extracted are not checked.
+            if error is not None or not os.path.isfile(path):
+                yield entry, error
+                continue
+            if entry.get('size') is not None:
+                size = os.path.getsize(path)
+                if size != entry['size']:
+                    error = ValueError("size mismatch: expected %d, got %d"
+                                       % (entry['size'], size))
+            if error is None and entry.get('sha256'):
+                # Verified while downloaded.
+                cache.set(path, entry['sha256'].lower())
+            yield entry, error
+
+    try:
+        _download_summary(check(results), scheduler)
+    finally:
+        cache.save()
+        ranking.save()
 
 
 @cli.command(name='files')
@@ -221,23 +603,79 @@ def cli_download(obj, name_spec, output_dir, force):
 @click.pass_obj
 @requires_index
 def cli_files(obj, name_spec):
-    index = SearchIndex(obj['rc']['index_dir'])
     name = name_spec.partition('[')[0]
-    recipe = index.get(name)
-    if not recipe:
-        _fail("Recipe '%s' not found" % name)
-
-    datasets_dir = obj['rc']['datasets_dir']
-    get_location = toolz.partial(os.path.join, datasets_dir, name)
-
-    files = list(recipes.match_files(recipe, name_spec))
-    if files:
-        for spec in files:
-            click.echo(get_location(spec['filename']))
+    paths = _from_daemon(obj, 'files', name_spec=name_spec)
+    if paths is None:
+        library = _get_library(obj)
+        recipe = library.get_recipe(name)
+        if not recipe:
+            _fail("Recipe '%s' not found" % name)
+        get_location = functools.partial(os.path.join, obj['rc']['datasets_dir'], name)
+        paths = [get_location(spec['filename']) for spec in library.files(recipe, name_spec)]
+    if paths:
+        for path in paths:
+            click.echo(path)
     else:
         _fail("File '%s' not found" % name_spec)
 
 
+@cli.command(name='serve')
+@click.option('--host', default='127.0.0.1', metavar='<host>',
+              help="Address to listen on, 0.0.0.0 for all the interfaces.")
+@click.option('--port', '-p', default=8750, metavar='<port>', type=click.IntRange(0, 65535))
+@click.pass_obj
+def cli_serve(obj, host, port):
+    """Shares the downloaded datasets and the recipe index over HTTP.
+
+    Other nodes download the files from this one before their origin when
+    its url is in their ``peers`` configuration.
+    """
+    from .serve import DatasetServer
+    rc = obj['rc']
+    server = DatasetServer(rc['datasets_dir'], rc['index_dir'], (host, port))
+    click.echo("Serving %s on %s/" % (rc['datasets_dir'], server.url()))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+@cli.command(name='daemon')
+@click.option('--socket', 'socket_path', metavar='<path>',
+              help="Socket to listen on. Defaults to $DATABREWER_DAEMON_SOCKET or %s."
+              % DEFAULT_DAEMON_SOCKET)
+@click.pass_obj
+def cli_daemon(obj, socket_path):
+    """Answers the list, search, info and files commands from memory.
+
+    The commands use the daemon when it listens on their socket and has the
+    same configuration. The index is reloaded when it changes.
+    """
+    from .daemon import DaemonServer
+    rcfile, override = obj['config_args']
+    try:
+        server = DaemonServer(socket_path or daemon_socket(), rcfile, override)
+    except (IOError, ValueError) as e:
+        _fail(str(e))
+    if not obj['quiet']:
+        click.echo("Listening on %s" % server.path)
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    # Stopped by service managers, the socket is removed on exit.
+    import signal
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
 @cli.group(name='config')
 @click.pass_obj
 def cli_config(obj):
@@ -255,6 +693,29 @@ def main(*args, **kwargs):
     return cli.main(*args, **kwargs)
 
 
+def _get_session(obj, pool_size=None):
+    """Returns the HTTP session, created on first use."""
+    timeout = download_options(obj['rc'])['timeout']
+    if obj.get('requests') is None:
+        obj['requests'] = pooled_session(timeout=timeout)
+    if pool_size:
+        pooled_session(obj['requests'], pool_size=pool_size, timeout=timeout)
+    return obj['requests']
+
+
+def _get_store(rc):
+    """Returns the downloaded files store, or ``None`` if it is disabled."""
+    if rc['store_mode'] != 'off':
+        from .store import BlobStore
+        return BlobStore(rc['store_dir'], link_mode=rc['store_mode'])
+
+
+def _get_ranking(rc):
+    """Returns the mirrors ranking, kept between runs."""
+    from .mirrors import MirrorRanking
+    return MirrorRanking(rc['mirrors_file'])
+
+
 def _fail(message, retcode=1):
     click.echo(message, sys.stderr)
     click.get_current_context().find_root().exit(retcode)
@@ -274,28 +735,82 @@ def _terminal_width():
     return width
 
 
-def _download_recipes(recipes_dir, url, quiet=True):
+def _download_recipes(recipes_dir, url, quiet=True, session=None):
+    """Refreshes the recipes extracted from the archive at ``url``.
+
+    The archive is requested conditionally with the validators of the last
+    download and only the changed members are extracted.
+    """
     recipes_dir = abspath(recipes_dir)
     ensure_dir(recipes_dir)
-    recipes_zip = tempfile.mktemp()
-    download_file(
-        url, recipes_zip, quiet=quiet, reporthook_kwargs={
-            'desc': "Downloading default recipes",
-        },
-    )
+    state_file = os.path.join(recipes_dir, ARCHIVE_STATE_FILE)
+    state = {}
+    if os.path.exists(state_file):
+        with open(state_file) as fp:
+            state = json.load(fp)
+    validators = None
+    members = state.get('members', [])
+    if state.get('url') == url and all(os.path.exists(os.path.join(recipes_dir, name))
+                                       for name in members):
+        validators = state
+
+    fd, recipes_zip = tempfile.mkstemp(suffix='.zip')
+    os.close(fd)
     try:
-        _extract_files(recipes_zip, recipes_dir)
+        new_validators = download_if_modified(
+            url, recipes_zip, validators, session=session, quiet=quiet, reporthook_kwargs={
+                'desc': "Downloading default recipes",
+            },
+        )
+        if new_validators is None:
+            return
+        extracted = _extract_files(recipes_zip, recipes_dir)
     finally:
         os.unlink(recipes_zip)
 
+    # Remove the recipes no longer in the archive.
+    for name in set(members) - set(extracted):
+        path = os.path.join(recipes_dir, name)
+        if os.path.exists(path):
+            os.unlink(path)
+
+    state = dict(new_validators, url=url, members=sorted(extracted))
+    with open(state_file, 'w') as fp:
+        json.dump(state, fp)
+
 
 def _extract_files(archive_zip, target_dir):
+    """Extracts the archive files whose size or CRC differ from the ones on disk.
+
+    Returns the names of all the files in the archive.
+    """
+    import zipfile
+    names = []
     zf = zipfile.ZipFile(archive_zip)
-    for name in zf.namelist():
-        basename = os.path.basename(name)
+    for info in zf.infolist():
+        basename = os.path.basename(info.filename)
         if not basename:  # directories
             continue
-        source = zf.open(name)
-        target = open(os.path.join(target_dir, basename), 'wb')
+        names.append(basename)
+        target_path = os.path.join(target_dir, basename)
+        if _same_file(target_path, info):
+            continue
+        source = zf.open(info)
+        target = open(target_path, 'wb')
         with source, target:
             shutil.copyfileobj(source, target)
+    return names
+
+
+def _same_file(path, zinfo):
+    import zlib
+    try:
+        if os.path.getsize(path) != zinfo.file_size:
+            return False
+        with open(path, 'rb') as fp:
+            crc = 0
+            for chunk in iter(lambda: fp.read(64 * 1024), b''):
+                crc = zlib.crc32(chunk, crc)
+    except OSError:
+        return False
+    return crc & 0xffffffff == zinfo.CRC
@@ -2,9 +2,8 @@ import logging
 import os
 
 import six
-import jsonschema
 
-from .utils import abspath, load_yaml, dump_yaml
+from .utils import abspath, load_yaml, dump_yaml, parse_size
 
 
 logger = logging.getLogger(__name__)
@@ -22,6 +21,18 @@ CONFIG_SCHEMA = {
                 {'type': 'array', 'items': {'type': 'string'}},
             ],
         },
+        'remote_cache_ttl': {'type': 'integer', 'minimum': 0},
+        'index_optimize_segments': {'type': 'integer', 'minimum': 1},
+        'store_mode': {'enum': ['off', 'hardlink', 'symlink']},
+        'download_per_host': {'type': 'integer', 'minimum': 0},
+        'download_rate': {'type': ['integer', 'string']},
+        'peers': {'type': 'array', 'items': {'type': 'string'}},
+        'download_connect_timeout': {'type': 'number', 'minimum': 0, 'exclusiveMinimum': True},
+        'download_read_timeout': {'type': 'number', 'minimum': 0, 'exclusiveMinimum': True},
+        'download_low_speed_limit': {'type': ['integer', 'string']},
+        'download_low_speed_time': {'type': 'number', 'minimum': 0, 'exclusiveMinimum': True},
+        'download_retries': {'type': 'integer', 'minimum': 0},
+        'download_backoff': {'type': 'number', 'minimum': 0},
     },
 }
 
@@ -30,10 +41,36 @@ CONFIG_DEFAULTS = {
     'datasets_dir': '~/.databrewer/datasets',
     'recipes_dir': '~/.databrewer/recipes',
     'recipes_default_url': 'https://github.com/rolando/databrewer-recipes/archive/master.zip',
+    # Seconds to trust the cached metadata of remote files.
+    'remote_cache_ttl': 86400,
+    # Merge the index into a single segment once it has this many segments.
+    'index_optimize_segments': 10,
+    # Keep the downloaded files in a content-addressed store under root_dir
+    # and link them into the datasets directory: off, hardlink or symlink.
+    'store_mode': 'off',
+    # Connections to each host and bytes per second (e.g. 10M) for all the
+    # downloads, 0 for no limit.
+    'download_per_host': 4,
+    'download_rate': 0,
+    # Urls of the ``databrewer serve`` instances to download files from
+    # before trying their origin.
+    'peers': [],
+    # Seconds to wait for a connection and for data from the server.
+    'download_connect_timeout': 10,
+    'download_read_timeout': 60,
+    # Abort the transfers slower than the limit in bytes per second (e.g.
+    # 10K) for that many seconds, 0 to disable.
+    'download_low_speed_limit': 0,
+    'download_low_speed_time': 30,
+    # Times a failed download is retried, resuming where it left off, and
+    # seconds to wait before the first retry, doubled on each one.
+    'download_retries': 3,
+    'download_backoff': 1,
 }
 
 DEFAULT_RECIPES_DIR = abspath(CONFIG_DEFAULTS['recipes_dir'])
 DEFAULT_USERRC = '~/.databrewerrc'
+DEFAULT_DAEMON_SOCKET = '~/.databrewer/daemon.sock'
 
 _missing = object()
 
@@ -49,6 +86,29 @@ class Config(dict):
         return super(Config, self).__getitem__(key)
 
 
+def daemon_socket():
+    """Returns the path of the ``databrewer daemon`` socket."""
+    return abspath(os.getenv('DATABREWER_DAEMON_SOCKET') or DEFAULT_DAEMON_SOCKET)
+
+
+def config_key(path=None, override=None, envname='DATABREWERRC'):
+    """Returns what ``get_config`` builds the configuration from.
+
+    It is the file, the overrides and the environment variables, without
+    loading the file.
+    """
+    envfile = os.getenv(envname)
+    if envfile and os.path.exists(envfile):
+        path = envfile
+    env = dict((key, val) for key, val in os.environ.items()
+               if key.startswith(Config.env_prefix) and key != 'DATABREWER_DAEMON_SOCKET')
+    return {
+        'path': abspath(path or DEFAULT_USERRC),
+        'override': override or {},
+        'env': env,
+    }
+
+
 def load_rc(default_rc_path,
             defaults=None,
             envname='DATABREWERRC',
@@ -64,8 +124,9 @@ def load_rc(default_rc_path,
     meta = (defaults or {}).copy()
     if os.path.exists(default_rc_path):
         meta.update(load_yaml(default_rc_path) or {})
-
-    jsonschema.validate(meta, schema)
+        # The defaults alone are known to be valid.
+        import jsonschema
+        jsonschema.validate(meta, schema)
 
     return meta
 
@@ -80,6 +141,10 @@ def get_config(path=None, override=None, defaults=CONFIG_DEFAULTS):
     cfg = Config(load_rc(abspath(path), defaults=values))
     cfg['root_dir'] = abspath(cfg['root_dir'])
     cfg['index_dir'] = os.path.join(cfg['root_dir'], 'index')
+    cfg['remote_cache_file'] = os.path.join(cfg['root_dir'], 'remote-cache.json')
+    cfg['store_dir'] = os.path.join(cfg['root_dir'], 'store')
+    cfg['hash_cache_file'] = os.path.join(cfg['root_dir'], 'hash-cache.json')
+    cfg['mirrors_file'] = os.path.join(cfg['root_dir'], 'mirrors.json')
     cfg['datasets_dir'] = abspath(cfg['datasets_dir'])
     # Ensure recipes dir is a list.
     if isinstance(cfg['recipes_dir'], six.string_types):
@@ -88,5 +153,24 @@ def get_config(path=None, override=None, defaults=CONFIG_DEFAULTS):
     return cfg
 
 
+def as_list(value):
+    """Returns a list option, given as a whitespace separated string in env vars."""
+    if isinstance(value, six.string_types):
+        return value.split()
+    return list(value)
+
+
+def download_options(cfg):
+    """Returns the ``download`` arguments for the timeouts and retries settings."""
+    limit = parse_size(cfg['download_low_speed_limit'])
+    return {
+        'timeout': (float(cfg['download_connect_timeout']),
+                    float(cfg['download_read_timeout'])),
+        'low_speed': (limit, float(cfg['download_low_speed_time'])) if limit else None,
+        'retries': int(cfg['download_retries']),
+        'backoff': float(cfg['download_backoff']),
+    }
+
+
 def dump_config(cfg):
     return dump_yaml(dict(cfg))
@@ -0,0 +1,206 @@
+"""Daemon answering the recipe lookups of the command line over a Unix socket.
+
+``databrewer daemon`` keeps the configuration, the catalog and the search
+index open, so the ``list``, ``search``, ``info`` and ``files`` commands do
+not load them on every call. Each connection carries a request and its
+reply, as JSON lines::
+
+    {"command": "search", "args": {"query": "taxi"}, "config": {...}}
+    {"result": [...]}
+
+The ``config`` of a request is the ``config_key`` of the command line. The
+daemon only answers the requests made with its own configuration, the
+command line runs the others itself. The index directory is watched and the
+index reopened once ``databrewer update`` changes it.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+
+from socketserver import StreamRequestHandler, ThreadingMixIn, UnixStreamServer
+
+from .api import Library
+from .config import config_key, get_config
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds between the checks of the index directory.
+WATCH_INTERVAL = 1
+# Seconds the command line waits for a reply before running the command itself.
+REQUEST_TIMEOUT = 10
+
+COMMANDS = ('list', 'search', 'info', 'files')
+
+
+class DaemonServer(ThreadingMixIn, UnixStreamServer):
+
+    daemon_threads = True
+
+    def __init__(self, path, rcfile=None, override=None):
+        self.path = path
+        self.key = config_key(rcfile, override)
+        self.rcfile = rcfile
+        self.override = override
+        self.lock = threading.Lock()
+        self.library = None
+        self.state = None
+        self.done = threading.Event()
+        self.refresh()
+        _remove_stale_socket(path)
+        UnixStreamServer.__init__(self, path, RequestHandler)
+        os.chmod(path, 0o600)
+        self.watcher = threading.Thread(target=self._watch)
+        self.watcher.daemon = True
+        self.watcher.start()
+
+    def refresh(self):
+        """Reloads the configuration and reopens the index if they changed."""
+        with self.lock:
+            rc_state = _file_state(self.key['path'])
+            if self.state is None or self.state[0] != rc_state:
+                config = get_config(self.rcfile, override=dict(self.override or {}))
+            else:
+                config = self.library.config
+            state = (rc_state, _dir_state(config['index_dir']))
+            if state == self.state:
+                return
+            if self.library is not None:
+                logger.info("Reloading the index")
+                self.library.close()
+            self.library = Library(config)
+            self.state = state
+            try:
+                self.library.preload()
+            except ValueError as e:
+                # Outdated index, reported on use.
+                logger.warning("Could not open the index: %s", e)
+
+    def handle(self, request):
+        """Returns the reply to a decoded request."""
+        if request.get('config') != self.key:
+            return {'mismatch': True}
+        command = request.get('command')
+        if command not in COMMANDS:
+            return {'error': "Unknown command '%s'" % command}
+        self.refresh()
+        with self.lock:
+            library = self.library
+            try:
+                if library.is_empty():
+                    return {'error': "Index is empty. Run 'databrewer update'"}
+                return {'result': getattr(self, '_' + command)(library, **request.get('args', {}))}
+            except LookupError as e:
+                return {'error': e.args[0]}
+            except ValueError:
+                return {'error': "Index is outdated. Run 'databrewer update'"}
+
+    def server_close(self):
+        self.done.set()
+        UnixStreamServer.server_close(self)
+        with self.lock:
+            if self.library is not None:
+                self.library.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _list(self, library):
+        return list(library.list())
+
+    def _search(self, library, query, limit=100, offset=0, fields=None):
+        return list(library.search(query, limit=limit, offset=offset, fields=fields))
+
+    def _info(self, library, name):
+        recipe = library.get_recipe(name)
+        return {
+            'recipe': recipe,
+            'files': list(library.files(recipe)) if recipe else [],
+            'datasets_dir': library.config['datasets_dir'],
+        }
+
+    def _files(self, library, name_spec):
+        name = name_spec.partition('[')[0]
+        recipe = library.get_recipe(name)
+        if recipe is None:
+            raise LookupError("Recipe '%s' not found" % name)
+        dest_dir = os.path.join(library.config['datasets_dir'], name)
+        return [os.path.join(dest_dir, spec['filename'])
+                for spec in library.files(recipe, name_spec)]
+
+    def _watch(self):
+        while not self.done.wait(WATCH_INTERVAL):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Could not reload the index")
+
+
+class RequestHandler(StreamRequestHandler):
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+        except ValueError:
+            reply = {'error': "Invalid request"}
+        else:
+            reply = self.server.handle(request)
+        self.wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+
+
+def request(path, command, args, key):
+    """Returns the reply of the daemon at ``path`` to a command.
+
+    Raises ``IOError`` if the daemon is not running or serves another
+    configuration than ``key``.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with sock:
+        sock.settimeout(REQUEST_TIMEOUT)
+        sock.connect(path)
+        message = {'command': command, 'args': args, 'config': key}
+        sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as fp:
+            line = fp.readline()
+    if not line:
+        raise IOError("The daemon closed the connection")
+    reply = json.loads(line.decode('utf-8'))
+    if reply.get('mismatch'):
+        raise IOError("The daemon serves another configuration")
+    return reply
+
+
+def _remove_stale_socket(path):
+    if not os.path.exists(path):
+        return
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with sock:
+        try:
+            sock.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            # Left by a daemon that did not exit cleanly.
+            os.unlink(path)
+            return
+    raise IOError("A daemon is already listening on %s" % path)
+
+
+def _file_state(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _dir_state(path):
+    """Returns the names, times and sizes of the files in ``path``."""
+    if not os.path.isdir(path):
+        return None
+    state = []
+    for entry in os.scandir(path):
+        file_state = _file_state(entry.path)
+        # Files may be removed while listed.
+        if file_state is not None and entry.is_file():
+            state.append((entry.name,) + file_state)
+    return sorted(state)
@@ -0,0 +1,226 @@
+"""Decompression and extraction of downloaded archives.
+
+Gzip, bzip2 and tar archives are extracted while they are downloaded, by
+sinks fed with the data as it is written. A sink has an ``update`` method,
+like the checksum hashers, plus ``close`` to finish the extraction and
+``abort`` to give up on it. Zip archives are extracted once downloaded, as
+their index is at the end of the file.
+"""
+import bz2
+import os
+import queue
+import shutil
+import tarfile
+import threading
+import zlib
+
+
+# Archive suffixes and their format, longest first.
+FORMATS = (
+    ('.tar.gz', 'tar'),
+    ('.tar.bz2', 'tar'),
+    ('.tgz', 'tar'),
+    ('.tbz2', 'tar'),
+    ('.tar', 'tar'),
+    ('.zip', 'zip'),
+    ('.gz', 'gz'),
+    ('.bz2', 'bz2'),
+)
+
+
+class ExtractError(ValueError):
+    """Raised when an archive cannot be extracted."""
+
+
+def archive_format(filename):
+    """Returns the archive format of ``filename`` or ``None``."""
+    lower = filename.lower()
+    for suffix, fmt in FORMATS:
+        if lower.endswith(suffix):
+            return fmt
+
+
+def decompressed_name(filename):
+    """Returns the name of a gzip or bzip2 file without its suffix."""
+    name, ext = os.path.splitext(filename)
+    return name if name else filename + '.out'
+
+
+def make_sink(filename, dest_dir):
+    """Returns the sink extracting ``filename`` into ``dest_dir``.
+
+    Returns ``None`` for zip archives, which are extracted with
+    ``extract_zip`` once downloaded.
+    """
+    fmt = archive_format(filename)
+    if fmt == 'tar':
+        return TarSink(dest_dir)
+    if fmt in ('gz', 'bz2'):
+        return DecompressSink(os.path.join(dest_dir, decompressed_name(filename)), fmt)
+    if fmt is None:
+        raise ExtractError("Unknown archive format: %s" % filename)
+
+
+def feed(sink, filename, chunk_size=1024 * 1024):
+    """Passes the contents of ``filename`` to ``sink``."""
+    with open(filename, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            sink.update(chunk)
+
+
+class DecompressSink(object):
+    """Writes the decompressed data of a gzip or bzip2 stream to a file."""
+
+    def __init__(self, filename, fmt):
+        self.fmt = fmt
+        self.fp = open(filename, 'wb')
+        self.decompressor = None
+
+    def _decompressor(self):
+        if self.fmt == 'gz':
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        return bz2.BZ2Decompressor()
+
+    def update(self, data):
+        # Concatenated streams are decompressed one after the other.
+        while data:
+            if self.decompressor is None:
+                self.decompressor = self._decompressor()
+            try:
+                self.fp.write(self.decompressor.decompress(data))
+            except (zlib.error, IOError, EOFError) as e:
+                raise ExtractError("Invalid %s stream: %s" % (self.fmt, e))
+            if not self.decompressor.eof:
+                return
+            data = self.decompressor.unused_data
+            self.decompressor = None
+
+    def close(self):
+        self.fp.close()
+        if self.decompressor is not None:
+            raise ExtractError("Truncated %s stream" % self.fmt)
+
+    def abort(self):
+        self.fp.close()
+
+
+class TarSink(object):
+    """Extracts a tar stream, optionally compressed, as it is fed.
+
+    The extraction runs in a thread reading the fed chunks from a bounded
+    queue, so at most ``max_pending`` chunks are held in memory.
+    """
+
+    def __init__(self, dest_dir, max_pending=16):
+        self.queue = queue.Queue(max_pending)
+        self.buffer = b''
+        self.offset = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._extract, args=(dest_dir,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def update(self, data):
+        # The data may be a view of a reused buffer.
+        self._put(bytes(data))
+        self._raise_error()
+
+    def close(self):
+        self._put(None)
+        self.thread.join()
+        self._raise_error()
+
+    def abort(self):
+        self._put(None)
+        self.thread.join()
+
+    def read(self, size=-1):
+        # Called by tarfile, from the extraction thread. The chunk is read
+        # from an offset, slicing off the rest would copy it on every read.
+        while self.offset >= len(self.buffer):
+            chunk = self.queue.get()
+            if chunk is None:
+                self.queue.put(None)
+                return b''
+            self.buffer, self.offset = chunk, 0
+        end = len(self.buffer) if size < 0 else self.offset + size
+        data = self.buffer[self.offset:end]
+        self.offset += len(data)
+        return data
+
+    def _put(self, data):
+        # Data is dropped once the extraction finished or failed.
+        while self.thread.is_alive():
+            try:
+                self.queue.put(data, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise ExtractError("Could not extract tar stream: %s" % self.error)
+
+    def _extract(self, dest_dir):
+        try:
+            with tarfile.open(fileobj=self, mode='r|*') as tar:
+                if hasattr(tarfile, 'data_filter'):
+                    tar.extractall(dest_dir, filter='data')
+                else:
+                    tar.extractall(dest_dir, members=_safe_members(tar, dest_dir))
+        except Exception as e:
+            self.error = e
+
+
+def _safe_members(tar, dest_dir):
+    root = os.path.realpath(dest_dir)
+    for member in tar:
+        path = os.path.realpath(os.path.join(root, member.name))
+        if not (member.isfile() or member.isdir()):
+            continue
+        if os.path.commonpath([root, path]) != root:
+            raise ExtractError("Unsafe path in archive: %s" % member.name)
+        yield member
+
+
+def extract_zip(filename, dest_dir, jobs=4):
+    """Extracts a zip archive, inflating its members in parallel.
+
+    Members are split by size among ``jobs`` threads, each reading the
+    archive with its own handle.
+    """
+    import zipfile
+    from concurrent.futures import ThreadPoolExecutor
+    try:
+        with zipfile.ZipFile(filename) as archive:
+            members = sorted(archive.infolist(), key=lambda m: m.file_size, reverse=True)
+    except zipfile.BadZipfile as e:
+        raise ExtractError("Invalid zip file %s: %s" % (filename, e))
+    groups = [members[i::jobs] for i in range(max(1, jobs))]
+
+    def _extract(group):
+        with zipfile.ZipFile(filename) as archive:
+            for member in group:
+                archive.extract(member, dest_dir)
+
+    with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+        for future in [executor.submit(_extract, group) for group in groups if group]:
+            future.result()
+
+
+def merge_tree(src, dst):
+    """Moves the contents of ``src`` into ``dst``, replacing existing files.
+
+    Returns the moved files, relative to ``dst``.
+    """
+    moved = []
+    for dirpath, dirnames, filenames in os.walk(src):
+        relpath = os.path.relpath(dirpath, src)
+        target_dir = os.path.normpath(os.path.join(dst, relpath))
+        if not os.path.isdir(target_dir):
+            os.makedirs(target_dir)
+        for name in filenames:
+            os.replace(os.path.join(dirpath, name), os.path.join(target_dir, name))
+            moved.append(os.path.normpath(os.path.join(relpath, name)))
+    shutil.rmtree(src)
+    return moved
@@ -0,0 +1,120 @@
+"""Lockfiles pinning the dataset files to download.
+
+A lockfile is a JSON document listing file specs with the path of each file
+relative to the datasets directory, and its pinned size and sha256 digest
+when known::
+
+    {"version": 1, "files": [
+        {"name": "iris[data]", "url": "...", "filename": "iris.csv",
+         "path": "iris/iris.csv", "size": 4551, "sha256": "..."}
+    ]}
+"""
+import hashlib
+import json
+import os
+
+from .recipes import get_checksum, is_downloaded, is_verified
+from .utils import load_json, write_json
+
+
+VERSION = 1
+
+
+def load(filename):
+    """Returns the file entries of a lockfile."""
+    with open(filename) as fp:
+        data = json.load(fp)
+    if data.get('version') != VERSION:
+        raise ValueError("Unsupported lockfile version: %s" % data.get('version'))
+    for entry in data['files']:
+        path = os.path.normpath(entry['path'])
+        if os.path.isabs(path) or path.split(os.sep)[0] == os.pardir:
+            raise ValueError("Invalid path in lockfile: %s" % entry['path'])
+        # The file is downloaded as its filename, next to its path.
+        if entry.get('filename') != os.path.basename(path):
+            raise ValueError("Filename of %s does not match its path" % entry['path'])
+    return data['files']
+
+
+def save(filename, entries):
+    write_json(filename, {'version': VERSION, 'files': entries}, indent=2, sort_keys=True)
+
+
+def freeze(file_specs, datasets_dir, cache):
+    """Returns the lockfile entries of ``(recipe_name, file_spec)`` pairs.
+
+    The size and digest are taken from the spec or, for files already
+    downloaded, from the local file.
+    """
+    entries = []
+    for recipe_name, spec in file_specs:
+        entry = {k: v for k, v in spec.items() if not k.startswith('_')}
+        entry['path'] = '%s/%s' % (recipe_name, spec['filename'])
+        local_path = os.path.join(datasets_dir, recipe_name, spec['filename'])
+        if os.path.isfile(local_path):
+            entry.setdefault('size', os.path.getsize(local_path))
+            entry.setdefault('sha256', cache.sha256(local_path))
+        entries.append(entry)
+    return entries
+
+
+def stale(entries, datasets_dir, cache):
+    """Returns the entries whose local file is missing or differs from the pin.
+
+    Archives removed once extracted are up to date if their extracted files
+    are listed.
+    """
+    result = []
+    for entry in entries:
+        path = os.path.join(datasets_dir, entry['path'])
+        if not os.path.isfile(path):
+            if not is_downloaded(entry, os.path.dirname(path)):
+                result.append(entry)
+        elif entry.get('size') is not None and os.path.getsize(path) != entry['size']:
+            result.append(entry)
+        elif entry.get('sha256') and cache.sha256(path) != entry['sha256'].lower():
+            result.append(entry)
+        elif not entry.get('sha256') and get_checksum(entry) and not is_verified(entry, path):
+            # Pinned with a weaker digest, trusted if recorded by download.
+            result.append(entry)
+    return result
+
+
+class HashCache(object):
+    """Persistent sha256 digests of local files, keyed by path, size and mtime."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.changed = False
+        self.entries = load_json(filename, 'hash cache', {})
+
+    def sha256(self, path):
+        """Returns the digest of ``path``, hashing it only if it changed."""
+        stat = os.stat(path)
+        entry = self.entries.get(path)
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+            return entry['sha256']
+        digest = _file_digest(path, 'sha256')
+        self.set(path, digest, stat)
+        return digest
+
+    def set(self, path, digest, stat=None):
+        stat = stat or os.stat(path)
+        self.entries[path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': digest}
+        self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        # Forget the files removed since.
+        entries = {path: entry for path, entry in self.entries.items() if os.path.exists(path)}
+        write_json(self.filename, entries)
+        self.changed = False
+
+
+def _file_digest(path, algo, chunk_size=1024 * 1024):
+    hasher = hashlib.new(algo)
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
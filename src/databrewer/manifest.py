@@ -0,0 +1,76 @@
+"""Tracks the recipe files stored in the search index."""
+import hashlib
+import os
+
+from .utils import load_json, write_json
+
+
+def file_hash(filename):
+    with open(filename, 'rb') as fp:
+        return hashlib.sha1(fp.read()).hexdigest()
+
+
+class RecipeManifest(object):
+    """Path, mtime, size and content hash of every indexed recipe file."""
+
+    filename = 'manifest.json'
+
+    def __init__(self, index_dir, entries=None):
+        self.path = os.path.join(index_dir, self.filename)
+        self.entries = entries or {}
+        self.changed = False
+
+    @classmethod
+    def load(cls, index_dir):
+        return cls(index_dir, load_json(os.path.join(index_dir, cls.filename), 'manifest'))
+
+    def save(self):
+        if not self.changed:
+            return
+        write_json(self.path, self.entries)
+        self.changed = False
+
+    def diff(self, filenames):
+        """Returns ``(changed, removed)`` recipe files.
+
+        ``changed`` lists the ``(filename, hash)`` of the new or modified
+        files given in ``filenames``, which must be parsed again. ``removed``
+        lists the manifest entries of the files no longer present. Files
+        touched without changes in their content are updated in place and are
+        not reported.
+        """
+        changed = []
+        seen = set()
+        for filename in filenames:
+            seen.add(filename)
+            stat = os.stat(filename)
+            entry = self.entries.get(filename)
+            if entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+                continue
+            digest = file_hash(filename)
+            if entry and entry['hash'] == digest:
+                entry.update(mtime=stat.st_mtime, size=stat.st_size)
+                self.changed = True
+                continue
+            changed.append((filename, digest))
+        removed = [dict(entry, path=path) for path, entry in self.entries.items()
+                   if path not in seen]
+        return changed, removed
+
+    def add(self, filename, name, digest=None):
+        stat = os.stat(filename)
+        self.entries[filename] = {
+            'name': name,
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'hash': digest or file_hash(filename),
+        }
+        self.changed = True
+
+    def paths(self, names):
+        """Returns the files defining one of the recipes in ``names``."""
+        return [path for path, entry in self.entries.items() if entry['name'] in names]
+
+    def remove(self, filename):
+        self.changed = True
+        return self.entries.pop(filename, None)
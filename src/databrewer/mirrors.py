@@ -0,0 +1,141 @@
+"""Ranking of the mirrors serving the dataset files.
+
+Hosts are ranked by the expected time to download a file from them, from
+the latency and throughput measured by probing them and by the downloads
+themselves. Failures make a host rank lower until it succeeds again. The
+measures are kept in a JSON file between runs, and hosts are probed again
+once their measures are older than ``ttl`` seconds.
+"""
+import contextlib
+import logging
+import threading
+import time
+
+from urllib.parse import urlparse
+
+from .utils import load_json, write_json
+
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from each mirror to measure its throughput.
+PROBE_SIZE = 64 * 1024
+PROBE_TIMEOUT = 5
+PROBE_TTL = 86400
+# Size assumed for the files without a declared size.
+DEFAULT_SIZE = 1024 * 1024
+# Weight of a new measure in the moving averages.
+SMOOTHING = 0.3
+
+
+class MirrorRanking(object):
+
+    def __init__(self, filename=None, ttl=PROBE_TTL):
+        self.filename = filename
+        self.ttl = ttl
+        self.hosts = {}
+        self.changed = False
+        self.lock = threading.Lock()
+        self.probe_lock = threading.Lock()
+        if filename:
+            self.hosts = load_json(filename, 'mirrors file', {})
+
+    def rank(self, urls, size=None, session=None):
+        """Returns ``urls`` sorted from the fastest mirror to the slowest.
+
+        The hosts without recent measures are probed first. Unmeasured urls
+        keep their order, after the measured ones.
+        """
+        urls = list(urls)
+        if len(urls) < 2:
+            return urls
+        self.probe(urls, session=session)
+        return sorted(urls, key=lambda url: self.cost(url, size))
+
+    def cost(self, url, size=None):
+        """Returns the expected seconds to download ``size`` bytes from ``url``."""
+        stats = self.hosts.get(_host(url))
+        if not stats or not stats.get('throughput'):
+            return float('inf')
+        seconds = stats['latency'] + (size or DEFAULT_SIZE) / stats['throughput']
+        return seconds * (1 + stats.get('failures', 0))
+
+    def probe(self, urls, session=None):
+        """Measures the hosts of ``urls`` lacking recent measures, in parallel."""
+        from concurrent.futures import ThreadPoolExecutor
+        with self.probe_lock:
+            pending = {}
+            for url in urls:
+                if url.startswith(('http://', 'https://')) and self._stale(url):
+                    pending.setdefault(_host(url), url)
+            if not pending:
+                return
+            with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+                for url in pending.values():
+                    executor.submit(self._probe, url, session)
+
+    def record(self, url, size, seconds):
+        """Accounts a successful download of ``size`` bytes from ``url``."""
+        if size <= 0 or seconds <= 0:
+            return
+        with self.lock:
+            stats = self.hosts.setdefault(_host(url), {'latency': 0., 'probed': time.time()})
+            throughput = size / seconds
+            if stats.get('throughput'):
+                throughput = SMOOTHING * throughput + (1 - SMOOTHING) * stats['throughput']
+            stats['throughput'] = throughput
+            stats['failures'] = stats.get('failures', 0) / 2.
+            self.changed = True
+
+    def fail(self, url):
+        """Accounts a failed download from ``url``."""
+        with self.lock:
+            stats = self.hosts.setdefault(_host(url), {'latency': 0.})
+            stats['failures'] = stats.get('failures', 0) + 1
+            stats['probed'] = time.time()
+            self.changed = True
+
+    def save(self):
+        if not self.changed or not self.filename:
+            return
+        with self.lock:
+            write_json(self.filename, self.hosts)
+            self.changed = False
+
+    def _stale(self, url):
+        stats = self.hosts.get(_host(url))
+        return not stats or time.time() - stats.get('probed', 0) > self.ttl
+
+    def _probe(self, url, session):
+        import requests
+        http = session or requests
+        headers = {'Range': 'bytes=0-%d' % (PROBE_SIZE - 1), 'Accept-Encoding': 'identity'}
+        start = time.monotonic()
+        try:
+            resp = http.get(url, stream=True, headers=headers, timeout=PROBE_TIMEOUT)
+            with contextlib.closing(resp):
+                resp.raise_for_status()
+                latency = time.monotonic() - start
+                size = 0
+                for chunk in resp.iter_content(chunk_size=16 * 1024):
+                    size += len(chunk)
+                    if size >= PROBE_SIZE:
+                        break
+        except (IOError, ValueError) as e:
+            logger.debug("Probing %s failed: %s", url, e)
+            self.fail(url)
+            return
+        elapsed = max(time.monotonic() - start - latency, 1e-3)
+        with self.lock:
+            stats = self.hosts.setdefault(_host(url), {})
+            stats.update({
+                'latency': latency,
+                'throughput': size / elapsed if size else None,
+                'probed': time.time(),
+            })
+            self.changed = True
+
+
+def _host(url):
+    parsed = urlparse(url)
+    return '%s://%s' % (parsed.scheme, parsed.netloc)
@@ -1,14 +1,48 @@
+import collections
 import glob
+import hashlib
 import os
+import logging
 import re
 import shutil
+import time
 
-import jsonschema
+from fnmatch import translate
+from urllib.parse import quote, urlparse, unquote
 
-from fnmatch import fnmatchcase
-from urllib.parse import urlparse, unquote
+from .utils import (AggregateProgress, ChecksumError, DEFAULT_BACKOFF, ReplayReportHook,
+                    ReplaySinks, load_yaml, download_file, ensure_dir, not_modified,
+                    retry_delay)
 
-from .utils import load_yaml, download_file, ensure_dir
+
+logger = logging.getLogger(__name__)
+
+# Supported checksum fields, strongest first.
+CHECKSUM_FIELDS = ('sha256', 'md5')
+
+# Seconds to connect and to wait for data before trying the next mirror.
+MIRROR_TIMEOUT = (10, 30)
+# Peers are close, do not wait long for one that is down.
+PEER_TIMEOUT = (2, 30)
+
+URLS_SCHEMA = {
+    'oneOf': [
+        {'type': 'string'},
+        {'type': 'array', 'items': {'type': 'string'}, 'minItems': 1},
+    ],
+}
+
+RECIPE_SCHEMA = {
+    '$schema': 'http://json-schema.org/draft-04/schema',
+    'type': 'object',
+    'required': ['name'],
+    'properties': {
+        'name': {'type': 'string'},
+        'url': URLS_SCHEMA,
+        'mirrors': {'type': 'array', 'items': {'type': 'string'}},
+        'files': {'type': 'array', 'items': {'type': 'object'}},
+    },
+}
 
 
 def url_filename(url):
@@ -16,13 +50,23 @@ def url_filename(url):
     return os.path.basename(unquote(path))
 
 
-def match_files(recipe, pattern):
+def translate_pattern(pattern):
+    """Translates a file name pattern into a glob pattern."""
     # Escape glob's meta chars.
     pattern = re.sub(r'([\[\]])', r'[\1]', pattern)
     # Translate range patterns.
-    pattern = re.sub(r'(\{.+?\})', r'[\1]', pattern)
+    return re.sub(r'(\{.+?\})', r'[\1]', pattern)
+
+
+def pattern_prefix(pattern):
+    """Returns the literal part of a file name pattern before any wildcard."""
+    return re.split(r'[*?{]', pattern, maxsplit=1)[0]
+
+
+def match_files(recipe, pattern):
+    match = re.compile(translate(translate_pattern(pattern))).match
     for spec in iter_files(recipe):
-        if fnmatchcase(spec['name'], pattern):
+        if match(spec['name']):
             yield spec
 
 
@@ -39,10 +83,44 @@ def iter_files(spec, parent=None):
                 yield out
 
 
+def summarize(recipe, files=None):
+    """Returns the recipe without its files tree.
+
+    The number of files and their total declared size are added instead.
+    ``files`` are the expanded file specs, if already known.
+    """
+    if files is None:
+        files = _iter_leaves(recipe)
+    count, sizes = 0, []
+    for spec in files:
+        count += 1
+        if isinstance(spec.get('size'), int):
+            sizes.append(spec['size'])
+    summary = {k: v for k, v in recipe.items() if k != 'files'}
+    summary['file_count'] = count
+    summary['total_size'] = sum(sizes) if sizes else None
+    return summary
+
+
+def _iter_leaves(spec):
+    # Like iter_files, without building the file specs.
+    if spec.get('url'):
+        yield spec
+    else:
+        for obj in spec.get('files', []):
+            for out in _iter_leaves(obj):
+                yield out
+
+
+def scan(root):
+    """Returns the recipe files found in given root directory."""
+    pattern = os.path.join(root, "*.yaml")
+    return glob.glob(pattern)
+
+
 def list(root):
     """Returns list of datasets found in given root directory."""
-    pattern = os.path.join(root, "*.yaml")
-    for filename in glob.glob(pattern):
+    for filename in scan(root):
         recipe = load_meta(filename)
         recipe['_file'] = filename
         yield recipe
@@ -51,12 +129,75 @@ def list(root):
 def load_meta(filename, schema=None):
     meta = load_yaml(filename)
     if schema:
+        import jsonschema
         jsonschema.validate(meta, schema)
     return meta
 
 
+def load_all(filenames, jobs=None, schema=RECIPE_SCHEMA, batch_size=32, max_pending=None):
+    """Parses and validates recipe files, spread over ``jobs`` processes.
+
+    Yields ``(filename, recipe, error)`` in the order of ``filenames``, where
+    ``error`` is a message for the files that could not be loaded. Files are
+    sent to the workers in batches and at most ``max_pending`` batches are in
+    flight, so results are streamed with bounded memory.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    import toolz
+    if jobs == 1:
+        for filename in filenames:
+            for result in _load_batch([filename], schema):
+                yield result
+        return
+
+    jobs = jobs or os.cpu_count() or 1
+    max_pending = max_pending or 2 * jobs
+    executor = ProcessPoolExecutor(max_workers=jobs)
+    pending = collections.deque()
+    try:
+        for batch in toolz.partition_all(batch_size, filenames):
+            pending.append(executor.submit(_load_batch, batch, schema))
+            if len(pending) >= max_pending:
+                for result in pending.popleft().result():
+                    yield result
+        while pending:
+            for result in pending.popleft().result():
+                yield result
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def _load_batch(filenames, schema):
+    import jsonschema
+    import yaml
+    results = []
+    for filename in filenames:
+        try:
+            recipe = load_meta(filename, schema)
+        except (EnvironmentError, yaml.YAMLError, jsonschema.ValidationError) as e:
+            error = getattr(e, 'message', None) or str(e)
+            results.append((filename, None, error))
+        else:
+            if not isinstance(recipe, dict):
+                results.append((filename, None, "recipe must be a mapping"))
+                continue
+            recipe['_file'] = filename
+            results.append((filename, recipe, None))
+    return results
+
+
 def make_file_spec(name, url, **kwargs):
+    """Returns the spec of a file.
+
+    ``url`` may be a list of mirrors, the first one is kept as the ``url``
+    of the file and the others are added to its ``mirrors``.
+    """
     spec = kwargs
+    if not isinstance(url, str):
+        spec['mirrors'] = url[1:] + spec.get('mirrors', [])
+        url = url[0]
     spec.update({
         'name': name,
         'url': url,
@@ -69,13 +210,258 @@ def make_file_spec(name, url, **kwargs):
     return spec
 
 
-def download(file_spec, dest_dir, quiet=False):
+def file_urls(file_spec):
+    """Returns the url and the mirrors of a file, without duplicates."""
+    urls = [file_spec['url']]
+    for url in file_spec.get('mirrors', ()):
+        if url not in urls:
+            urls.append(url)
+    return urls
+
+
+def peer_urls(file_spec, peers):
+    """Returns the urls of the file on the ``databrewer serve`` peers."""
+    path = '/datasets/%s/%s' % (quote(file_spec['name'].partition('[')[0]),
+                                quote(file_spec['filename']))
+    return [peer.rstrip('/') + path for peer in peers]
+
+
+def get_checksum(file_spec):
+    """Returns the ``(algorithm, hexdigest)`` pair used to verify a file."""
+    for field in CHECKSUM_FIELDS:
+        if file_spec.get(field):
+            return field, file_spec[field].lower()
+
+
+def is_verified(file_spec, filename):
+    """Returns whether the file was verified against the spec checksum.
+
+    Relies on the digest recorded by ``download``, which is trusted as long
+    as the file has not been modified after it was recorded.
+    """
+    checksum = get_checksum(file_spec)
+    if not checksum:
+        return False
+    checksum_filename = '%s.%s' % (filename, checksum[0])
+    try:
+        with open(checksum_filename) as fp:
+            digest = fp.read().partition(' ')[0]
+        recorded = os.path.getmtime(checksum_filename) >= os.path.getmtime(filename)
+    except (IOError, OSError):
+        return False
+    return recorded and digest == checksum[1]
+
+
+def download(file_spec, dest_dir, quiet=False, session=None, reporthook=None, segments=1,
+             extract=None, keep_archive=None, store=None, throttle=None, ranking=None,
+             peers=(), timeout=None, low_speed=None, retries=0, backoff=DEFAULT_BACKOFF,
+             force=False):
+    """Downloads a file into ``dest_dir``.
+
+    If ``extract`` is true, or not given and the spec has a true ``extract``
+    field, the archive is also extracted into ``dest_dir``: gzip, bzip2 and
+    tar archives while they are downloaded, zip archives afterwards. The
+    extracted files are listed in ``<filename>.extracted``. The archive is
+    removed once extracted if ``keep_archive``, or the spec field of the same
+    name, is false. Files that are not archives are not extracted.
+
+    With a ``store``, the file is downloaded only if the store does not have
+    it yet, and linked into ``dest_dir``. With ``force`` it is downloaded
+    again, unless the server confirms the stored file is still current.
+
+    Files with mirrors are downloaded from the fastest one according to the
+    ``ranking``, switching to the next one if it fails or stalls. The
+    ``peers`` serving their datasets are tried before all the mirrors.
+
+    ``timeout``, ``low_speed``, ``retries`` and ``backoff`` are passed to
+    ``download_file``. With mirrors, each retry goes through all of them.
+    """
     ensure_dir(dest_dir)
+    if extract is None:
+        extract = file_spec.get('extract', False)
+    if keep_archive is None:
+        keep_archive = file_spec.get('keep_archive', True)
+    dest_filename = os.path.join(dest_dir, file_spec['filename'])
+    checksum = get_checksum(file_spec)
+    kwargs = dict(quiet=quiet, session=session, reporthook=reporthook, segments=segments,
+                  throttle=throttle, ranking=ranking, peers=peers, timeout=timeout,
+                  low_speed=low_speed, retries=retries, backoff=backoff)
+    fmt = staging_dir = sinks = None
+    if extract:
+        from .extract import archive_format
+        fmt = archive_format(file_spec['filename'])
+    if fmt is not None:
+        # Extracted files are moved into place once the archive is verified.
+        staging_dir = os.path.join(dest_dir, '.%s.extract' % file_spec['filename'])
+
+    def make_sinks(hashers=()):
+        # The sinks of a download from the start of the file.
+        sinks = []
+        if staging_dir:
+            from .extract import make_sink
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            os.makedirs(staging_dir)
+            sink = make_sink(file_spec['filename'], staging_dir)
+            if sink is not None:
+                sinks.append(sink)
+        return sinks + [hashlib.new(name) for name in hashers]
+
+    try:
+        if store is None:
+            filename = dest_filename + '.part'
+            sinks = ReplaySinks(factory=make_sinks)
+            _retrieve(file_spec, filename, sinks, **kwargs)
+        else:
+            with store.lock(file_spec):
+                filename = store.find(file_spec)
+                if filename is not None and force and not not_modified(
+                        file_spec['url'], store.validators(file_spec), session=session,
+                        timeout=timeout):
+                    filename = None
+                if filename is None:
+                    sinks = ReplaySinks(factory=lambda: make_sinks(['sha256']))
+                    part_filename = store.part_path(file_spec)
+                    url, validators = _retrieve(file_spec, part_filename, sinks, **kwargs)
+                    # The validators of a mirror or a peer do not apply to the url.
+                    filename = store.add(file_spec, part_filename, sinks.sinks[-1].hexdigest(),
+                                         validators if url == file_spec['url'] else None)
+                else:
+                    sinks = ReplaySinks(factory=make_sinks)
+                    if sinks.sinks:
+                        from .extract import feed
+                        feed(sinks, filename)
+        sinks.close()
+        if fmt == 'zip':
+            from .extract import extract_zip
+            extract_zip(filename, staging_dir)
+    except BaseException:
+        if sinks is not None:
+            sinks.abort()
+        if staging_dir:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+    if store is None:
+        shutil.move(filename, dest_filename)
+    else:
+        store.link(filename, dest_filename)
+    if checksum:
+        # Recorded in the format used by md5sum and sha256sum.
+        with open('%s.%s' % (dest_filename, checksum[0]), 'w') as fp:
+            fp.write('%s  %s\n' % (checksum[1], file_spec['filename']))
+    if staging_dir:
+        from .extract import merge_tree
+        extracted = merge_tree(staging_dir, dest_dir)
+        with open(dest_filename + '.extracted', 'w') as fp:
+            fp.write(''.join(name + '\n' for name in extracted))
+        if not keep_archive:
+            os.unlink(dest_filename)
+            if checksum:
+                os.unlink('%s.%s' % (dest_filename, checksum[0]))
+
+
+def _retrieve(file_spec, filename, sinks, ranking=None, peers=(), retries=0,
+              backoff=DEFAULT_BACKOFF, **kwargs):
+    """Downloads the file from one of its urls.
+
+    Returns the url it was downloaded from and its validators.
+    """
+    urls = file_urls(file_spec)
+    if len(urls) > 1 and ranking is not None:
+        urls = ranking.rank(urls, size=file_spec.get('size'), session=kwargs.get('session'))
+    local_urls = peer_urls(file_spec, peers)
+    urls = local_urls + urls
+    if len(urls) == 1:
+        return urls[0], _retrieve_from(urls, 0, file_spec, filename, sinks, retries=retries,
+                                       backoff=backoff, **kwargs)
+    if kwargs.get('timeout') is None:
+        kwargs['timeout'] = MIRROR_TIMEOUT
+    # Each attempt feeds the file from its start, the data is only passed
+    # on once.
+    if not isinstance(sinks, ReplaySinks):
+        sinks = ReplaySinks(sinks)
+    if kwargs.get('reporthook') is not None:
+        kwargs['reporthook'] = ReplayReportHook(kwargs['reporthook'])
+    # The mirrors are tried in turn, the peers only on the first round.
+    rounds = [range(len(urls))] + [range(len(local_urls), len(urls))] * retries
+    for round_number, indexes in enumerate(rounds):
+        if round_number:
+            time.sleep(retry_delay(round_number - 1, backoff))
+        for i in indexes:
+            is_peer = i < len(local_urls)
+            offset = os.path.getsize(filename) if os.path.exists(filename) else 0
+            start = time.monotonic()
+            try:
+                validators = _retrieve_from(urls, i, file_spec, filename, sinks,
+                                            **dict(kwargs, timeout=PEER_TIMEOUT) if is_peer
+                                            else kwargs)
+            except IOError as e:
+                if ranking is not None and not is_peer:
+                    ranking.fail(urls[i])
+                if i + 1 == len(urls) and round_number + 1 == len(rounds):
+                    raise
+                if is_peer:
+                    logger.debug("Peer %s does not have the file (%s)", urls[i], e)
+                else:
+                    next_url = urls[i + 1] if i + 1 < len(urls) else urls[len(local_urls)]
+                    logger.warning("Downloading %s failed (%s), switching to %s",
+                                   urls[i], e, next_url)
+            else:
+                if ranking is not None and not is_peer:
+                    ranking.record(urls[i], os.path.getsize(filename) - offset,
+                                   time.monotonic() - start)
+                return urls[i], validators
+
+
+def _retrieve_from(urls, i, file_spec, filename, sinks, **kwargs):
+    try:
+        return download_file(urls[i], filename,
+                             reporthook_kwargs={
+                                 'desc': "%(name)s - %(filename)s" % file_spec,
+                             },
+                             checksum=get_checksum(file_spec),
+                             sinks=sinks,
+                             mirrors=urls[:i] + urls[i + 1:],
+                             **kwargs)
+    except ChecksumError:
+        # Do not resume from corrupted data.
+        os.unlink(filename)
+        raise
+
+
+def is_downloaded(file_spec, dest_dir):
+    """Returns whether the file, or the files extracted from it, are in ``dest_dir``."""
     dest_filename = os.path.join(dest_dir, file_spec['filename'])
-    part_filename = dest_filename + '.part'
-    # TODO: verify checksum.
-    download_file(file_spec['url'], part_filename, quiet=quiet,
-                  reporthook_kwargs={
-                      'desc': "%(name)s - %(filename)s" % file_spec,
-                  })
-    shutil.move(part_filename, dest_filename)
+    return os.path.exists(dest_filename) or os.path.exists(dest_filename + '.extracted')
+
+
+def download_many(downloads, scheduler, quiet=False, session=None, segments=1, **kwargs):
+    """Downloads ``(file_spec, dest_dir)`` pairs with the given scheduler.
+
+    Files are grouped by destination directory, so the scheduler takes turns
+    between datasets, and ordered by their ``priority`` field. Other
+    arguments are passed to ``download``.
+
+    Yields ``(file_spec, error)`` pairs as downloads finish, where ``error``
+    is ``None`` on success.
+    """
+    downloads = tuple(downloads)
+    progress = None
+    if not quiet:
+        progress = AggregateProgress(desc="Downloading %d files" % len(downloads))
+
+    def _download(item):
+        spec, dest_dir = item
+        reporthook = progress.reporthook() if progress else None
+        download(spec, dest_dir, quiet=True, session=session, reporthook=reporthook,
+                 segments=segments, throttle=scheduler.throttle, **kwargs)
+
+    for item in downloads:
+        spec, dest_dir = item
+        scheduler.add(item, _download, host=urlparse(spec['url']).hostname, group=dest_dir,
+                      priority=spec.get('priority', 0), slots=segments)
+    try:
+        for (spec, _), error in scheduler.run():
+            yield spec, error
+    finally:
+        if progress:
+            progress.close()
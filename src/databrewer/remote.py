@@ -0,0 +1,82 @@
+"""Remote file metadata probes."""
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from .utils import load_json, write_json
+
+
+class MetadataCache(object):
+    """Persistent cache of remote file metadata keyed by URL."""
+
+    def __init__(self, filename, ttl=86400):
+        self.filename = filename
+        self.ttl = ttl
+        self.changed = False
+        self.entries = load_json(filename, 'metadata cache', {})
+
+    def get(self, url):
+        meta = self.entries.get(url)
+        if meta and time.time() - meta['checked_at'] < self.ttl:
+            return meta
+
+    def set(self, url, meta):
+        self.entries[url] = meta
+        self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        now = time.time()
+        entries = {url: meta for url, meta in self.entries.items()
+                   if now - meta['checked_at'] < self.ttl}
+        write_json(self.filename, entries)
+        self.changed = False
+
+
+def probe(url, session=None, timeout=3):
+    """Returns the metadata of a remote file from a HEAD request.
+
+    The returned ``status`` is ``None`` when the request failed.
+    """
+    try:
+        resp = (session or requests).head(url, timeout=timeout)
+    except requests.RequestException as e:
+        return {'status': None, 'error': str(e), 'checked_at': time.time()}
+    length = resp.headers.get('content-length')
+    return {
+        'status': resp.status_code,
+        'length': int(length) if length else None,
+        'etag': resp.headers.get('etag'),
+        'last_modified': resp.headers.get('last-modified'),
+        'checked_at': time.time(),
+    }
+
+
+def probe_all(urls, session=None, jobs=8, cache=None, timeout=3):
+    """Returns a dict of URL to metadata, probing up to ``jobs`` URLs at once.
+
+    URLs found in ``cache`` are not requested again. Failed probes are not
+    cached.
+    """
+    results = {}
+    pending = []
+    for url in set(urls):
+        meta = cache.get(url) if cache else None
+        if meta:
+            results[url] = meta
+        else:
+            pending.append(url)
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            metas = executor.map(lambda url: probe(url, session, timeout), pending)
+            for url, meta in zip(pending, metas):
+                results[url] = meta
+                if cache and meta['status'] is not None:
+                    cache.set(url, meta)
+        if cache:
+            cache.save()
+    return results
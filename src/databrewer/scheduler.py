@@ -0,0 +1,189 @@
+"""Scheduling of concurrent downloads.
+
+Jobs run in a fixed number of worker threads. The next job is the one with
+the lowest priority value whose host has free connections, taking turns
+between the groups (datasets) that have jobs of the same priority. All the
+jobs share a token bucket capping the bandwidth.
+
+Stopping the run, on Ctrl-C for instance, cancels the running jobs the next
+time they report the bytes they read.
+"""
+import bisect
+import itertools
+import queue
+import threading
+import time
+
+
+class Cancelled(Exception):
+    """The job was cancelled while running."""
+
+
+class TokenBucket(object):
+    """Limits a flow to ``rate`` units per second, with bursts of ``capacity``.
+
+    Consumers take the tokens they need, possibly going into debt, and
+    sleep until the debt is paid.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount, cancelled=None):
+        """Takes ``amount`` tokens, waiting until they are available.
+
+        Stops waiting once the ``cancelled`` event is set.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            if cancelled is not None:
+                cancelled.wait(wait)
+            else:
+                time.sleep(wait)
+
+
+class _Job(object):
+
+    def __init__(self, item, func, host, group, priority, slots):
+        self.item = item
+        self.func = func
+        self.host = host
+        self.group = group
+        self.priority = priority
+        self.slots = slots
+
+
+class Scheduler(object):
+    """Runs jobs with per-host connection caps and a global bandwidth cap.
+
+    ``per_host`` caps the connections to each host and ``rate`` the bytes
+    per second of all the jobs, which report the bytes they read by calling
+    ``throttle``. ``None`` means no limit. ``throttle`` raises ``Cancelled``
+    once the run is stopped.
+    """
+
+    def __init__(self, workers=4, per_host=None, rate=None):
+        self.workers = workers
+        self.per_host = per_host
+        self.bucket = TokenBucket(rate) if rate else None
+        self.cond = threading.Condition()
+        self.pending = {}
+        self.groups = []
+        self.turn = 0
+        self.active = {}
+        self.counter = itertools.count()
+        self.bytes = 0
+        self.started = None
+        self.lock = threading.Lock()
+        self.cancelled = threading.Event()
+
+    def add(self, item, func, host=None, group=None, priority=0, slots=1):
+        """Schedules ``func(item)``. ``slots`` is the number of connections it uses."""
+        if self.per_host:
+            slots = min(slots, self.per_host)
+        job = _Job(item, func, host, group, priority, slots)
+        if group not in self.pending:
+            self.pending[group] = []
+            self.groups.append(group)
+        bisect.insort(self.pending[group], (priority, next(self.counter), job))
+
+    def throttle(self, size):
+        """Accounts ``size`` bytes read, waiting if over the bandwidth cap."""
+        if self.cancelled.is_set():
+            raise Cancelled("Download cancelled")
+        with self.lock:
+            self.bytes += size
+        if self.bucket is not None:
+            self.bucket.consume(size, self.cancelled)
+            if self.cancelled.is_set():
+                raise Cancelled("Download cancelled")
+
+    def throughput(self):
+        """Returns the bytes read per second since the jobs started."""
+        if self.started is None:
+            return 0.
+        return self.bytes / max(time.monotonic() - self.started, 1e-6)
+
+    def run(self):
+        """Runs the jobs, yielding ``(item, error)`` pairs as they finish.
+
+        ``error`` is ``None`` on success. Closing the generator drops the
+        pending jobs, cancels the running ones and waits for them to stop.
+        """
+        total = sum(len(jobs) for jobs in self.pending.values())
+        self.started = time.monotonic()
+        done = queue.Queue()
+        threads = [threading.Thread(target=self._work, args=(done,))
+                   for _ in range(max(1, min(self.workers, total)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            for _ in range(total):
+                yield done.get()
+        finally:
+            with self.cond:
+                self.pending.clear()
+                self.cond.notify_all()
+            self.cancelled.set()
+            for thread in threads:
+                thread.join()
+
+    def _work(self, done):
+        while True:
+            job = self._next()
+            if job is None:
+                return
+            try:
+                job.func(job.item)
+            except Exception as e:
+                done.put((job.item, e))
+            else:
+                done.put((job.item, None))
+            finally:
+                with self.cond:
+                    self.active[job.host] -= job.slots
+                    self.cond.notify_all()
+
+    def _next(self):
+        with self.cond:
+            while any(self.pending.values()):
+                job = self._pick()
+                if job is not None:
+                    self.active[job.host] = self.active.get(job.host, 0) + job.slots
+                    return job
+                self.cond.wait()
+
+    def _pick(self):
+        # The best job that fits of each group, starting from the group
+        # whose turn it is. Ties go to the first group found.
+        best = None
+        count = len(self.groups)
+        for i in range(count):
+            index = (self.turn + i) % count
+            jobs = self.pending.get(self.groups[index], ())
+            for position, (priority, _, job) in enumerate(jobs):
+                if self._fits(job):
+                    if best is None or priority < best[2].priority:
+                        best = (index, position, job)
+                    break
+        if best is None:
+            return None
+        index, position, job = best
+        del self.pending[self.groups[index]][position]
+        self.turn = index + 1
+        return job
+
+    def _fits(self, job):
+        if not self.per_host:
+            return True
+        return self.active.get(job.host, 0) + job.slots <= self.per_host
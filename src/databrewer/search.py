@@ -1,67 +1,157 @@
 import json
 import logging
+import zlib
 
 from whoosh.analysis import FancyAnalyzer, StemFilter
-from whoosh.fields import Schema, ID, TEXT
-from whoosh.index import create_in, open_dir, exists_in
+from whoosh.fields import Schema, ID, STORED, TEXT
+from whoosh.index import EmptyIndexError, create_in, open_dir
 from whoosh.qparser import QueryParser
 from whoosh.query import Query, Variations
 
+from .recipes import summarize
+
 
 DEFAULT_SCHEMA = Schema(
     id=ID(unique=True, stored=True),
-    data=ID(stored=True),
+    description=STORED,
+    homepage=STORED,
+    keywords=STORED,
+    file_count=STORED,
+    total_size=STORED,
+    # The whole recipe, as compressed JSON decoded only when needed.
+    payload=STORED,
     content=TEXT(FancyAnalyzer() | StemFilter()),
 )
 
+# Recipe fields that can be read from the stored fields of a hit.
+STORED_FIELDS = {
+    'name': 'id',
+    'description': 'description',
+    'homepage': 'homepage',
+    'keywords': 'keywords',
+    'file_count': 'file_count',
+    'total_size': 'total_size',
+}
+
 
 logger = logging.getLogger(__name__)
 
 
+class OutdatedIndexError(ValueError):
+    """The index was built with another schema, ``databrewer update`` rebuilds it."""
+
+
 class SearchIndex(object):
+    """Search index of recipes.
+
+    Searches share a single searcher, refreshed when the index changes. Use
+    the index as a context manager or call ``close`` to release it.
+    """
 
     def __init__(self, index_dir, schema=DEFAULT_SCHEMA, force_create=False):
         self.schema = schema
-        if exists_in(index_dir) and not force_create:
-            self.index = open_dir(index_dir, schema=schema)
-        else:
+        self.index = None
+        if not force_create:
+            try:
+                index = open_dir(index_dir)
+            except EmptyIndexError:
+                pass
+            else:
+                # Compared with the schema stored in the index.
+                if sorted(index.schema.names()) != sorted(schema.names()):
+                    index.close()
+                    raise OutdatedIndexError(
+                        "The index at %s uses an outdated schema" % index_dir)
+                self.index = index
+        if self.index is None:
             self.index = create_in(index_dir, schema=schema)
+        self._searcher = None
 
-    @classmethod
-    def is_empty(cls, index_dir):
-        si = SearchIndex(index_dir)
-        return si.index.is_empty()
-
-    def search(self, query, search_field='content'):
+    @property
+    def searcher(self):
+        """Returns the shared searcher for the latest version of the index."""
+        if self._searcher is None:
+            self._searcher = self.index.searcher()
+        else:
+            # Returns the same searcher unless the index generation changed.
+            self._searcher = self._searcher.refresh()
+        return self._searcher
+
+    def close(self):
+        if self._searcher is not None:
+            self._searcher.close()
+            self._searcher = None
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def search(self, query, search_field='content', limit=100, offset=0, fields=None):
+        """Yields the recipes matching the query, best first.
+
+        ``offset`` and ``limit`` select a page of results, ``limit=None``
+        returns all of them. If ``fields`` is given only those fields are
+        returned, read from the stored fields instead of decoding the whole
+        recipe when possible.
+        """
         if not isinstance(query, Query):
             parser = QueryParser(search_field, self.schema, termclass=Variations)
             query = parser.parse(query)
 
-        with self.index.searcher() as searcher:
-            for hit in searcher.search(query, limit=100):
-                yield self._decode(hit['data'])
+        results = self.searcher.search(query, limit=offset + limit if limit else None)
+        for hit in results[offset:]:
+            yield self._select(hit, fields)
 
-    def get(self, key, field='id'):
+    def get(self, key, field='id', fields=None):
         kwargs = {field: key}
-        hit = self.index.searcher().document(**kwargs)
+        hit = self.searcher.document(**kwargs)
         if hit:
-            return self._decode(hit['data'])
+            return self._select(hit, fields)
 
-    def list(self):
-        for hit in self.index.searcher().documents():
-            yield self._decode(hit['data'])
+    def list(self, fields=None):
+        for hit in self.searcher.documents():
+            yield self._select(hit, fields)
 
     def update(self, recipes,
                id_field='name',
-               text_fields=('name', 'description', 'keywords')):
-        writer = self.index.writer()
+               text_fields=('name', 'description', 'keywords'),
+               deleted=(),
+               optimize_segments=10):
+        """Adds or replaces the given recipes and removes the ``deleted`` ones.
+
+        ``deleted`` is consumed after ``recipes``, so it can be filled while
+        the recipes are produced. Names updated in the same call are kept.
+        The index is optimized only once it has ``optimize_segments``
+        segments. Returns the number of updated and deleted documents.
+        """
+        writer = None
+        updated = set()
         for recipe in recipes:
+            if writer is None:
+                writer = self.index.writer()
+            summary = summarize(recipe)
             writer.update_document(
                 id=recipe[id_field],
                 content=self._get_content(recipe, text_fields),
-                data=self._encode(recipe),
+                payload=self._encode(recipe),
+                description=str(recipe.get('description') or ''),
+                homepage=recipe.get('homepage'),
+                keywords=recipe.get('keywords'),
+                file_count=summary['file_count'],
+                total_size=summary['total_size'],
             )
-        writer.commit(optimize=True)
+            updated.add(recipe[id_field])
+        removed = set(deleted) - updated
+        for key in removed:
+            if writer is None:
+                writer = self.index.writer()
+            writer.delete_by_term('id', key)
+        if writer is not None:
+            writer.commit(optimize=len(writer.segments) >= optimize_segments)
+        return len(updated), len(removed)
 
     def _get_content(self, doc, fields):
         content = []
@@ -73,8 +163,17 @@ class SearchIndex(object):
                 content.append(text)
         return "\n".join(content)
 
+    def _select(self, hit, fields):
+        """Returns the given fields of a hit, or the whole recipe."""
+        if fields is not None and all(f in STORED_FIELDS for f in fields):
+            return {f: hit.get(STORED_FIELDS[f]) for f in fields}
+        recipe = self._decode(hit['payload'])
+        if fields is None:
+            return recipe
+        return {f: recipe.get(f) for f in fields}
+
     def _encode(self, obj):
-        return json.dumps(obj)
+        return zlib.compress(json.dumps(obj, separators=(',', ':')).encode('utf-8'))
 
-    def _decode(self, data):
-        return json.loads(data)
+    def _decode(self, payload):
+        return json.loads(zlib.decompress(payload).decode('utf-8'))
@@ -0,0 +1,141 @@
+"""HTTP server sharing the downloaded datasets with other nodes.
+
+Serves::
+
+    /datasets/<recipe>/<filename>   the downloaded files, with byte ranges
+    /index/                         the recipe index files, as a JSON list
+    /index/<filename>               a recipe index file
+
+Nodes listing the server in their ``peers`` configuration download files
+from it before trying their origin. Files being downloaded or extracted are
+not served.
+"""
+import email.utils
+import json
+import os
+import posixpath
+import re
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import unquote, urlparse
+
+
+DEFAULT_PORT = 8750
+
+# Files left by downloads in progress.
+PARTIAL_SUFFIXES = ('.part', '.resume', '.tmp', '.link')
+
+
+class DatasetServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, datasets_dir, index_dir, address=('127.0.0.1', DEFAULT_PORT)):
+        self.roots = {'datasets': datasets_dir, 'index': index_dir}
+        HTTPServer.__init__(self, address, RequestHandler)
+
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._send(head=True)
+
+    def do_GET(self):
+        self._send(head=False)
+
+    def _send(self, head):
+        root, _, relpath = unquote(urlparse(self.path).path).lstrip('/').partition('/')
+        if root == 'index' and not relpath:
+            self._send_index_list(head)
+            return
+        path = self._translate(root, relpath)
+        if path is None or not os.path.isfile(path):
+            self._send_empty(404)
+            return
+        with open(path, 'rb') as fp:
+            stat = os.fstat(fp.fileno())
+            size = stat.st_size
+            etag = '"%x-%x"' % (stat.st_mtime_ns, size)
+            start, end = 0, size - 1
+            status = 200
+            byte_range = self._range(size, etag)
+            if byte_range == 'invalid':
+                self._send_empty(416, {'Content-Range': 'bytes */%d' % size})
+                return
+            if byte_range:
+                start, end = byte_range
+                status = 206
+            self.send_response(status)
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', email.utils.formatdate(stat.st_mtime, usegmt=True))
+            self.send_header('Accept-Ranges', 'bytes')
+            if status == 206:
+                self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, size))
+            self.end_headers()
+            if not head and end >= start:
+                self.connection.sendfile(fp, start, end - start + 1)
+
+    def _translate(self, root, relpath):
+        """Returns the local path of a served file or ``None``."""
+        if root not in self.server.roots:
+            return None
+        parts = posixpath.normpath(relpath).split('/')
+        if any(not part or part.startswith('.') for part in parts):
+            return None
+        if parts[-1].endswith(PARTIAL_SUFFIXES):
+            return None
+        return os.path.join(self.server.roots[root], *parts)
+
+    def _range(self, size, etag):
+        """Returns the requested ``(start, end)`` bytes, ``None`` or ``'invalid'``."""
+        value = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if not value or (if_range and if_range != etag):
+            return None
+        match = re.match(r'bytes=(\d*)-(\d*)$', value.strip())
+        if not match or match.groups() == ('', ''):
+            # Multiple ranges are not supported, send the whole file.
+            return None
+        first, last = match.groups()
+        if not first:
+            start, end = max(size - int(last), 0), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        if start >= size or start > end:
+            return 'invalid'
+        return start, end
+
+    def _send_index_list(self, head):
+        index_dir = self.server.roots['index']
+        files = []
+        if os.path.isdir(index_dir):
+            for name in sorted(os.listdir(index_dir)):
+                path = os.path.join(index_dir, name)
+                if not name.startswith('.') and os.path.isfile(path):
+                    files.append({'name': name, 'size': os.path.getsize(path)})
+        body = json.dumps({'files': files}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def _send_empty(self, status, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
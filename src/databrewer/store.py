@@ -0,0 +1,142 @@
+"""Content-addressed store of downloaded files.
+
+Files are stored once, named by their sha256 digest, and linked into the
+dataset directories of the recipes listing them::
+
+    blobs/<xx>/<sha256>    the file contents, read-only
+    urls/<sha256(url)>     the digest and validators of the file downloaded
+                           from the url, as JSON
+    tmp/                   downloads in progress and their locks
+
+A file is looked up by the sha256 declared in its spec and, failing that,
+by its url. Like files in the dataset directories, the contents of a url
+are not checked again once stored, unless the download is forced.
+"""
+import contextlib
+import errno
+import hashlib
+import json
+import os
+import threading
+
+from .utils import write_json
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+LINK_MODES = ('hardlink', 'symlink')
+
+
+class BlobStore(object):
+
+    def __init__(self, store_dir, link_mode='hardlink'):
+        if link_mode not in LINK_MODES:
+            raise ValueError("Unknown link mode: %s" % link_mode)
+        self.store_dir = store_dir
+        self.link_mode = link_mode
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        for name in ('blobs', 'urls', 'tmp'):
+            path = os.path.join(store_dir, name)
+            if not os.path.isdir(path):
+                os.makedirs(path, exist_ok=True)
+
+    @contextlib.contextmanager
+    def lock(self, file_spec):
+        """Holds the lock to fetch a file only once.
+
+        The lock is held on a file in ``tmp/``, so processes and hosts
+        sharing the store wait for each other too.
+        """
+        with self._locks_lock:
+            thread_lock = self._locks.setdefault(file_spec['url'], threading.Lock())
+        with thread_lock:
+            if fcntl is None:
+                yield
+                return
+            lock_path = os.path.join(self.store_dir, 'tmp', _url_key(file_spec['url']) + '.lock')
+            with open(lock_path, 'a') as fp:
+                fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+
+    def blob_path(self, digest):
+        return os.path.join(self.store_dir, 'blobs', digest[:2], digest)
+
+    def part_path(self, file_spec):
+        """Returns where the file is downloaded before it is added."""
+        return os.path.join(self.store_dir, 'tmp', _url_key(file_spec['url']) + '.part')
+
+    def find(self, file_spec):
+        """Returns the path of the stored file or ``None``."""
+        digest = file_spec.get('sha256') or self._url_record(file_spec).get('sha256')
+        if not digest:
+            return None
+        path = self.blob_path(digest.lower())
+        if os.path.exists(path):
+            return path
+
+    def validators(self, file_spec):
+        """Returns the ``etag`` and ``last_modified`` of the file stored from its url."""
+        record = self._url_record(file_spec)
+        return {'etag': record.get('etag'), 'last_modified': record.get('last_modified')}
+
+    def add(self, file_spec, filename, digest, validators=None):
+        """Moves a downloaded file with the given sha256 digest into the store.
+
+        ``validators`` are the ``etag`` and ``last_modified`` of the file at
+        its url. Returns the path of the stored file. An existing blob with
+        the same digest is kept.
+        """
+        path = self.blob_path(digest)
+        if os.path.exists(path):
+            os.unlink(filename)
+        else:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.chmod(filename, 0o444)
+            os.replace(filename, path)
+        url_path = os.path.join(self.store_dir, 'urls', _url_key(file_spec['url']))
+        write_json(url_path, dict(validators or {}, sha256=digest))
+        return path
+
+    def link(self, path, dest_filename):
+        """Links the stored file at ``path`` to ``dest_filename``."""
+        if (self.link_mode == 'hardlink' and not os.path.islink(dest_filename)
+                and os.path.exists(dest_filename) and os.path.samefile(path, dest_filename)):
+            # Renaming a hard link over another link to the same file does
+            # nothing, leaving the temporary link behind.
+            return
+        tmp_filename = '%s.%d.link' % (dest_filename, os.getpid())
+        if os.path.lexists(tmp_filename):
+            os.unlink(tmp_filename)
+        if self.link_mode == 'hardlink':
+            try:
+                os.link(path, tmp_filename)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                # The store is on another device.
+                os.symlink(os.path.abspath(path), tmp_filename)
+        else:
+            os.symlink(os.path.abspath(path), tmp_filename)
+        os.replace(tmp_filename, dest_filename)
+        if os.path.lexists(tmp_filename):
+            # Linked to the same file by another process in the meantime.
+            os.unlink(tmp_filename)
+
+    def _url_record(self, file_spec):
+        try:
+            with open(os.path.join(self.store_dir, 'urls', _url_key(file_spec['url']))) as fp:
+                return json.load(fp)
+        except (IOError, OSError, ValueError):
+            return {}
+
+
+def _url_key(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
@@ -1,53 +1,130 @@
 from __future__ import division
 
+import collections
 import contextlib
+import hashlib
+import itertools
+import json
+import logging
 import os.path
-import pdb
+import re
+import socket
 import sys
 import textwrap
+import threading
+import time
 import traceback
 
-import requests
-import toolz
-import tqdm
-import yaml
+# Heavy modules (requests, tqdm, yaml, toolz) are imported by the functions
+# using them to keep the CLI start up fast.
 
-from six.moves.urllib.request import urlretrieve as _urlretrieve
 
+logger = logging.getLogger(__name__)
 
-abspath = toolz.compose(os.path.abspath, os.path.expanduser)
+
+# Files smaller than two segments are not worth splitting.
+MIN_SEGMENT_SIZE = 1024 * 1024
+
+SIZE_SUFFIXES = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+# Bounds of the read buffer, sized to fill in about READ_INTERVAL seconds at
+# the observed throughput.
+MIN_BUFFER_SIZE = 64 * 1024
+MAX_BUFFER_SIZE = 4 * 1024 * 1024
+READ_INTERVAL = 0.05
+
+# Seconds between progress reports.
+REPORT_INTERVAL = 0.1
+
+# Smaller files are not worth reserving the disk space of.
+MIN_PREALLOCATE_SIZE = 1024 * 1024
+
+# Seconds to wait before the first retry of a download, doubled after each
+# attempt up to MAX_BACKOFF.
+DEFAULT_BACKOFF = 1
+MAX_BACKOFF = 60
+
+
+def abspath(path):
+    return os.path.abspath(os.path.expanduser(path))
 
 
 def load_yaml(filename):
-    # TODO: Add basic validation.
+    import yaml
+    # Use libyaml bindings when available, they are much faster.
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
     with open(filename) as fp:
-        return yaml.load(fp)
+        return yaml.load(fp, Loader=loader)
 
 
 def dump_yaml(obj):
+    import yaml
     return yaml.dump(obj)
 
 
+def load_json(filename, description, default=None):
+    """Returns the JSON document in ``filename``, or ``default`` if it is
+    missing or corrupted."""
+    if not os.path.exists(filename):
+        return default
+    try:
+        with open(filename) as fp:
+            return json.load(fp)
+    except ValueError:
+        logger.warning("Ignoring corrupted %s '%s'", description, filename)
+        return default
+
+
+def write_json(filename, data, **kwargs):
+    """Replaces ``filename`` with the JSON document of ``data`` atomically."""
+    tmp_filename = '%s.%d.tmp' % (filename, os.getpid())
+    with open(tmp_filename, 'w') as fp:
+        json.dump(data, fp, **kwargs)
+        fp.write('\n')
+    os.replace(tmp_filename, filename)
+
+
 def ensure_dir(path):
     os.makedirs(path, exist_ok=True)
 
 
+def parse_size(value):
+    """Returns the number of bytes of a size like ``512``, ``64K`` or ``1.5M``."""
+    text = str(value).strip()
+    number, multiplier = text, 1
+    if text[-1:].upper() in SIZE_SUFFIXES:
+        number, multiplier = text[:-1], SIZE_SUFFIXES[text[-1:].upper()]
+    try:
+        size = int(float(number) * multiplier)
+    except ValueError:
+        size = -1
+    if size < 0:
+        raise ValueError("Invalid size: %s" % text)
+    return size
+
+
 def format_results(terminal_width, key_list, separator, text_list,
-                   left_align=True, min_factor=3, **kwargs):
+                   left_align=True, min_factor=3, key_width=None, **kwargs):
     """Returns formatted results in two columns.
+
+    The keys column is as wide as the longest key, or ``key_width``.
     """
-    key_width = max(map(len, key_list))
+    if key_width is None:
+        key_width = max(map(len, key_list))
     separator_length = len(separator)
-    desc_wrap = toolz.identity
+    text_width = None
     if terminal_width:
         if key_width / terminal_width > .5:
             key_width = terminal_width // 2 - 3
         text_width = terminal_width - key_width - separator_length
-        if text_width * min_factor > terminal_width:
-            desc_wrap = toolz.compose(
-                ('\n' + ' ' * (key_width + separator_length)).join,
-                toolz.partial(textwrap.wrap, width=text_width, **kwargs),
-            )
+        if text_width * min_factor <= terminal_width:
+            text_width = None
+    indent = '\n' + ' ' * (key_width + separator_length)
+
+    def desc_wrap(text):
+        if text_width is None:
+            return text
+        return indent.join(textwrap.wrap(text, width=text_width, **kwargs))
 
     if left_align:
         fmt = '%-*s%s%s'
@@ -63,8 +140,80 @@ def format_results(terminal_width, key_list, separator, text_list,
             yield fmt % (key_width, key, separator, text)
 
 
-def download_file(url, filename, quiet=True, reporthook_kwargs=None):
-    """Downloads a file with optional progress report."""
+def pooled_session(session=None, pool_size=10, timeout=None):
+    """Returns a requests session able to keep ``pool_size`` connections per host.
+
+    ``timeout`` applies to the requests not given one, in seconds or as a
+    ``(connect, read)`` pair.
+    """
+    import requests
+    if session is None:
+        session = requests.Session()
+    adapter_kwargs = {'pool_connections': pool_size, 'pool_maxsize': pool_size}
+    session.mount('http://', _http_adapter(timeout, **adapter_kwargs))
+    session.mount('https://', _http_adapter(timeout, **adapter_kwargs))
+    return session
+
+
+def _http_adapter(timeout, **kwargs):
+    import requests
+    if timeout is None:
+        return requests.adapters.HTTPAdapter(**kwargs)
+
+    class HTTPAdapter(requests.adapters.HTTPAdapter):
+        def send(self, request, **send_kwargs):
+            if send_kwargs.get('timeout') is None:
+                send_kwargs['timeout'] = timeout
+            return super(HTTPAdapter, self).send(request, **send_kwargs)
+
+    return HTTPAdapter(**kwargs)
+
+
+def retry_delay(attempt, backoff=DEFAULT_BACKOFF):
+    """Returns the seconds to wait after the given failed attempt, from 0."""
+    return min(backoff * 2 ** attempt, MAX_BACKOFF)
+
+
+class ChecksumError(ValueError):
+    """Downloaded data does not match the expected checksum."""
+
+
+def download_file(url, filename, quiet=True, reporthook_kwargs=None,
+                  reporthook=None, session=None, segments=1, checksum=None, sinks=(),
+                  throttle=None, mirrors=(), timeout=None, low_speed=None, retries=0,
+                  backoff=DEFAULT_BACKOFF):
+    """Downloads a file with optional progress report.
+
+    A given ``reporthook`` takes precedence over the default progress bar and
+    is left open for the caller to close. HTTP requests go through
+    ``session`` when given. With ``segments`` greater than one, large HTTP
+    files are fetched in that many byte ranges over parallel connections.
+
+    An ``(algorithm, hexdigest)`` pair in ``checksum`` is verified against
+    the data as it is written, raising ``ChecksumError`` on mismatch. The
+    ``update`` method of each of the ``sinks`` is called with the data too,
+    as a buffer only valid during the call.
+
+    ``throttle`` is called with the size of every chunk read from the
+    network, before it is written, and may block to limit the bandwidth.
+    Progress is reported at most every ``REPORT_INTERVAL`` seconds.
+
+    ``mirrors`` are other urls of the same file: a partial download from any
+    of them is resumed, as long as the sizes match. ``timeout`` is given to
+    requests, in seconds or as a ``(connect, read)`` pair. With ``low_speed``,
+    a ``(bytes_per_second, seconds)`` pair, the transfer is aborted when it
+    stays slower than that for that long.
+
+    Failed transfers are retried up to ``retries`` times, after ``backoff``
+    seconds doubled on each attempt, resuming from the data already written.
+    HTTP errors are only retried for 5xx and 429 statuses. Sinks and
+    reporthook wrapped in ``ReplaySinks`` and ``ReplayReportHook`` keep
+    track of the data they got across calls.
+
+    Returns the ``etag`` and ``last_modified`` validators of the file, empty
+    for FTP downloads.
+    """
+    import toolz
     if '://' not in url:
         raise ValueError("fully qualified URL required: %s" % url)
     if url.partition('://')[0] not in ('https', 'http', 'ftp'):
@@ -72,40 +221,723 @@ def download_file(url, filename, quiet=True, reporthook_kwargs=None):
 
     if url.startswith('ftp://'):
         retrieve = _urlretrieve
+    elif segments > 1:
+        retrieve = toolz.partial(_urlretrieve_segmented, session=session, segments=segments,
+                                 mirrors=mirrors)
     else:
-        retrieve = _urlretrieve_requests
+        retrieve = toolz.partial(_urlretrieve_requests, session=session, mirrors=mirrors)
+    retrieve = toolz.partial(retrieve, throttle=throttle, timeout=timeout, low_speed=low_speed)
 
-    if quiet:
-        return retrieve(url, filename)
+    if not isinstance(sinks, ReplaySinks):
+        sinks = ReplaySinks(sinks)
+    progress = None
+    if reporthook is None and not quiet:
+        reporthook_kwargs = reporthook_kwargs or {}
+        if filename:
+            reporthook_kwargs.setdefault('desc', filename)
 
-    reporthook_kwargs = reporthook_kwargs or {}
-    if filename:
-        reporthook_kwargs.setdefault('desc', filename)
+        reporthook_kwargs.setdefault('unit', 'b')
+        reporthook_kwargs.setdefault('unit_scale', True)
+
+        reporthook = progress = _ReportHook(**reporthook_kwargs)
+    if reporthook is not None and not isinstance(reporthook, ReplayReportHook):
+        reporthook = ReplayReportHook(reporthook)
+
+    try:
+        for attempt in itertools.count():
+            # Each attempt feeds the data from the start of the file.
+            sinks.restart()
+            if reporthook is not None:
+                reporthook.restart()
+            attempt_sinks = [sinks] if sinks.sinks else []
+            if checksum:
+                hasher = hashlib.new(checksum[0])
+                attempt_sinks.append(hasher)
+            try:
+                validators = retrieve(url, filename, reporthook, sinks=attempt_sinks)
+                break
+            except IOError as e:
+                if attempt >= retries or not _is_retriable(e):
+                    raise
+                delay = retry_delay(attempt, backoff)
+                logger.warning("Downloading %s failed (%s), retrying in %ss", url, e, delay)
+                time.sleep(delay)
+    finally:
+        if progress is not None:
+            progress.close()
 
-    reporthook_kwargs.setdefault('unit', 'b')
-    reporthook_kwargs.setdefault('unit_scale', True)
+    if checksum and hasher.hexdigest() != checksum[1].lower():
+        raise ChecksumError("%s mismatch for %s: expected %s, got %s" % (
+            checksum[0], url, checksum[1], hasher.hexdigest()))
+    return validators or {}
 
-    reporthook = _ReportHook(**reporthook_kwargs)
-    retrieve = _urlretrieve if url.startswith('ftp://') else _urlretrieve_requests
-    with contextlib.closing(reporthook):
-        retrieve(url, filename, reporthook)
 
+def _is_retriable(error):
+    response = getattr(error, 'response', None)
+    if response is not None:
+        return response.status_code >= 500 or response.status_code == 429
+    return True
+
+
+class ReplaySinks(object):
+    """Passes the data of a download to ``sinks`` once across attempts.
+
+    Each attempt feeds the file from its start, once ``restart`` is called.
+    The bytes the sinks already got are skipped. When an attempt writes the
+    file again below them, the sinks are aborted and new ones are made by
+    ``factory``, which replaces ``sinks`` when given.
+    """
+
+    def __init__(self, sinks=(), factory=None):
+        self.factory = factory
+        self.sinks = list(factory() if factory else sinks)
+        self.fed = 0
+        self.position = 0
 
-def _urlretrieve_requests(url, filename, reporthook=None):
-    resp = requests.get(url, stream=True)
+    def restart(self):
+        self.position = 0
+
+    def rewind(self, offset):
+        """Tells that the file is written again from ``offset``."""
+        if offset >= self.fed:
+            return
+        if self.factory is None:
+            raise ValueError("The download restarted, its sinks cannot be fed again")
+        self.abort()
+        self.sinks = list(self.factory())
+        self.fed = 0
+
+    def close(self):
+        for sink in self.sinks:
+            if hasattr(sink, 'close'):
+                sink.close()
+
+    def abort(self):
+        for sink in self.sinks:
+            if hasattr(sink, 'abort'):
+                sink.abort()
+
+    def update(self, data):
+        end = self.position + len(data)
+        if end > self.fed:
+            chunk = data[self.fed - self.position:] if self.fed > self.position else data
+            for sink in self.sinks:
+                sink.update(chunk)
+            self.fed = end
+        self.position = end
+
+
+class ReplayReportHook(object):
+    """Reports the bytes of a download once across attempts, like ``ReplaySinks``."""
+
+    def __init__(self, reporthook):
+        self.reporthook = reporthook
+        self.started = False
+        self.reported = 0
+        self.position = 0
+
+    def restart(self):
+        self.position = 0
+
+    def __call__(self, block_number, block_size, total_size):
+        if block_number == 0:
+            if not self.started:
+                self.started = True
+                self.reporthook(0, block_size, total_size)
+            return
+        end = self.position + block_size
+        if end > self.reported:
+            self.reporthook(block_number, end - max(self.reported, self.position), total_size)
+            self.reported = end
+        self.position = end
+
+
+def _urlretrieve(url, filename, reporthook=None, sinks=(), throttle=None, timeout=None,
+                 low_speed=None):
+    from six.moves.urllib.request import urlopen
+    if timeout is None:
+        resp = urlopen(url)
+    else:
+        resp = urlopen(url, timeout=max(timeout) if isinstance(timeout, tuple) else timeout)
+    _rewind_sinks(sinks, 0)
     fp = open(filename, 'wb')
-    with contextlib.closing(resp), fp:
-        chunk_num = 0
-        chunk_size = 64 * 1024
-        total = int(resp.headers.get('content-length', -1))
-        if reporthook:
-            reporthook(chunk_num, chunk_size, total)
-        for chunk in resp.iter_content(chunk_size=chunk_size):
-            if chunk:  # skip keep alive chunks
+    # The watch cannot interrupt a blocked read, the timeout does.
+    watch = _LowSpeedWatch(None, *low_speed) if low_speed else None
+    try:
+        with contextlib.closing(resp), fp:
+            chunk_num = 0
+            chunk_size = 64 * 1024
+            total = int(resp.headers.get('content-length') or -1)
+            if reporthook:
+                reporthook(chunk_num, chunk_size, total)
+            for chunk in iter(lambda: resp.read(chunk_size), b''):
+                if watch is not None:
+                    watch.update(len(chunk))
+                    watch.check()
+                if throttle:
+                    throttle(len(chunk))
                 fp.write(chunk)
+                for sink in sinks:
+                    sink.update(chunk)
                 chunk_num += 1
                 if reporthook:
-                    reporthook(chunk_num, chunk_size, total)
+                    reporthook(chunk_num, len(chunk), total)
+    finally:
+        if watch is not None:
+            watch.close()
+
+
+def _urlretrieve_requests(url, filename, reporthook=None, session=None, sinks=(),
+                          throttle=None, mirrors=(), timeout=None, low_speed=None):
+    """Downloads ``url`` into ``filename``, resuming a previous partial download.
+
+    The validators of the response are kept in a ``<filename>.resume`` file
+    while the download is in progress. If the download is interrupted, the
+    next call requests only the missing bytes and appends them, as long as
+    the server confirms it is the same version of the file. Otherwise, the
+    file is downloaded from the start. A partial download from one of the
+    ``mirrors`` is resumed if the server returns the rest of a file of the
+    same size.
+
+    Each written chunk is passed to the ``update`` method of the ``sinks``.
+    """
+    import requests
+    http = session or requests
+    resume_filename = filename + '.resume'
+    resume_info = _read_resume_info(resume_filename, url, mirrors=mirrors)
+    offset = 0
+    headers = {'Accept-Encoding': 'identity'}
+    if resume_info and os.path.exists(filename) and not resume_info.get('preallocated'):
+        # The size of a preallocated file does not tell how much was written.
+        offset = os.path.getsize(filename)
+    same_url = not resume_info or resume_info['url'] == url
+    if offset:
+        headers['Range'] = 'bytes=%d-' % offset
+        # The validators of another server do not apply.
+        validator = same_url and _if_range_validator(resume_info)
+        if validator:
+            headers['If-Range'] = validator
+
+    resp = http.get(url, stream=True, headers=headers, timeout=timeout)
+    if offset and resp.status_code == 416 and resume_info.get('total') == offset:
+        # Nothing left to download.
+        resp.close()
+        _feed_file(filename, sinks, offset)
+        if reporthook:
+            reporthook(0, 0, offset)
+        os.unlink(resume_filename)
+        return _validator_fields(resume_info)
+
+    if offset and not _can_resume(resp, offset, resume_info, same_url=same_url):
+        resp.close()
+        offset = 0
+        del headers['Range']
+        headers.pop('If-Range', None)
+        resp = http.get(url, stream=True, headers=headers, timeout=timeout)
+    resp.raise_for_status()
+
+    if offset:
+        total = _parse_content_range(resp.headers['content-range'])[2]
+        if total is None:
+            total = -1
+        info = dict(resume_info, url=url, **_validators(resp)) if not same_url else resume_info
+    else:
+        total = int(resp.headers.get('content-length', -1))
+        info = dict(_validators(resp), url=url, total=total if total >= 0 else None)
+
+    _rewind_sinks(sinks, offset)
+    _feed_file(filename, sinks, offset)
+    fp = open(filename, 'r+b' if offset else 'wb')
+    with contextlib.closing(resp), fp:
+        fp.seek(offset)
+        preallocated = _preallocate(fp.fileno(), offset, total - offset)
+        _write_resume_info(resume_filename, dict(info, preallocated=preallocated))
+        try:
+            _copy_response(resp, fp, reporthook, total, offset=offset, sinks=sinks,
+                           throttle=throttle, low_speed=low_speed)
+        finally:
+            # Drop the space reserved and not written.
+            fp.truncate()
+            if preallocated:
+                _write_resume_info(resume_filename, info)
+    os.unlink(resume_filename)
+    return _validator_fields(info)
+
+
+def _copy_response(resp, fp, reporthook=None, total=-1, offset=0, sinks=(), throttle=None,
+                   low_speed=None):
+    """Writes the body of a streamed response to ``fp``.
+
+    ``offset`` is the number of bytes already downloaded before.
+    """
+    report = _ProgressReport(reporthook, total)
+    if reporthook:
+        reporthook(0, MIN_BUFFER_SIZE, total)
+        # Account for the bytes downloaded previously.
+        report.update(offset)
+    try:
+        for chunk in _iter_response(resp, low_speed=low_speed):
+            if throttle:
+                throttle(len(chunk))
+            fp.write(chunk)
+            for sink in sinks:
+                sink.update(chunk)
+            report.update(len(chunk))
+    finally:
+        report.flush()
+
+
+def _iter_response(resp, low_speed=None):
+    """Yields the body of a streamed response in a reused buffer.
+
+    The chunks are memoryviews only valid until the next one is read. They
+    are read straight from the connection into a buffer sized to the
+    throughput, falling back to ``iter_content`` for encoded responses.
+
+    With ``low_speed``, a ``(bytes_per_second, seconds)`` pair, the
+    connection is shut down when the transfer stays slower than that.
+    """
+    if not low_speed:
+        for chunk in _read_response(resp):
+            yield chunk
+        return
+    limit, seconds = low_speed
+    watch = _LowSpeedWatch(_response_socket(resp), limit, seconds)
+    try:
+        # Reads block until the buffer is full, keep them short enough
+        # to measure the speed.
+        for chunk in _read_response(resp, min_size=max(min(MIN_BUFFER_SIZE, int(limit)), 1024)):
+            watch.update(len(chunk))
+            yield chunk
+        watch.check()
+    except IOError:
+        watch.check()
+        raise
+    finally:
+        watch.close()
+
+
+def _read_response(resp, min_size=MIN_BUFFER_SIZE):
+    import http.client
+    raw = getattr(resp.raw, '_fp', None)
+    if (not hasattr(raw, 'readinto')
+            or resp.headers.get('content-encoding', 'identity').lower() != 'identity'):
+        for chunk in resp.iter_content(chunk_size=MIN_BUFFER_SIZE):
+            if chunk:  # skip keep alive chunks
+                yield memoryview(chunk)
+        return
+
+    length = int(resp.headers.get('content-length', -1))
+    buf = memoryview(bytearray(MAX_BUFFER_SIZE if length < 0 else
+                               max(min(length, MAX_BUFFER_SIZE), 1)))
+    size = min(min_size, len(buf))
+    received = 0
+    while True:
+        started = time.monotonic()
+        try:
+            count = raw.readinto(buf[:size])
+        except http.client.HTTPException as e:
+            raise IOError("Connection broken: %r" % e)
+        if not count:
+            break
+        received += count
+        elapsed = time.monotonic() - started
+        yield buf[:count]
+        if count == size and elapsed < READ_INTERVAL / 2:
+            size = min(size * 2, len(buf))
+        elif elapsed > READ_INTERVAL * 2:
+            size = max(size // 2, min_size)
+    if received < length:
+        # Unlike urllib3, http.client does not check the length.
+        raise IOError("Connection broken: got %d of %d bytes" % (received, length))
+    # Read through, the connection can be reused.
+    resp.raw.release_conn()
+
+
+def _response_socket(resp):
+    connection = getattr(resp.raw, 'connection', None)
+    sock = getattr(connection, 'sock', None)
+    if sock is None:
+        # http.client lets go of the connections closed after the response,
+        # the body is still read from the socket file.
+        fp = getattr(getattr(resp.raw, '_fp', None), 'fp', None)
+        sock = getattr(getattr(fp, 'raw', None), '_sock', None)
+    return sock
+
+
+class _LowSpeedWatch(object):
+    """Drops a transfer slower than ``limit`` bytes per second for ``seconds``.
+
+    A thread samples the bytes received and shuts down ``sock`` to interrupt
+    the blocked read. ``check`` raises ``IOError`` once the transfer is
+    aborted.
+    """
+
+    def __init__(self, sock, limit, seconds):
+        self.sock = sock
+        self.limit = limit
+        self.seconds = seconds
+        self.received = 0
+        self.aborted = False
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self._watch)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def update(self, size):
+        self.received += size
+
+    def check(self):
+        if self.aborted:
+            raise IOError("Transfer slower than %d bytes/s for %ss" % (self.limit, self.seconds))
+
+    def close(self):
+        self.done.set()
+
+    def _watch(self):
+        # Samples over the last ``seconds``, the first one at least as old.
+        samples = collections.deque([(time.monotonic(), 0)])
+        while not self.done.wait(min(self.seconds, 1.)):
+            now, received = time.monotonic(), self.received
+            while len(samples) > 1 and now - samples[1][0] >= self.seconds:
+                samples.popleft()
+            started, start_received = samples[0]
+            if now - started >= self.seconds and \
+                    received - start_received < self.limit * (now - started):
+                self.aborted = True
+                if self.sock is not None:
+                    try:
+                        self.sock.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+                return
+            samples.append((now, received))
+
+
+def _preallocate(fd, offset, size):
+    """Reserves the disk space of ``size`` bytes from ``offset``.
+
+    Returns whether it did, the file size is then ``offset + size``.
+    """
+    if size < MIN_PREALLOCATE_SIZE or not hasattr(os, 'posix_fallocate'):
+        return False
+    try:
+        os.posix_fallocate(fd, offset, size)
+    except OSError:
+        # Not supported by the file system.
+        return False
+    return True
+
+
+class _ProgressReport(object):
+    """Passes the bytes read to a reporthook at most every ``interval`` seconds."""
+
+    def __init__(self, reporthook, total, interval=REPORT_INTERVAL):
+        self.reporthook = reporthook
+        self.total = total
+        self.interval = interval
+        self.blocks = 0
+        self.pending = 0
+        self.reported = time.monotonic()
+        self.lock = threading.Lock()
+
+    def update(self, size):
+        if self.reporthook is None or not size:
+            return
+        with self.lock:
+            self.pending += size
+            now = time.monotonic()
+            if now - self.reported >= self.interval:
+                self._report(now)
+
+    def flush(self):
+        if self.reporthook is None:
+            return
+        with self.lock:
+            if self.pending:
+                self._report(time.monotonic())
+
+    def _report(self, now):
+        self.blocks += 1
+        self.reporthook(self.blocks, self.pending, self.total)
+        self.pending = 0
+        self.reported = now
+
+
+def download_if_modified(url, filename, validators=None, session=None, quiet=True,
+                         reporthook_kwargs=None):
+    """Downloads ``url`` unless it is unchanged since a previous download.
+
+    ``validators`` holds the ``etag`` and ``last_modified`` values returned
+    by the previous call. Returns the new validators, or ``None`` without
+    writing ``filename`` when the server replies 304 Not Modified.
+    """
+    import requests
+    headers = _conditional_headers(validators or {})
+    resp = (session or requests).get(url, stream=True, headers=headers)
+    with contextlib.closing(resp):
+        if resp.status_code == 304:
+            return None
+        resp.raise_for_status()
+        reporthook = None
+        if not quiet:
+            reporthook = _ReportHook(**dict(reporthook_kwargs or {}, unit='b', unit_scale=True))
+        total = int(resp.headers.get('content-length', -1))
+        try:
+            with open(filename, 'wb') as fp:
+                _copy_response(resp, fp, reporthook, total)
+        finally:
+            if reporthook:
+                reporthook.close()
+    return _validators(resp)
+
+
+def not_modified(url, validators, session=None, timeout=None):
+    """Returns whether the server confirms ``url`` is unchanged since ``validators``."""
+    import requests
+    headers = _conditional_headers(validators or {})
+    if not headers or not url.startswith(('http://', 'https://')):
+        return False
+    resp = (session or requests).head(url, allow_redirects=True, timeout=timeout,
+                                      headers=dict(headers, **{'Accept-Encoding': 'identity'}))
+    resp.close()
+    return resp.status_code == 304
+
+
+def _conditional_headers(validators):
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+    return headers
+
+
+def _urlretrieve_segmented(url, filename, reporthook=None, session=None, segments=4,
+                           min_segment_size=MIN_SEGMENT_SIZE, sinks=(), throttle=None,
+                           mirrors=(), timeout=None, low_speed=None):
+    """Downloads ``url`` in byte ranges fetched over parallel connections.
+
+    Each range is written in place into the preallocated ``filename``. The
+    progress of every range is kept in ``<filename>.resume`` so an interrupted
+    download continues where each range stopped. Falls back to a single
+    stream when the server does not accept ranges or the file is small.
+
+    As ranges arrive out of order, ``sinks`` are fed by reading the file back
+    once it is complete.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import requests
+    http = session or requests
+    head = http.head(url, allow_redirects=True, headers={'Accept-Encoding': 'identity'},
+                     timeout=timeout)
+    total = int(head.headers.get('content-length', -1))
+    if (not head.ok or head.headers.get('accept-ranges', '').lower() != 'bytes'
+            or total < 2 * min_segment_size):
+        return _urlretrieve_requests(url, filename, reporthook, session=session, sinks=sinks,
+                                     throttle=throttle, mirrors=mirrors, timeout=timeout,
+                                     low_speed=low_speed)
+
+    resume_filename = filename + '.resume'
+    info = dict(_validators(head), url=url, total=total)
+    previous = _read_resume_info(resume_filename, url, segmented=None, mirrors=mirrors)
+    if previous and os.path.exists(filename) and _same_version(previous, info):
+        ranges = previous.get('segments')
+        if ranges is None:
+            # Continue a partial single stream download.
+            done = 0 if previous.get('preallocated') else os.path.getsize(filename)
+            ranges = _plan_segments(total, segments, done=done)
+    else:
+        ranges = _plan_segments(total, segments)
+        if os.path.exists(filename):
+            os.unlink(filename)
+        _rewind_sinks(sinks, 0)
+    info['segments'] = ranges
+    _write_resume_info(resume_filename, info)
+
+    fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o644)
+    report = _ProgressReport(reporthook, total)
+    state = {'stop': False}
+    headers = {'Accept-Encoding': 'identity'}
+    validator = _if_range_validator(info)
+    if validator:
+        headers['If-Range'] = validator
+
+    def fetch(segment):
+        position, end = segment[1], segment[2]
+        if position >= end:
+            return
+        resp = http.get(url, stream=True, headers=dict(headers, Range='bytes=%d-%d' % (position, end - 1)),
+                        timeout=timeout)
+        with contextlib.closing(resp):
+            resp.raise_for_status()
+            if resp.status_code != 206 or _parse_content_range(resp.headers['content-range'])[0] != position:
+                raise IOError("server did not honor the range request for %s" % url)
+            for chunk in _iter_response(resp, low_speed=low_speed):
+                if state['stop']:
+                    break
+                chunk = chunk[:end - position]
+                if throttle:
+                    throttle(len(chunk))
+                _pwrite(fd, chunk, position)
+                position += len(chunk)
+                segment[1] = position
+                report.update(len(chunk))
+                if position >= end:
+                    break
+        if position < end:
+            raise IOError("incomplete range %d-%d for %s" % (segment[0], end - 1, url))
+
+    executor = ThreadPoolExecutor(max_workers=len(ranges))
+    try:
+        os.ftruncate(fd, total)
+        _preallocate(fd, 0, total)
+        if reporthook:
+            reporthook(0, 0, total)
+            report.update(sum(position - start for start, position, _ in ranges))
+        for future in [executor.submit(fetch, segment) for segment in ranges]:
+            future.result()
+    except BaseException:
+        # Let the other connections finish early.
+        state['stop'] = True
+        raise
+    finally:
+        executor.shutdown(wait=True)
+        os.close(fd)
+        report.flush()
+        _write_resume_info(resume_filename, info)
+    _feed_file(filename, sinks, total)
+    os.unlink(resume_filename)
+    return _validator_fields(info)
+
+
+def _rewind_sinks(sinks, offset):
+    """Tells the ``ReplaySinks`` in ``sinks`` that the file is written from ``offset``."""
+    for sink in sinks:
+        if isinstance(sink, ReplaySinks):
+            sink.rewind(offset)
+
+
+def _feed_file(filename, sinks, size, chunk_size=1024 * 1024):
+    """Passes the first ``size`` bytes of ``filename`` to ``sinks``."""
+    if not sinks or not size:
+        return
+    with open(filename, 'rb') as fp:
+        while size > 0:
+            chunk = fp.read(min(size, chunk_size))
+            if not chunk:
+                break
+            for sink in sinks:
+                sink.update(chunk)
+            size -= len(chunk)
+
+
+def _plan_segments(total, count, done=0):
+    """Splits the remaining bytes in ``count`` ``[start, position, end]`` ranges."""
+    ranges = []
+    if done:
+        ranges.append([0, done, done])
+    size = -(-(total - done) // count)
+    for start in range(done, total, size):
+        ranges.append([start, start, min(start + size, total)])
+    return ranges
+
+
+def _pwrite(fd, data, offset):
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+
+def _same_version(previous, current):
+    if previous.get('total') != current['total']:
+        return False
+    if previous.get('url') != current['url']:
+        # Another mirror, only the size tells it is the same file.
+        return True
+    for field in ('etag', 'last_modified'):
+        if previous.get(field) != current.get(field):
+            return False
+    return bool(current.get('etag') or current.get('last_modified'))
+
+
+def _read_resume_info(filename, url, segmented=False, mirrors=()):
+    """Returns the resume info for ``url`` or one of its ``mirrors``.
+
+    ``segmented`` selects the info of a segmented download, a single stream
+    download or either of them when ``None``.
+    """
+    try:
+        with open(filename) as fp:
+            info = json.load(fp)
+    except (IOError, ValueError):
+        return None
+    if info.get('url') != url and info.get('url') not in mirrors:
+        return None
+    if segmented is not None and segmented != ('segments' in info):
+        return None
+    return info
+
+
+def _validators(resp):
+    return {
+        'etag': resp.headers.get('etag'),
+        'last_modified': resp.headers.get('last-modified'),
+    }
+
+
+def _validator_fields(info):
+    return {'etag': info.get('etag'), 'last_modified': info.get('last_modified')}
+
+
+def _write_resume_info(filename, info):
+    with open(filename, 'w') as fp:
+        json.dump(info, fp)
+
+
+def _if_range_validator(info):
+    # If-Range requires a strong validator.
+    etag = info.get('etag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return info.get('last_modified')
+
+
+def _can_resume(resp, offset, info, same_url=True):
+    """Returns whether the response continues the same file from ``offset``.
+
+    ``same_url`` is false when resuming the download of another mirror.
+    """
+    if resp.status_code != 206:
+        # The server ignored the range or the file has changed.
+        return False
+    try:
+        start, _, total = _parse_content_range(resp.headers['content-range'])
+    except (KeyError, ValueError):
+        return False
+    if start != offset:
+        return False
+    if info.get('total') is not None and total != info['total']:
+        return False
+    if not same_url:
+        return info.get('total') is not None
+    for header, field in [('etag', 'etag'), ('last-modified', 'last_modified')]:
+        value = resp.headers.get(header)
+        if value and info.get(field) and value != info[field]:
+            return False
+    # Without any validator we cannot tell whether the file has changed.
+    return bool(info.get('etag') or info.get('last_modified'))
+
+
+def _parse_content_range(value):
+    """Returns ``(start, end, total)`` from a ``Content-Range`` header value."""
+    match = re.match(r'bytes\s+(\d+)-(\d+)/(\d+|\*)$', value.strip())
+    if not match:
+        raise ValueError("invalid Content-Range: %r" % value)
+    start, end, total = match.groups()
+    return int(start), int(end), (None if total == '*' else int(total))
 
 
 class _ReportHook(object):
@@ -117,6 +949,7 @@ class _ReportHook(object):
 
     def __call__(self, block_number, block_size, total_size):
         if self.pb is None:  # First call.
+            import tqdm
             self.pb = tqdm.tqdm(**dict(self.params, total=total_size))
         if block_number > 0:
             self.pb.update(block_size)
@@ -127,6 +960,36 @@ class _ReportHook(object):
             self.pb = None
 
 
+class AggregateProgress(object):
+    """A single tqdm progress bar shared by concurrent downloads."""
+
+    def __init__(self, **params):
+        import tqdm
+        params.setdefault('unit', 'b')
+        params.setdefault('unit_scale', True)
+        self.pb = tqdm.tqdm(**dict(params, total=0))
+        self.lock = threading.Lock()
+
+    def reporthook(self):
+        """Returns a reporthook for one download feeding the shared bar."""
+        state = {'started': False}
+
+        def hook(block_number, block_size, total_size):
+            with self.lock:
+                if not state['started']:
+                    state['started'] = True
+                    if total_size > 0:
+                        self.pb.total += total_size
+                        self.pb.refresh()
+                if block_number > 0:
+                    self.pb.update(block_size)
+
+        return hook
+
+    def close(self):
+        self.pb.close()
+
+
 @contextlib.contextmanager
 def debugger():
     try:
@@ -136,4 +999,5 @@ def debugger():
     except Exception:
         info = sys.exc_info()
         traceback.print_exception(*info)
+        import pdb
         pdb.post_mortem(info[2])
@@ -0,0 +1,133 @@
+import email.utils
+import hashlib
+import os
+import re
+import threading
+
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+import pytest
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Serves static files with support for single byte ranges.
+
+    With ``fail_after`` set, the connection is dropped after sending that
+    many bytes of a body.
+    """
+
+    accept_ranges = True
+    fail_after = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._send(head=True)
+
+    def do_GET(self):
+        self._send(head=False)
+
+    def _send(self, head):
+        self.server.log.append((self.command, self.path, dict(self.headers)))
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        stat = os.stat(path)
+        size = stat.st_size
+        etag = '"%s"' % hashlib.md5(('%s-%s' % (size, stat.st_mtime)).encode()).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        start, end = 0, size - 1
+        status = 200
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if self.accept_ranges and range_header and (not if_range or if_range == etag):
+            match = re.match(r'bytes=(\d+)-(\d*)$', range_header)
+            if match:
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(int(match.group(2)), size - 1)
+                if start >= size:
+                    self.send_response(416)
+                    self.send_header('Content-Range', 'bytes */%d' % size)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                status = 206
+        self.send_response(status)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', email.utils.formatdate(stat.st_mtime, usegmt=True))
+        if self.accept_ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, size))
+        self.end_headers()
+        if head:
+            return
+        with open(path, 'rb') as fp:
+            fp.seek(start)
+            remaining = end - start + 1
+            if self.fail_after is not None:
+                remaining = min(remaining, self.fail_after)
+                self.close_connection = True
+            while remaining > 0:
+                chunk = fp.read(min(remaining, 64 * 1024))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+
+class HTTPOrigin(object):
+    """A local HTTP server serving files from a directory."""
+
+    def __init__(self, root, handler=RangeRequestHandler):
+        self.root = str(root)
+        root_dir = self.root
+
+        class Handler(handler):
+            def __init__(self, *args, **kwargs):
+                kwargs['directory'] = root_dir
+                super(Handler, self).__init__(*args, **kwargs)
+
+        self.handler = Handler
+        self.server = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.log = self.log = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_file(self, name, data):
+        path = os.path.join(self.root, name)
+        with open(path, 'wb') as fp:
+            fp.write(data)
+        return self.url(name)
+
+    def url(self, name):
+        host, port = self.server.server_address
+        return 'http://%s:%d/%s' % (host, port, name)
+
+
+@pytest.fixture
+def http_origin(tmpdir):
+    origin = HTTPOrigin(tmpdir.mkdir('origin'))
+    origin.start()
+    yield origin
+    origin.stop()
@@ -0,0 +1,71 @@
+import mmap
+import os
+
+import pytest
+
+from databrewer.api import Library
+from databrewer.catalog import CatalogWriter, FileTableWriter
+from databrewer.config import get_config
+from databrewer.recipes import summarize
+from databrewer.search import SearchIndex
+
+
+@pytest.fixture
+def library(tmpdir, http_origin):
+    root_dir = tmpdir.mkdir('root')
+    index_dir = root_dir.mkdir('index')
+    recipe = {'name': 'demo', 'files': [
+        {'name': 'a', 'url': http_origin.add_file('a.csv', b'x,y\n1,2\n')},
+        {'name': 'b', 'url': http_origin.add_file('b.csv', b'')},
+    ]}
+    catalog = CatalogWriter(str(index_dir))
+    catalog.add(summarize(recipe))
+    catalog.commit()
+    files = FileTableWriter(str(index_dir))
+    files.add(recipe)
+    files.commit()
+    with SearchIndex(str(index_dir)) as index:
+        index.update([recipe])
+    config = get_config(str(tmpdir.join('missingrc')), override={
+        'root_dir': str(root_dir),
+        'datasets_dir': str(root_dir.join('datasets')),
+    })
+    with Library(config) as library:
+        yield library
+
+
+def test_resolve(library):
+    assert library.get_recipe('demo')['file_count'] == 2
+    specs = library.resolve('demo')
+    assert [spec['name'] for spec in specs] == ['demo[a]', 'demo[b]']
+    assert specs[0]['path'] == os.path.join(library.config['datasets_dir'], 'demo', 'a.csv')
+    assert [spec['name'] for spec in library.resolve('demo[b]')] == ['demo[b]']
+    with pytest.raises(LookupError):
+        library.resolve('missing')
+
+
+def test_get_recipe_without_catalog(library):
+    summary = library.get_recipe('demo')
+    library.close()
+    os.unlink(os.path.join(library.config['index_dir'], 'catalog.bin'))
+    assert library.get_recipe('demo') == summary
+    assert library.get_recipe('missing') is None
+    assert [spec['name'] for spec in library.resolve('demo')] == ['demo[a]', 'demo[b]']
+
+
+def test_open(library, http_origin):
+    with pytest.raises(IOError):
+        library.open('demo[a]', download=False)
+    with pytest.raises(LookupError):
+        library.open('demo')
+
+    with library.open('demo[a]') as buf:
+        assert isinstance(buf, mmap.mmap)
+        assert bytes(buf) == b'x,y\n1,2\n'
+    requests = len(http_origin.log)
+    with library.open('demo[a]', mmap=False) as fp:
+        assert fp.read() == b'x,y\n1,2\n'
+    assert len(http_origin.log) == requests
+
+    with library.open('demo[b]') as fp:
+        assert fp.read() == b''
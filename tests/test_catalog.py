@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from databrewer import recipes
+from databrewer.catalog import Catalog, CatalogWriter, FileTable, FileTableWriter
+
+
+def test_catalog(tmpdir):
+    index_dir = str(tmpdir)
+    recipes = [
+        {'name': 'b-dataset', 'description': u'Café data', 'url': 'http://example.com/b.csv'},
+        {'name': 'a-dataset', 'files': [{'name': 'x', 'url': 'http://example.com/x.csv'}]},
+        {'name': 'c-dataset', 'description': 'Third'},
+    ]
+    writer = CatalogWriter(index_dir)
+    for recipe in recipes:
+        writer.add(recipe)
+    writer.commit()
+
+    with Catalog(index_dir) as catalog:
+        assert len(catalog) == 3
+        assert list(catalog.list()) == [
+            {'name': 'a-dataset', 'description': ''},
+            {'name': 'b-dataset', 'description': u'Café data'},
+            {'name': 'c-dataset', 'description': 'Third'},
+        ]
+        for recipe in recipes:
+            assert catalog.get(recipe['name']) == recipe
+        assert catalog.get('0-dataset') is None
+        assert catalog.get('b') is None
+        assert catalog.get('d-dataset') is None
+
+        # Records can be copied without decoding them.
+        writer = CatalogWriter(index_dir)
+        for name, description, payload in catalog.items():
+            if name != 'b-dataset':
+                writer.add_payload(name, description, payload)
+        writer.commit()
+
+    with Catalog(index_dir) as catalog:
+        assert [item['name'] for item in catalog.list()] == ['a-dataset', 'c-dataset']
+        assert catalog.get('c-dataset') == recipes[2]
+
+
+def test_empty_catalog(tmpdir):
+    assert not Catalog.exists(str(tmpdir))
+    CatalogWriter(str(tmpdir)).commit()
+    with Catalog(str(tmpdir)) as catalog:
+        assert len(catalog) == 0
+        assert catalog.get('any') is None
+
+
+def _nested(name, fanout):
+    return {'name': name, 'files': [
+        {'name': 'b%d' % i, 'files': [
+            {'name': 'c%d' % j, 'url': 'http://example.com/%s/%d/%d.csv' % (name, i, j)}
+            for j in range(fanout)]}
+        for i in range(fanout)]}
+
+
+def test_file_table(tmpdir):
+    index_dir = str(tmpdir)
+    foo = _nested('foo', 12)
+    others = [
+        _nested('foo-bar', 3),
+        {'name': 'fo', 'url': 'http://example.com/fo.csv'},
+        {'name': 'foo[b1', 'url': 'http://example.com/odd.csv'},
+        {'name': 'empty'},
+    ]
+    writer = FileTableWriter(index_dir)
+    for recipe in [foo] + others:
+        writer.add(recipe)
+    with pytest.raises(ValueError):
+        writer.add({'name': 'broken', 'files': [{'name': 'x', 'url': 'http://example.com/'}]})
+    writer.commit()
+
+    with FileTable(index_dir) as table:
+        assert table.has_files('foo')
+        assert table.has_files('fo')
+        assert not table.has_files('empty')
+        assert not table.has_files('broken')
+        assert list(table.files('fo')) == list(recipes.iter_files(others[1]))
+
+        def names(specs):
+            return [spec['name'] for spec in specs]
+
+        assert names(table.files('foo')) == names(recipes.iter_files(foo))
+        for pattern in ['foo', 'foo*', 'foo[b1]*', 'foo[b1*', 'foo[b1][c1{01}]',
+                        'foo[b{12}]*', 'foo[*][c3]', 'foo[b11][c11]', 'foo[b99]*']:
+            assert names(table.files('foo', pattern)) == names(recipes.match_files(foo, pattern))
+        assert list(table.files('foo', 'foo[b1]*')) != []
+
+
+def test_file_table_order(tmpdir):
+    index_dir = str(tmpdir)
+    recipe = {'name': 'foo', 'files': [
+        {'name': 'z', 'url': 'http://example.com/z.csv'},
+        {'name': 'a', 'url': 'http://example.com/a1.csv'},
+        {'name': 'a', 'url': 'http://example.com/a2.csv'},
+        {'name': 'm', 'url': 'http://example.com/m.csv'},
+    ]}
+    writer = FileTableWriter(index_dir)
+    writer.add({'name': 'foo', 'url': 'http://example.com/old.csv'})
+    writer.add(recipe)
+    writer.commit()
+
+    expected = list(recipes.iter_files(recipe))
+    with FileTable(index_dir) as table:
+        assert list(table.files('foo')) == expected
+        assert list(table.files('foo', 'foo[a]')) == expected[1:3]
+
+        # Copied entries keep their position.
+        writer = FileTableWriter(index_dir)
+        for name, owner, position, payload in table.items():
+            writer.add_payload(name, owner, payload, position)
+        writer.commit()
+
+    with FileTable(index_dir) as table:
+        assert list(table.files('foo')) == expected
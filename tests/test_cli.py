@@ -0,0 +1,121 @@
+import gzip
+import io
+import json
+import os
+import zipfile
+
+import pytest
+
+from click.testing import CliRunner
+
+from databrewer import cli
+from databrewer.api import Library
+
+
+def _make_archive(files):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zf:
+        for name, content in files.items():
+            zf.writestr('recipes-master/' + name, content)
+    return buf.getvalue()
+
+
+def test_download_recipes_only_when_modified(http_origin, tmpdir):
+    recipes_dir = tmpdir.join('recipes')
+    url = http_origin.add_file('master.zip', _make_archive({
+        'a.yaml': 'name: a\n',
+        'b.yaml': 'name: b\n',
+    }))
+
+    cli._download_recipes(str(recipes_dir), url)
+    assert sorted(p.basename for p in recipes_dir.listdir('*.yaml')) == ['a.yaml', 'b.yaml']
+
+    mtime = os.path.getmtime(str(recipes_dir.join('a.yaml')))
+    os.utime(str(recipes_dir.join('a.yaml')), (mtime - 100, mtime - 100))
+    cli._download_recipes(str(recipes_dir), url)
+    assert 'If-None-Match' in http_origin.log[-1][2]
+    assert os.path.getmtime(str(recipes_dir.join('a.yaml'))) == mtime - 100
+
+    http_origin.add_file('master.zip', _make_archive({
+        'a.yaml': 'name: a\n',
+        'c.yaml': 'name: c\n',
+    }))
+    cli._download_recipes(str(recipes_dir), url)
+    assert sorted(p.basename for p in recipes_dir.listdir('*.yaml')) == ['a.yaml', 'c.yaml']
+    # Unchanged members are not extracted again.
+    assert os.path.getmtime(str(recipes_dir.join('a.yaml'))) == mtime - 100
+
+
+@pytest.fixture
+def run(tmpdir, monkeypatch):
+    """Runs the command line with its own directories and recipes."""
+    monkeypatch.setattr(cli, '_download_recipes', lambda *args, **kwargs: None)
+    monkeypatch.delenv('DATABREWERRC', raising=False)
+    recipes_dir = tmpdir.mkdir('recipes')
+    options = ['--rcfile', str(tmpdir.join('missingrc')), '--root-dir', str(tmpdir),
+               '--recipes-dir', str(recipes_dir), '--datasets-dir', str(tmpdir.join('datasets')),
+               '--quiet']
+
+    def run(*args):
+        result = CliRunner().invoke(cli.cli, options + list(args), obj={})
+        assert result.exit_code == 0, result.output
+        return result.output
+
+    run.options = options
+    run.recipes_dir = recipes_dir
+    return run
+
+
+def test_update_keeps_names_defined_twice(run):
+    recipes_dir = run.recipes_dir
+    recipes_dir.join('a.yaml').write('name: demo\ndescription: First\nurl: http://example.com/a.csv\n')
+    recipes_dir.join('b.yaml').write('name: demo\ndescription: Second\nurl: http://example.com/b.csv\n')
+    run('update')
+    recipes_dir.join('a.yaml').remove()
+    run('update')
+    assert 'Second' in run('info', 'demo')
+    # A renamed file does not drop the name either.
+    recipes_dir.join('a.yaml').write('name: demo\ndescription: First\nurl: http://example.com/a.csv\n')
+    run('update')
+    recipes_dir.join('a.yaml').write('name: other\n')
+    run('update')
+    assert [line.split()[0] for line in run('list').splitlines()] == ['demo', 'other']
+
+
+def test_search_prints_results_as_read(run, monkeypatch):
+    run.recipes_dir.join('a.yaml').write('name: demo\ndescription: Demo data\n')
+    run('update')
+
+    def search(library, query, **kwargs):
+        yield {'name': 'demo', 'description': 'Demo data'}
+        raise RuntimeError("stopped")
+
+    monkeypatch.setattr(Library, 'search', search)
+    result = CliRunner().invoke(cli.cli, run.options + ['search', 'demo'], obj={})
+    assert isinstance(result.exception, RuntimeError)
+    assert result.output.split() == ['demo', '-', 'Demo', 'data']
+
+
+def test_sync_extracted_archive(http_origin, tmpdir, run):
+    data = gzip.compress(b'a,b\n1,2\n')
+    url = http_origin.add_file('a.csv.gz', data)
+    lockfile = tmpdir.join('databrewer.lock')
+    lockfile.write(json.dumps({'version': 1, 'files': [
+        {'name': 'r[a]', 'url': url, 'filename': 'a.csv.gz', 'path': 'r/a.csv.gz',
+         'size': len(data), 'extract': True, 'keep_archive': False},
+    ]}))
+    for output in ["Downloading 1 of 1 files.", "All 1 files are up to date."]:
+        assert run('sync', '-f', str(lockfile)).startswith(output)
+    assert tmpdir.join('datasets', 'r', 'a.csv').read() == 'a,b\n1,2\n'
+    assert not tmpdir.join('datasets', 'r', 'a.csv.gz').exists()
+    assert len(http_origin.log) == 1
+
+
+def test_download_overlapping_specs_once(http_origin, run):
+    run.recipes_dir.join('demo.yaml').write(
+        'name: demo\nfiles:\n  - name: a\n    url: %s\n  - name: b\n    url: %s\n'
+        % (http_origin.add_file('a.csv', b'a'), http_origin.add_file('b.csv', b'b')))
+    run('update')
+    output = run('download', '--force', 'demo[a]', 'demo', 'demo[a]')
+    assert sorted(path for command, path, _ in http_origin.log) == ['/a.csv', '/b.csv']
+    assert output.count('demo[a]') == 2
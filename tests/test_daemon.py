@@ -0,0 +1,111 @@
+import threading
+
+import pytest
+
+from click.testing import CliRunner
+
+from databrewer import cli
+from databrewer.catalog import CatalogWriter, FileTableWriter
+from databrewer.daemon import DaemonServer
+from databrewer.recipes import summarize
+from databrewer.search import SearchIndex
+
+
+def _write_index(index_dir, recipes):
+    catalog = CatalogWriter(index_dir)
+    files = FileTableWriter(index_dir)
+    for recipe in recipes:
+        catalog.add(summarize(recipe))
+        files.add(recipe)
+    catalog.commit()
+    files.commit()
+    with SearchIndex(index_dir) as index:
+        index.update(recipes)
+
+
+@pytest.fixture
+def root(tmpdir, monkeypatch):
+    root = tmpdir.mkdir('root')
+    _write_index(str(root.mkdir('index')), [
+        {'name': 'demo', 'description': 'Demo data', 'files': [
+            {'name': 'a', 'url': 'http://example.com/a.csv'},
+            {'name': 'b', 'url': 'http://example.com/b.csv'},
+        ]},
+    ])
+    monkeypatch.setenv('DATABREWER_DAEMON_SOCKET', str(tmpdir.join('daemon.sock')))
+    monkeypatch.delenv('DATABREWERRC', raising=False)
+    root.rcfile = str(tmpdir.join('missingrc'))
+    root.socket = str(tmpdir.join('daemon.sock'))
+    root.override = {'root_dir': str(root), 'datasets_dir': str(root.join('datasets'))}
+    return root
+
+
+@pytest.fixture
+def daemon(root):
+    server = DaemonServer(root.socket, root.rcfile, root.override)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _run(root, *args):
+    obj = {}
+    options = ['--rcfile', root.rcfile, '--root-dir', root.override['root_dir'],
+               '--datasets-dir', root.override['datasets_dir']]
+    result = CliRunner().invoke(cli.cli, options + list(args), obj=obj)
+    return result, 'rc' not in obj
+
+
+COMMANDS = [
+    ['list'],
+    ['search', 'demo'],
+    ['search', '--names-only', 'demo'],
+    ['info', 'demo'],
+    ['files', 'demo[a]'],
+    ['files', 'demo[c]'],
+    ['files', 'other'],
+]
+
+
+def test_daemon_answers_commands(root):
+    local = [_run(root, *args)[0] for args in COMMANDS]
+    server = DaemonServer(root.socket, root.rcfile, root.override)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        for args, expected in zip(COMMANDS, local):
+            result, from_daemon = _run(root, *args)
+            assert from_daemon
+            # Without the progress of the files listing.
+            output = expected.output.rpartition('\r')[2]
+            assert (result.exit_code, result.output) == (expected.exit_code, output)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert not root.dirpath().join('daemon.sock').exists()
+
+
+def test_daemon_reloads_index(root, daemon):
+    _write_index(str(root.join('index')), [
+        {'name': 'other', 'description': 'Other data', 'url': 'http://example.com/c.csv'},
+    ])
+    result, from_daemon = _run(root, 'files', 'other')
+    assert from_daemon
+    assert result.output == str(root.join('datasets', 'other', 'c.csv')) + '\n'
+
+
+def test_daemon_other_config(root, daemon, tmpdir):
+    # Another datasets directory, the command runs without the daemon.
+    result, from_daemon = _run(root, '--datasets-dir', str(tmpdir.join('other')),
+                               'files', 'demo[a]')
+    assert not from_daemon
+    assert result.output == str(tmpdir.join('other', 'demo', 'a.csv')) + '\n'
+
+
+def test_daemon_socket_in_use(root, daemon):
+    with pytest.raises(IOError):
+        DaemonServer(root.socket, root.rcfile, root.override)
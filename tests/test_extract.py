@@ -0,0 +1,90 @@
+import bz2
+import gzip
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from databrewer import recipes
+from databrewer.extract import DecompressSink, ExtractError, archive_format
+
+
+def _tar(files, mode='w:gz'):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode=mode) as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def test_archive_format():
+    assert archive_format('a.tar.gz') == 'tar'
+    assert archive_format('a.TGZ') == 'tar'
+    assert archive_format('a.csv.gz') == 'gz'
+    assert archive_format('a.zip') == 'zip'
+    assert archive_format('a.csv') is None
+
+
+@pytest.mark.parametrize('fmt,compress', [('gz', gzip.compress), ('bz2', bz2.compress)])
+def test_decompress_sink(tmpdir, fmt, compress):
+    filename = str(tmpdir.join('out'))
+    # Concatenated streams, fed in small chunks.
+    data = compress(b'hello ' * 1000) + compress(b'world')
+    sink = DecompressSink(filename, fmt)
+    for i in range(0, len(data), 7):
+        sink.update(data[i:i + 7])
+    sink.close()
+    assert open(filename, 'rb').read() == b'hello ' * 1000 + b'world'
+
+    sink = DecompressSink(filename, fmt)
+    sink.update(data[:-3])
+    with pytest.raises(ExtractError):
+        sink.close()
+
+
+def test_download_extracts_tar(http_origin, tmpdir):
+    files = {'data/a.csv': b'a' * 300000, 'b.csv': b'b'}
+    spec = recipes.make_file_spec('t', http_origin.add_file('t.tar.gz', _tar(files)))
+    dest = str(tmpdir.join('dest'))
+    recipes.download(spec, dest, quiet=True, extract=True, keep_archive=False)
+    assert sorted(os.listdir(dest)) == ['b.csv', 'data', 't.tar.gz.extracted']
+    assert open(os.path.join(dest, 'data', 'a.csv'), 'rb').read() == files['data/a.csv']
+    assert recipes.is_downloaded(spec, dest)
+
+
+def test_download_extracts_zip(http_origin, tmpdir):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for i in range(10):
+            archive.writestr('part-%d.csv' % i, b'%d' % i * 1000)
+    spec = recipes.make_file_spec('z', http_origin.add_file('z.zip', buf.getvalue()),
+                                  extract=True)
+    dest = str(tmpdir.join('dest'))
+    recipes.download(spec, dest, quiet=True)
+    assert open(os.path.join(dest, 'part-7.csv'), 'rb').read() == b'7' * 1000
+    assert os.path.exists(os.path.join(dest, 'z.zip'))
+    with open(os.path.join(dest, 'z.zip.extracted')) as fp:
+        assert len(fp.read().split()) == 10
+
+
+def test_download_rejects_unsafe_tar(http_origin, tmpdir):
+    url = http_origin.add_file('bad.tar', _tar({'../evil': b'x'}, mode='w'))
+    spec = recipes.make_file_spec('bad', url)
+    dest = str(tmpdir.join('dest'))
+    with pytest.raises(ExtractError):
+        recipes.download(spec, dest, quiet=True, extract=True)
+    assert not os.path.exists(str(tmpdir.join('evil')))
+    assert os.listdir(dest) == ['bad.tar.part']
+
+
+def test_download_skips_non_archives(http_origin, tmpdir):
+    url = http_origin.add_file('a.csv', b'a,b\n')
+    dest = tmpdir.mkdir('dest')
+    recipes.download(recipes.make_file_spec('a', url), str(dest), quiet=True, extract=True,
+                     keep_archive=False)
+    assert dest.listdir() == [dest.join('a.csv')]
+    assert dest.join('a.csv').read_binary() == b'a,b\n'
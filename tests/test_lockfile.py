@@ -0,0 +1,58 @@
+import hashlib
+import os
+
+import pytest
+
+from databrewer import lockfile
+
+
+def test_freeze_and_stale(tmpdir):
+    datasets_dir = tmpdir.mkdir('datasets')
+    datasets_dir.mkdir('r').join('a.csv').write_binary(b'a')
+    cache = lockfile.HashCache(str(tmpdir.join('cache.json')))
+    specs = [
+        ('r', {'name': 'r[a]', 'url': 'http://example.com/a.csv', 'filename': 'a.csv',
+               '_file': 'r.yaml'}),
+        ('r', {'name': 'r[b]', 'url': 'http://example.com/b.csv', 'filename': 'b.csv'}),
+    ]
+    entries = lockfile.freeze(specs, str(datasets_dir), cache)
+    assert entries[0] == {'name': 'r[a]', 'url': 'http://example.com/a.csv', 'filename': 'a.csv',
+                          'path': 'r/a.csv', 'size': 1, 'sha256': hashlib.sha256(b'a').hexdigest()}
+    assert 'sha256' not in entries[1]
+
+    filename = str(tmpdir.join('databrewer.lock'))
+    lockfile.save(filename, entries)
+    entries = lockfile.load(filename)
+    assert lockfile.stale(entries, str(datasets_dir), cache) == entries[1:]
+
+    datasets_dir.join('r', 'a.csv').write_binary(b'b')
+    assert lockfile.stale(entries, str(datasets_dir), cache) == entries
+
+    # Removed once extracted.
+    datasets_dir.join('r', 'a.csv').remove()
+    datasets_dir.join('r', 'a.csv.extracted').write('a\n')
+    assert lockfile.stale(entries, str(datasets_dir), cache) == entries[1:]
+
+    for entry in ['{"path": "../escape", "filename": "escape"}',
+                  '{"path": "r/x", "filename": "../../x"}']:
+        with open(filename, 'w') as fp:
+            fp.write('{"version": 1, "files": [%s]}' % entry)
+        with pytest.raises(ValueError):
+            lockfile.load(filename)
+
+
+def test_hash_cache(tmpdir):
+    path = tmpdir.join('data.bin')
+    path.write_binary(b'one')
+    cache = lockfile.HashCache(str(tmpdir.join('cache.json')))
+    digest = cache.sha256(str(path))
+    cache.save()
+
+    # Same size and mtime, the digest is not computed again.
+    stat = os.stat(str(path))
+    path.write_binary(b'two')
+    os.utime(str(path), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    cache = lockfile.HashCache(str(tmpdir.join('cache.json')))
+    assert cache.sha256(str(path)) == digest
+    os.utime(str(path))
+    assert cache.sha256(str(path)) == hashlib.sha256(b'two').hexdigest()
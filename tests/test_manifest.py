@@ -0,0 +1,30 @@
+import os
+
+from databrewer.manifest import RecipeManifest
+
+
+def test_manifest_diff(tmpdir):
+    index_dir = str(tmpdir.mkdir('index'))
+    paths = []
+    for name in ('a', 'b', 'c'):
+        path = tmpdir.join('%s.yaml' % name)
+        path.write('name: %s\n' % name)
+        paths.append(str(path))
+
+    manifest = RecipeManifest(index_dir)
+    changed, removed = manifest.diff(paths)
+    assert [path for path, _ in changed] == paths
+    assert removed == []
+    for path, digest in changed:
+        manifest.add(path, os.path.basename(path)[0], digest)
+    manifest.save()
+
+    manifest = RecipeManifest.load(index_dir)
+    assert manifest.diff(paths) == ([], [])
+
+    # Touched files are not reported, modified files are.
+    os.utime(paths[0], (0, 0))
+    tmpdir.join('b.yaml').write('name: b\ndescription: changed\n')
+    changed, removed = manifest.diff(paths[:2])
+    assert [path for path, _ in changed] == [paths[1]]
+    assert [entry['name'] for entry in removed] == ['c']
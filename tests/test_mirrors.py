@@ -0,0 +1,124 @@
+import hashlib
+import os
+
+import pytest
+
+from databrewer import recipes, utils
+from databrewer.mirrors import MirrorRanking
+from databrewer.store import BlobStore
+
+from conftest import HTTPOrigin, RangeRequestHandler
+
+
+class _Truncated(object):
+
+    def __init__(self, fp, limit):
+        self.fp = fp
+        self.limit = limit
+
+    def write(self, data):
+        data = data[:self.limit]
+        self.limit -= len(data)
+        self.fp.write(data)
+
+    def flush(self):
+        self.fp.flush()
+
+
+class BrokenMirrorHandler(RangeRequestHandler):
+    """Stops sending the files under ``/broken/`` after 100K."""
+
+    def end_headers(self):
+        RangeRequestHandler.end_headers(self)
+        if self.path.startswith('/broken/'):
+            self.wfile = _Truncated(self.wfile, 100 * 1024)
+            self.close_connection = True
+
+
+@pytest.fixture
+def mirrors_origin(tmpdir):
+    origin = HTTPOrigin(tmpdir.mkdir('origin'), handler=BrokenMirrorHandler)
+    origin.root_dir = tmpdir.join('origin')
+    origin.start()
+    yield origin
+    origin.stop()
+
+
+def _add_mirrors(origin, data):
+    for name in ('broken', 'good'):
+        origin.root_dir.mkdir(name).join('data.bin').write_binary(data)
+    return [origin.url('broken/data.bin'), origin.url('good/data.bin')]
+
+
+def test_make_file_spec_mirrors():
+    spec = recipes.make_file_spec('a', ['http://a/x.csv', 'http://b/x.csv'],
+                                  mirrors=['http://c/x.csv'])
+    assert spec['url'] == 'http://a/x.csv'
+    assert spec['filename'] == 'x.csv'
+    assert recipes.file_urls(spec) == ['http://a/x.csv', 'http://b/x.csv', 'http://c/x.csv']
+
+
+def test_download_fails_over_and_resumes(mirrors_origin, tmpdir):
+    data = os.urandom(300 * 1024)
+    urls = _add_mirrors(mirrors_origin, data)
+    spec = recipes.make_file_spec('data', urls)
+    ranking = MirrorRanking()
+    store = BlobStore(str(tmpdir.join('store')))
+
+    recipes.download(spec, str(tmpdir.mkdir('dest')), quiet=True, ranking=ranking, store=store)
+
+    assert tmpdir.join('dest', 'data.bin').read_binary() == data
+    # The store digest covers the data of both mirrors once.
+    assert os.path.exists(store.blob_path(hashlib.sha256(data).hexdigest()))
+    method, path, headers = mirrors_origin.log[-1]
+    assert path == '/good/data.bin'
+    # Resumed from the data written before the first mirror broke.
+    assert 0 < int(headers['Range'][len('bytes='):-1]) <= 100 * 1024
+    assert 'If-Range' not in headers
+    assert ranking.hosts
+
+
+def test_download_file_resumes_from_mirror(http_origin, tmpdir):
+    data = os.urandom(200 * 1024)
+    url = http_origin.add_file('data.bin', data)
+    filename = str(tmpdir.join('data.bin.part'))
+    tmpdir.join('data.bin.part').write_binary(data[:1000])
+    with open(filename + '.resume', 'w') as fp:
+        fp.write('{"url": "http://mirror/data.bin", "total": %d, "etag": "\\"other\\""}'
+                 % len(data))
+
+    utils.download_file(url, filename, mirrors=['http://mirror/data.bin'])
+
+    assert tmpdir.join('data.bin.part').read_binary() == data
+    assert http_origin.log[-1][2]['Range'] == 'bytes=1000-'
+
+
+def test_mirror_ranking(tmpdir):
+    filename = str(tmpdir.join('mirrors.json'))
+    ranking = MirrorRanking(filename)
+    fast, slow, unknown = 'http://fast/x', 'http://slow/x', 'ftp://other/x'
+    ranking.record(fast, 10 * 1024 * 1024, 1)
+    ranking.record(slow, 1024 * 1024, 1)
+    ranking.save()
+
+    ranking = MirrorRanking(filename)
+    assert ranking.rank([unknown, slow, fast]) == [fast, slow, unknown]
+    for _ in range(20):
+        ranking.fail(fast)
+    assert ranking.rank([fast, slow]) == [slow, fast]
+
+
+def test_download_retries_mirrors(mirrors_origin, tmpdir):
+    data = os.urandom(250 * 1024)
+    broken = mirrors_origin.root_dir.mkdir('broken')
+    broken.join('data.bin').write_binary(data)
+    broken.mkdir('copy').join('data.bin').write_binary(data)
+    spec = recipes.make_file_spec('data', [mirrors_origin.url('broken/data.bin'),
+                                           mirrors_origin.url('broken/copy/data.bin')])
+
+    with pytest.raises(IOError):
+        recipes.download(spec, str(tmpdir.mkdir('failed')), quiet=True)
+
+    # Each round resumes from where the previous mirror broke.
+    recipes.download(spec, str(tmpdir.mkdir('dest')), quiet=True, retries=1, backoff=0)
+    assert tmpdir.join('dest', 'data.bin').read_binary() == data
@@ -0,0 +1,102 @@
+import hashlib
+import os
+
+import pytest
+import requests
+
+from databrewer import recipes
+from databrewer.scheduler import Scheduler
+from databrewer.utils import ChecksumError
+
+
+def test_download_many(http_origin, tmpdir):
+    blobs = {'part-%d.bin' % i: os.urandom(1000 + i) for i in range(10)}
+    specs = [
+        recipes.make_file_spec(name='dataset[%s]' % name, url=http_origin.add_file(name, data))
+        for name, data in blobs.items()
+    ]
+    dest_dir = str(tmpdir.join('dest'))
+
+    downloads = [(spec, dest_dir) for spec in specs]
+    results = list(recipes.download_many(downloads, Scheduler(workers=4), quiet=True))
+
+    assert sorted(spec['filename'] for spec, _ in results) == sorted(blobs)
+    assert all(error is None for _, error in results)
+    for name, data in blobs.items():
+        assert tmpdir.join('dest', name).read_binary() == data
+
+
+def test_download_many_reports_errors(http_origin, tmpdir):
+    ok_url = http_origin.add_file('ok.bin', b'data')
+    specs = [
+        recipes.make_file_spec(name='dataset[ok]', url=ok_url),
+        recipes.make_file_spec(name='dataset[bad]', url='mailto:nobody/bad.bin'),
+        recipes.make_file_spec(name='dataset[missing]', url=http_origin.url('missing.bin')),
+    ]
+    downloads = [(spec, str(tmpdir)) for spec in specs]
+    results = dict((spec['name'], error) for spec, error in
+                   recipes.download_many(downloads, Scheduler(workers=2), quiet=True))
+    assert results['dataset[ok]'] is None
+    assert isinstance(results['dataset[bad]'], ValueError)
+    assert isinstance(results['dataset[missing]'], requests.HTTPError)
+    assert not tmpdir.join('missing.bin').exists()
+
+
+def test_download_verifies_checksum(http_origin, tmpdir):
+    data = os.urandom(1000)
+    spec = recipes.make_file_spec(name='dataset', url=http_origin.add_file('data.bin', data),
+                                  sha256=hashlib.sha256(data).hexdigest())
+    dest_dir = str(tmpdir)
+
+    recipes.download(spec, dest_dir, quiet=True)
+
+    filename = str(tmpdir.join('data.bin'))
+    assert tmpdir.join('data.bin.sha256').read() == '%s  data.bin\n' % spec['sha256']
+    assert recipes.is_verified(spec, filename)
+    assert not recipes.is_verified(dict(spec, sha256='0' * 64), filename)
+
+
+def test_download_checksum_mismatch(http_origin, tmpdir):
+    spec = recipes.make_file_spec(name='dataset', url=http_origin.add_file('data.bin', b'data'),
+                                  md5='0' * 32)
+
+    dest_dir = tmpdir.join('dest')
+
+    with pytest.raises(ChecksumError):
+        recipes.download(spec, str(dest_dir), quiet=True)
+
+    assert dest_dir.listdir() == []
+
+
+def test_load_all(tmpdir):
+    filenames = []
+    for i in range(50):
+        path = tmpdir.join('r%02d.yaml' % i)
+        path.write('name: r%02d\ndescription: Recipe %d\n' % (i, i))
+        filenames.append(str(path))
+    tmpdir.join('bad.yaml').write('name: [bad\n')
+    tmpdir.join('noname.yaml').write('description: no name\n')
+    filenames[10:10] = [str(tmpdir.join('bad.yaml')), str(tmpdir.join('noname.yaml'))]
+
+    results = list(recipes.load_all(filenames, jobs=2, batch_size=4, max_pending=2))
+
+    assert [filename for filename, _, _ in results] == filenames
+    errors = {filename: error for filename, recipe, error in results if error}
+    assert sorted(errors) == sorted(filenames[10:12])
+    assert 'required' in errors[str(tmpdir.join('noname.yaml'))]
+    recipe = results[0][1]
+    assert recipe == {'name': 'r00', 'description': 'Recipe 0', '_file': filenames[0]}
+
+
+def test_summarize():
+    recipe = {'name': 'r', 'description': 'R', 'files': [
+        {'name': 'a', 'url': 'http://example.com/a.csv', 'size': 10},
+        {'name': 'b', 'files': [
+            {'name': 'c', 'url': 'http://example.com/c.csv', 'size': 5},
+            {'name': 'd', 'url': 'http://example.com/d.csv'},
+        ]},
+    ]}
+    assert recipes.summarize(recipe) == {
+        'name': 'r', 'description': 'R', 'file_count': 3, 'total_size': 15}
+    assert recipes.summarize(recipe, recipes.iter_files(recipe))['file_count'] == 3
+    assert recipes.summarize({'name': 'r'})['file_count'] == 0
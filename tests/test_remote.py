@@ -0,0 +1,27 @@
+from databrewer import remote
+
+
+def test_probe_all_uses_cache(http_origin, tmpdir):
+    url = http_origin.add_file('data.bin', b'x' * 100)
+    missing_url = http_origin.url('missing.bin')
+    cache_file = str(tmpdir.join('cache.json'))
+
+    metas = remote.probe_all([url, missing_url], jobs=2, cache=remote.MetadataCache(cache_file))
+
+    assert metas[url]['status'] == 200
+    assert metas[url]['length'] == 100
+    assert metas[missing_url]['status'] == 404
+    assert len(http_origin.log) == 2
+
+    metas = remote.probe_all([url], cache=remote.MetadataCache(cache_file))
+    assert metas[url]['length'] == 100
+    assert len(http_origin.log) == 2
+
+    remote.probe_all([url], cache=remote.MetadataCache(cache_file, ttl=0))
+    assert len(http_origin.log) == 3
+
+
+def test_probe_failure():
+    meta = remote.probe('http://127.0.0.1:1/data.bin')
+    assert meta['status'] is None
+    assert meta['error']
@@ -0,0 +1,84 @@
+import threading
+import time
+
+from databrewer import recipes
+from databrewer.scheduler import Cancelled, Scheduler, TokenBucket
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=1000)
+    started = time.monotonic()
+    bucket.consume(1000)
+    assert time.monotonic() - started < 0.1
+    bucket.consume(300)
+    assert time.monotonic() - started >= 0.25
+
+
+def test_scheduler_order():
+    scheduler = Scheduler(workers=1)
+    order = []
+    for group in ('a', 'b'):
+        for i in range(3):
+            scheduler.add('%s%d' % (group, i), order.append, group=group)
+    scheduler.add('urgent', order.append, group='b', priority=-1)
+    results = list(scheduler.run())
+    assert all(error is None for _, error in results)
+    assert order == ['urgent', 'a0', 'b0', 'a1', 'b1', 'a2', 'b2']
+
+
+def test_scheduler_per_host_limit():
+    scheduler = Scheduler(workers=6, per_host=2)
+    lock = threading.Lock()
+    running = {'x': 0, 'y': 0}
+    peak = {'x': 0, 'y': 0}
+
+    def job(host):
+        with lock:
+            running[host] += 1
+            peak[host] = max(peak[host], running[host])
+        time.sleep(0.02)
+        with lock:
+            running[host] -= 1
+        if host == 'y':
+            raise ValueError(host)
+
+    for i in range(6):
+        scheduler.add('x', job, host='x')
+        scheduler.add('y', job, host='y')
+    errors = [error for _, error in scheduler.run()]
+    assert peak == {'x': 2, 'y': 2}
+    assert sum(1 for error in errors if isinstance(error, ValueError)) == 6
+
+
+def test_download_many_accounts_bytes(http_origin, tmpdir):
+    url = http_origin.add_file('a.bin', b'x' * 100000)
+    scheduler = Scheduler(workers=2, per_host=1, rate=10 ** 9)
+    downloads = [(recipes.make_file_spec('a', url), str(tmpdir.join(d))) for d in 'pq']
+    results = list(recipes.download_many(downloads, scheduler, quiet=True))
+    assert [error for _, error in results] == [None, None]
+    assert scheduler.bytes == 200000
+    assert scheduler.throughput() > 0
+
+
+def test_scheduler_cancels_running_jobs():
+    scheduler = Scheduler(workers=4, rate=1000)
+    errors = []
+
+    def job(item):
+        try:
+            while True:
+                scheduler.throttle(100)
+        except Cancelled as e:
+            errors.append(e)
+            raise
+
+    scheduler.add('quick', lambda item: None, priority=-1)
+    for i in range(3):
+        scheduler.add(i, job)
+    started = time.monotonic()
+    results = scheduler.run()
+    assert next(results) == ('quick', None)
+    # As when the caller is interrupted.
+    results.close()
+    assert time.monotonic() - started < 2
+    assert len(errors) == 3
@@ -0,0 +1,66 @@
+import pytest
+
+from databrewer.search import OutdatedIndexError, SearchIndex
+
+
+def test_search_index(tmpdir):
+    index_dir = str(tmpdir)
+    with SearchIndex(index_dir) as index:
+        assert index.index.is_empty()
+        index.update([
+            {'name': 'nyc-taxi', 'description': 'NYC taxi trips', 'keywords': ['transport']},
+            {'name': 'iris', 'description': 'Iris flowers'},
+        ])
+        assert not index.index.is_empty()
+        assert index.get('iris')['description'] == 'Iris flowers'
+        assert [r['name'] for r in index.search('taxi')] == ['nyc-taxi']
+        assert [r['name'] for r in index.search('transport')] == ['nyc-taxi']
+        assert sorted(r['name'] for r in index.list()) == ['iris', 'nyc-taxi']
+        assert index.get('nyc-taxi', fields=('name', 'keywords', 'file_count')) == {
+            'name': 'nyc-taxi', 'keywords': ['transport'], 'file_count': 0}
+
+
+def test_search_index_outdated_schema(tmpdir):
+    from whoosh.fields import Schema, ID
+
+    index_dir = str(tmpdir)
+    SearchIndex(index_dir, schema=Schema(id=ID(stored=True), data=ID(stored=True))).close()
+    with pytest.raises(OutdatedIndexError):
+        SearchIndex(index_dir)
+    SearchIndex(index_dir, force_create=True).close()
+    SearchIndex(index_dir).close()
+
+
+def test_search_index_reuses_searcher(tmpdir):
+    index_dir = str(tmpdir)
+    with SearchIndex(index_dir) as index:
+        index.update([{'name': 'iris', 'description': 'Iris flowers'}])
+        searcher = index.searcher
+        assert index.get('iris')
+        assert index.searcher is searcher
+
+        # Changes made by another writer are picked up.
+        with SearchIndex(index_dir) as other:
+            updated, deleted = other.update([{'name': 'wine'}], deleted=['iris'])
+        assert (updated, deleted) == (1, 1)
+        assert index.get('wine') == {'name': 'wine'}
+        assert index.get('iris') is None
+        assert index.searcher is not searcher
+    assert index._searcher is None
+
+
+def test_search_pages_and_fields(tmpdir):
+    with SearchIndex(str(tmpdir)) as index:
+        index.update([{'name': 'taxi-%02d' % i, 'description': 'Taxi trips %d' % i,
+                       'files': [{'name': 'f', 'url': 'http://example.com/f.csv'}]}
+                      for i in range(25)])
+        everything = [r['name'] for r in index.search('taxi', limit=None)]
+        assert len(everything) == 25
+        assert [r['name'] for r in index.search('taxi', limit=10)] == everything[:10]
+        assert [r['name'] for r in index.search('taxi', limit=10, offset=20)] == everything[20:]
+        assert list(index.search('taxi', offset=30)) == []
+
+        hit = next(index.search('taxi', fields=('name', 'description')))
+        assert sorted(hit) == ['description', 'name']
+        hit = next(index.search('taxi', fields=('name', 'files')))
+        assert hit['files'] == [{'name': 'f', 'url': 'http://example.com/f.csv'}]
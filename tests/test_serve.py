@@ -0,0 +1,65 @@
+import os
+import threading
+
+import pytest
+import requests
+
+from databrewer import recipes
+from databrewer.serve import DatasetServer
+
+
+@pytest.fixture
+def peer(tmpdir):
+    root = tmpdir.mkdir('peer')
+    server = DatasetServer(str(root.mkdir('datasets')), str(root.mkdir('index')),
+                           ('127.0.0.1', 0))
+    server.root = root
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_serve_files(peer):
+    data = os.urandom(100 * 1024)
+    dataset_dir = peer.root.join('datasets').mkdir('demo')
+    dataset_dir.join('data.bin').write_binary(data)
+    dataset_dir.join('other.bin.part').write_binary(data)
+    peer.root.join('index', 'catalog.bin').write_binary(b'catalog')
+    url = peer.url() + '/datasets/demo/data.bin'
+
+    assert requests.get(url).content == data
+    resp = requests.get(url, headers={'Range': 'bytes=1000-'})
+    assert resp.status_code == 206
+    assert resp.headers['Content-Range'] == 'bytes 1000-%d/%d' % (len(data) - 1, len(data))
+    assert resp.content == data[1000:]
+    resp = requests.get(url, headers={'Range': 'bytes=1000-', 'If-Range': '"old"'})
+    assert resp.status_code == 200
+    assert requests.get(url, headers={'Range': 'bytes=%d-' % len(data)}).status_code == 416
+
+    for path in ('/datasets/demo/other.bin.part', '/datasets/demo/%2e%2e/%2e%2e/peer',
+                 '/datasets/%2e%2e/peer/index/catalog.bin', '/other/data.bin'):
+        assert requests.get(peer.url() + path).status_code == 404
+
+    assert requests.get(peer.url() + '/index/').json() == {
+        'files': [{'name': 'catalog.bin', 'size': 7}]}
+    assert requests.get(peer.url() + '/index/catalog.bin').content == b'catalog'
+
+
+def test_download_from_peer(peer, http_origin, tmpdir):
+    data = os.urandom(100 * 1024)
+    url = http_origin.add_file('data.bin', data)
+    spec = recipes.make_file_spec('demo[data]', url)
+    peer.root.join('datasets').mkdir('demo').join('data.bin').write_binary(data)
+
+    recipes.download(spec, str(tmpdir.mkdir('first')), quiet=True, peers=[peer.url()])
+    assert tmpdir.join('first', 'data.bin').read_binary() == data
+    assert not http_origin.log
+
+    # Falls back to the origin when the peer does not have the file.
+    peer.root.join('datasets', 'demo', 'data.bin').remove()
+    recipes.download(spec, str(tmpdir.mkdir('second')), quiet=True, peers=[peer.url()])
+    assert tmpdir.join('second', 'data.bin').read_binary() == data
+    assert [path for _, path, _ in http_origin.log] == ['/data.bin']
@@ -0,0 +1,83 @@
+"""Cold start budget of the CLI commands.
+
+Each command runs in a fresh interpreter with ``-X importtime``. The time
+spent importing modules, excluding the ones imported by the bare interpreter,
+must stay within the command budget. Set ``DATABREWER_STARTUP_BUDGET_FACTOR``
+to scale the budgets on slow machines.
+"""
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+from databrewer.catalog import CatalogWriter, FileTableWriter
+from databrewer.recipes import summarize
+
+
+# Modules only some commands need.
+HEAVY_MODULES = ('requests', 'whoosh', 'tqdm', 'jsonschema', 'yaml', 'toolz', 'zipfile')
+
+# Command, modules it may import and import time budget in milliseconds.
+COMMANDS = [
+    (['--help'], (), 100),
+    (['config', 'show'], ('yaml',), 150),
+    (['list'], (), 100),
+    (['files', 'demo'], (), 100),
+    (['info', 'demo'], ('tqdm',), 180),
+]
+
+SCRIPT = """
+import sys
+from databrewer.cli import main
+try:
+    main(sys.argv[1:])
+except SystemExit:
+    pass
+print(' '.join(sorted(sys.modules)))
+"""
+
+
+def _run(args, env):
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c'] + args,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          env=env, universal_newlines=True, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+\d+ \|\s+(\S+)$', line)
+        if match:
+            times[match.group(2).strip()] = int(match.group(1))
+    return proc.stdout, times
+
+
+@pytest.fixture(scope='module')
+def env(tmpdir_factory):
+    home = tmpdir_factory.mktemp('home')
+    index_dir = home.mkdir('.databrewer').mkdir('index')
+    recipe = {'name': 'demo', 'description': 'Demo', 'url': 'http://example.com/demo.csv'}
+    writer = CatalogWriter(str(index_dir))
+    writer.add(summarize(recipe))
+    writer.commit()
+    writer = FileTableWriter(str(index_dir))
+    writer.add(recipe)
+    writer.commit()
+    env = dict(os.environ, HOME=str(home), COLUMNS='80')
+    env.pop('DATABREWERRC', None)
+    return env
+
+
+@pytest.mark.parametrize('command,allowed,budget', COMMANDS)
+def test_command_startup(env, command, allowed, budget):
+    _, baseline = _run(['pass'], env)
+    stdout, times = _run([SCRIPT] + command, env)
+    modules = set(stdout.splitlines()[-1].split())
+
+    unexpected = [name for name in HEAVY_MODULES
+                  if name in modules and name not in allowed and name not in baseline]
+    assert not unexpected, "%s imports %s" % (' '.join(command), ', '.join(unexpected))
+
+    factor = float(os.getenv('DATABREWER_STARTUP_BUDGET_FACTOR', 1))
+    elapsed = sum(t for name, t in times.items() if name not in baseline) / 1000.
+    assert elapsed <= budget * factor, "%s took %.1fms to import, budget is %dms" % (
+        ' '.join(command), elapsed, budget * factor)
@@ -0,0 +1,120 @@
+import gzip
+import hashlib
+import os
+
+import pytest
+
+from databrewer import recipes
+from databrewer.store import BlobStore
+
+
+def _gets(origin):
+    return [path for command, path, _ in origin.log if command == 'GET']
+
+
+def test_download_with_store(http_origin, tmpdir):
+    store = BlobStore(str(tmpdir.join('store')))
+    data = b'shared data'
+    digest = hashlib.sha256(data).hexdigest()
+    url = http_origin.add_file('a.csv', data)
+    first, second = str(tmpdir.join('first')), str(tmpdir.join('second'))
+
+    recipes.download(recipes.make_file_spec('a', url), first, quiet=True, store=store)
+    recipes.download(recipes.make_file_spec('b', url), second, quiet=True, store=store)
+    assert _gets(http_origin) == ['/a.csv']
+    blob = store.blob_path(digest)
+    assert os.path.samefile(blob, os.path.join(first, 'a.csv'))
+    assert os.path.samefile(blob, os.path.join(second, 'a.csv'))
+
+    # Another url with a known digest is not downloaded either.
+    other = http_origin.add_file('copy.csv', data)
+    spec = recipes.make_file_spec('c', other, sha256=digest)
+    recipes.download(spec, second, quiet=True, store=store)
+    assert _gets(http_origin) == ['/a.csv']
+    assert recipes.is_verified(spec, os.path.join(second, 'copy.csv'))
+
+
+@pytest.mark.parametrize('link_mode', ['hardlink', 'symlink'])
+def test_store_extracts_stored_archive(http_origin, tmpdir, link_mode):
+    store = BlobStore(str(tmpdir.join('store')), link_mode=link_mode)
+    url = http_origin.add_file('a.csv.gz', gzip.compress(b'a,b\n'))
+    for name in ('first', 'second'):
+        dest = str(tmpdir.join(name))
+        recipes.download(recipes.make_file_spec('a', url), dest, quiet=True, store=store,
+                         extract=True)
+        assert open(os.path.join(dest, 'a.csv'), 'rb').read() == b'a,b\n'
+        assert os.path.islink(os.path.join(dest, 'a.csv.gz')) == (link_mode == 'symlink')
+    assert _gets(http_origin) == ['/a.csv.gz']
+
+
+def test_force_download_with_store(http_origin, tmpdir):
+    store = BlobStore(str(tmpdir.join('store')))
+    url = http_origin.add_file('a.csv', b'old data')
+    spec = recipes.make_file_spec('a', url)
+    dest = str(tmpdir.join('dest'))
+    recipes.download(spec, dest, quiet=True, store=store)
+
+    # Unchanged at the origin, the stored file is linked again.
+    recipes.download(spec, dest, quiet=True, store=store, force=True)
+    assert _gets(http_origin) == ['/a.csv']
+    assert http_origin.log[-1][0] == 'HEAD'
+
+    http_origin.add_file('a.csv', b'new data, changed')
+    recipes.download(spec, dest, quiet=True, store=store)
+    assert open(os.path.join(dest, 'a.csv'), 'rb').read() == b'old data'
+    recipes.download(spec, dest, quiet=True, store=store, force=True)
+    assert open(os.path.join(dest, 'a.csv'), 'rb').read() == b'new data, changed'
+    assert store.find(spec) == store.blob_path(hashlib.sha256(b'new data, changed').hexdigest())
+
+
+@pytest.mark.parametrize('link_mode', ['hardlink', 'symlink'])
+def test_link_again(tmpdir, link_mode):
+    store = BlobStore(str(tmpdir.join('store')), link_mode=link_mode)
+    tmpdir.join('data.part').write_binary(b'data')
+    path = store.add({'url': 'http://example.com/data'}, str(tmpdir.join('data.part')),
+                     hashlib.sha256(b'data').hexdigest())
+    dest = tmpdir.mkdir('dest')
+    for _ in range(2):
+        store.link(path, str(dest.join('data')))
+    assert dest.listdir() == [dest.join('data')]
+    assert os.path.samefile(path, str(dest.join('data')))
+
+
+def test_lock_across_processes(tmpdir):
+    fcntl = pytest.importorskip('fcntl')
+    spec = {'url': 'http://example.com/data'}
+    store = BlobStore(str(tmpdir.join('store')))
+    with store.lock(spec):
+        lock_path = store.part_path(spec)[:-len('.part')] + '.lock'
+        # Another open file, as in another process.
+        with open(lock_path, 'a') as fp:
+            with pytest.raises(BlockingIOError):
+                fcntl.flock(fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    with open(lock_path, 'a') as fp:
+        fcntl.flock(fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+def test_store_restarts_sinks_when_origin_changes(http_origin, tmpdir):
+    store = BlobStore(str(tmpdir.join('store')))
+    old, new = os.urandom(2 * 1024 * 1024), os.urandom(2 * 1024 * 1024 + 1)
+    url = http_origin.add_file('a.bin.gz', gzip.compress(old, 1))
+    changed = gzip.compress(new, 1)
+    http_origin.handler.fail_after = 1024 * 1024
+
+    def reporthook(block_number, block_size, total_size):
+        if block_number and http_origin.handler.fail_after:
+            # Replaced while the first response is sent, which is then cut.
+            http_origin.handler.fail_after = None
+            http_origin.add_file('a.bin.gz.tmp', changed)
+            os.replace(os.path.join(http_origin.root, 'a.bin.gz.tmp'),
+                       os.path.join(http_origin.root, 'a.bin.gz'))
+
+    dest = str(tmpdir.join('dest'))
+    spec = recipes.make_file_spec('a', url)
+    recipes.download(spec, dest, quiet=True, store=store, extract=True, retries=1, backoff=0,
+                     reporthook=reporthook)
+
+    assert len(_gets(http_origin)) == 3
+    assert open(os.path.join(dest, 'a.bin'), 'rb').read() == new
+    assert store.find(spec) == store.blob_path(hashlib.sha256(changed).hexdigest())
+    assert open(store.find(spec), 'rb').read() == changed
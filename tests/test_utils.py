@@ -0,0 +1,304 @@
+import hashlib
+import json
+import os
+import socket
+import time
+
+import pytest
+import requests
+
+from databrewer import utils
+
+from conftest import HTTPOrigin, RangeRequestHandler
+
+
+def _write_resume_info(filename, url, total, etag=None, last_modified=None):
+    with open(filename + '.resume', 'w') as fp:
+        json.dump({'url': url, 'total': total, 'etag': etag,
+                   'last_modified': last_modified}, fp)
+
+
+def test_download_file(http_origin, tmpdir):
+    data = os.urandom(200 * 1024)
+    url = http_origin.add_file('data.bin', data)
+    filename = str(tmpdir.join('data.bin'))
+    utils.download_file(url, filename)
+    assert tmpdir.join('data.bin').read_binary() == data
+    assert not os.path.exists(filename + '.resume')
+
+
+def test_download_file_resumes_partial_file(http_origin, tmpdir):
+    data = os.urandom(200 * 1024)
+    url = http_origin.add_file('data.bin', data)
+    headers = requests.head(url).headers
+    filename = str(tmpdir.join('data.bin.part'))
+    tmpdir.join('data.bin.part').write_binary(data[:1000])
+    _write_resume_info(filename, url, len(data), etag=headers['etag'])
+
+    utils.download_file(url, filename)
+
+    assert tmpdir.join('data.bin.part').read_binary() == data
+    method, _, request_headers = http_origin.log[-1]
+    assert request_headers['Range'] == 'bytes=1000-'
+    assert not os.path.exists(filename + '.resume')
+
+
+def test_download_file_restarts_when_file_changed(http_origin, tmpdir):
+    data = os.urandom(200 * 1024)
+    url = http_origin.add_file('data.bin', data)
+    filename = str(tmpdir.join('data.bin.part'))
+    tmpdir.join('data.bin.part').write_binary(b'x' * 1000)
+    _write_resume_info(filename, url, len(data), etag='"old-version"')
+
+    utils.download_file(url, filename)
+
+    assert tmpdir.join('data.bin.part').read_binary() == data
+
+
+def test_download_file_restarts_without_range_support(http_origin, tmpdir):
+    http_origin.handler.accept_ranges = False
+    data = os.urandom(200 * 1024)
+    url = http_origin.add_file('data.bin', data)
+    filename = str(tmpdir.join('data.bin.part'))
+    tmpdir.join('data.bin.part').write_binary(b'x' * 1000)
+    _write_resume_info(filename, url, len(data), etag='"any"')
+
+    utils.download_file(url, filename)
+
+    assert tmpdir.join('data.bin.part').read_binary() == data
+
+
+def test_download_file_segmented(http_origin, tmpdir):
+    data = os.urandom(3 * 1024 * 1024 + 17)
+    url = http_origin.add_file('data.bin', data)
+    filename = str(tmpdir.join('data.bin'))
+
+    utils.download_file(url, filename, segments=4)
+
+    assert tmpdir.join('data.bin').read_binary() == data
+    ranges = [headers['Range'] for method, _, headers in http_origin.log if method == 'GET']
+    assert len(ranges) == 4
+    assert not os.path.exists(filename + '.resume')
+
+
+def test_download_file_segmented_resumes_ranges(http_origin, tmpdir):
+    data = os.urandom(4 * 1024 * 1024)
+    url = http_origin.add_file('data.bin', data)
+    headers = requests.head(url).headers
+    filename = str(tmpdir.join('data.bin.part'))
+    partial = bytearray(len(data))
+    partial[:1000] = data[:1000]
+    partial[2 * 1024 * 1024:2 * 1024 * 1024 + 10] = data[2 * 1024 * 1024:2 * 1024 * 1024 + 10]
+    tmpdir.join('data.bin.part').write_binary(bytes(partial))
+    with open(filename + '.resume', 'w') as fp:
+        json.dump({'url': url, 'total': len(data), 'etag': headers['etag'],
+                   'last_modified': headers['last-modified'],
+                   'segments': [[0, 1000, 2 * 1024 * 1024],
+                                [2 * 1024 * 1024, 2 * 1024 * 1024 + 10, len(data)]]}, fp)
+
+    utils.download_file(url, filename, segments=2)
+
+    assert tmpdir.join('data.bin.part').read_binary() == data
+    ranges = sorted(headers['Range'] for method, _, headers in http_origin.log if method == 'GET')
+    assert ranges == ['bytes=1000-2097151', 'bytes=2097162-4194303']
+
+
+def test_download_file_segmented_without_range_support(http_origin, tmpdir):
+    http_origin.handler.accept_ranges = False
+    data = os.urandom(3 * 1024 * 1024)
+    url = http_origin.add_file('data.bin', data)
+    filename = str(tmpdir.join('data.bin'))
+
+    utils.download_file(url, filename, segments=4)
+
+    assert tmpdir.join('data.bin').read_binary() == data
+    assert len([method for method, _, _ in http_origin.log if method == 'GET']) == 1
+
+
+def test_download_file_checksum_covers_resumed_data(http_origin, tmpdir):
+    data = os.urandom(200 * 1024)
+    url = http_origin.add_file('data.bin', data)
+    headers = requests.head(url).headers
+    filename = str(tmpdir.join('data.bin.part'))
+    tmpdir.join('data.bin.part').write_binary(data[:1000])
+    _write_resume_info(filename, url, len(data), etag=headers['etag'])
+
+    utils.download_file(url, filename, checksum=('sha256', hashlib.sha256(data).hexdigest()))
+
+
+def test_download_file_segmented_checksum(http_origin, tmpdir):
+    data = os.urandom(3 * 1024 * 1024)
+    url = http_origin.add_file('data.bin', data)
+    filename = str(tmpdir.join('data.bin'))
+
+    with pytest.raises(utils.ChecksumError):
+        utils.download_file(url, filename, segments=3, checksum=('md5', '0' * 32))
+    utils.download_file(url, filename, segments=3, checksum=('md5', hashlib.md5(data).hexdigest()))
+
+
+def test_download_file_detects_truncated_response(http_origin, tmpdir):
+    data = os.urandom(3 * 1024 * 1024)
+    url = http_origin.add_file('data.bin', data)
+    filename = str(tmpdir.join('data.bin.part'))
+    http_origin.handler.fail_after = 1024 * 1024
+
+    with pytest.raises(IOError):
+        utils.download_file(url, filename)
+    # The space reserved for the rest is released.
+    assert os.path.getsize(filename) == 1024 * 1024
+
+    http_origin.handler.fail_after = None
+    utils.download_file(url, filename)
+    assert tmpdir.join('data.bin.part').read_binary() == data
+    assert http_origin.log[-1][2]['Range'] == 'bytes=%d-' % (1024 * 1024)
+
+
+def test_download_file_restarts_preallocated_file(http_origin, tmpdir):
+    data = os.urandom(2 * 1024 * 1024)
+    url = http_origin.add_file('data.bin', data)
+    headers = requests.head(url).headers
+    filename = str(tmpdir.join('data.bin.part'))
+    # Left by a process killed while downloading.
+    tmpdir.join('data.bin.part').write_binary(data[:1000] + bytes(len(data) - 1000))
+    with open(filename + '.resume', 'w') as fp:
+        json.dump({'url': url, 'total': len(data), 'etag': headers['etag'],
+                   'preallocated': True}, fp)
+
+    utils.download_file(url, filename)
+
+    assert tmpdir.join('data.bin.part').read_binary() == data
+    assert 'Range' not in http_origin.log[-1][2]
+
+
+def test_download_file_reports_progress_by_time(http_origin, tmpdir):
+    data = os.urandom(3 * 1024 * 1024)
+    url = http_origin.add_file('data.bin', data)
+    calls = []
+
+    utils.download_file(url, str(tmpdir.join('data.bin')),
+                        reporthook=lambda *args: calls.append(args))
+
+    assert calls[0] == (0, utils.MIN_BUFFER_SIZE, len(data))
+    assert sum(size for block, size, _ in calls[1:]) == len(data)
+    assert len(calls) < 10
+
+
+class _Trickle(object):
+
+    def __init__(self, fp):
+        self.fp = fp
+
+    def write(self, data):
+        for i in range(0, len(data), 1024):
+            self.fp.write(data[i:i + 1024])
+            self.fp.flush()
+            time.sleep(0.1)
+
+    def flush(self):
+        self.fp.flush()
+
+    @property
+    def closed(self):
+        return self.fp.closed
+
+
+class FlakyHandler(RangeRequestHandler):
+    """Answers with the statuses in ``server.statuses`` first, trickles ``/slow/``."""
+
+    def _send(self, head):
+        if self.server.statuses:
+            self.server.log.append((self.command, self.path, dict(self.headers)))
+            self.send_error(self.server.statuses.pop(0))
+            return
+        RangeRequestHandler._send(self, head)
+
+    def end_headers(self):
+        RangeRequestHandler.end_headers(self)
+        if self.path.startswith('/slow/'):
+            self.wfile = _Trickle(self.wfile)
+            self.close_connection = True
+
+
+@pytest.fixture
+def flaky_origin(tmpdir):
+    origin = HTTPOrigin(tmpdir.mkdir('origin'), handler=FlakyHandler)
+    origin.server.statuses = []
+    origin.start()
+    yield origin
+    origin.stop()
+
+
+def test_download_file_retries_and_resumes(http_origin, tmpdir):
+    data = os.urandom(3 * 1024 * 1024)
+    url = http_origin.add_file('data.bin', data)
+    filename = str(tmpdir.join('data.bin.part'))
+    http_origin.handler.fail_after = 1024 * 1024
+    hasher = hashlib.sha256()
+
+    class Sink(object):
+        def update(self, chunk):
+            # Only the first response is cut.
+            http_origin.handler.fail_after = None
+            hasher.update(chunk)
+
+    utils.download_file(url, filename, sinks=[Sink()], retries=1, backoff=0,
+                        checksum=('sha256', hashlib.sha256(data).hexdigest()))
+
+    assert tmpdir.join('data.bin.part').read_binary() == data
+    assert hasher.hexdigest() == hashlib.sha256(data).hexdigest()
+    assert len(http_origin.log) == 2
+    assert http_origin.log[-1][2]['Range'] == 'bytes=%d-' % (1024 * 1024)
+
+
+def test_download_file_retries_server_errors(flaky_origin, tmpdir):
+    url = flaky_origin.add_file('data.bin', b'data')
+    filename = str(tmpdir.join('data.bin'))
+    flaky_origin.server.statuses = [503, 429]
+    utils.download_file(url, filename, retries=2, backoff=0)
+    assert tmpdir.join('data.bin').read_binary() == b'data'
+    assert len(flaky_origin.log) == 3
+
+    # Client errors are not retried.
+    with pytest.raises(requests.HTTPError):
+        utils.download_file(flaky_origin.url('missing.bin'), filename, retries=2, backoff=0)
+    assert len(flaky_origin.log) == 4
+
+
+def test_download_file_aborts_low_speed(flaky_origin, tmpdir):
+    os.mkdir(os.path.join(flaky_origin.root, 'slow'))
+    url = flaky_origin.add_file('slow/data.bin', os.urandom(1024 * 1024))
+    start = time.monotonic()
+    with pytest.raises(IOError, match='slower'):
+        utils.download_file(url, str(tmpdir.join('data.bin')), low_speed=(100 * 1024, 1))
+    assert time.monotonic() - start < 5
+
+
+def test_pooled_session_timeout():
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    with server:
+        session = utils.pooled_session(timeout=(1, 0.2))
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            session.get('http://127.0.0.1:%d/' % server.getsockname()[1])
+
+
+def test_parse_size():
+    assert utils.parse_size(512) == 512
+    assert utils.parse_size('64k') == 64 * 1024
+    assert utils.parse_size('1.5M') == 1536 * 1024
+    with pytest.raises(ValueError):
+        utils.parse_size('fast')
+    with pytest.raises(ValueError):
+        utils.parse_size('-1')
+
+
+def test_json_helpers(tmpdir):
+    filename = str(tmpdir.join('cache.json'))
+    assert utils.load_json(filename, 'cache', {}) == {}
+    utils.write_json(filename, {'a': 1})
+    assert utils.load_json(filename, 'cache') == {'a': 1}
+    assert os.listdir(str(tmpdir)) == ['cache.json']
+    with open(filename, 'w') as fp:
+        fp.write('{')
+    assert utils.load_json(filename, 'cache', {}) == {}